@@ -0,0 +1,228 @@
+# 导入os模块，用于读取环境变量
+import os
+# 导入time模块，用于TTL过期判断
+import time
+# 导入threading模块，保证缓存读写的线程安全
+import threading
+# 导入有序字典，用于LRU淘汰
+from collections import OrderedDict
+# 导入类型注解
+from typing import Dict, Iterable, List, Optional, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于批量计算余弦距离
+import numpy as np
+
+# 导入数据库相关的函数
+import db
+
+logger = logging.getLogger(__name__)
+
+# 是否启用语义答案缓存，设置环境变量 RAG_ANSWER_CACHE=1 开启
+ANSWER_CACHE_ENABLED = os.getenv("RAG_ANSWER_CACHE", "0") == "1"
+# 命中缓存允许的最大余弦距离（1 - 余弦相似度）
+DEFAULT_MAX_DISTANCE = float(os.getenv("RAG_ANSWER_CACHE_MAX_DISTANCE", "0.05"))
+# 缓存条目的有效期（秒），小于等于0表示永不过期
+DEFAULT_TTL_SECONDS = float(os.getenv("RAG_ANSWER_CACHE_TTL", "3600"))
+# 每个集合最多缓存的答案条数
+DEFAULT_MAX_ENTRIES = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1024"))
+
+# 全局缓存实例，初始为None，延迟初始化
+_cache: Optional["SemanticAnswerCache"] = None
+# 创建缓存实例时使用的锁
+_cache_lock = threading.Lock()
+
+
+def collection_state(collection, collection_name: str) -> Tuple[int, int]:
+    """
+    获取集合的当前状态，用于判断缓存的答案是否仍然有效。
+    版本号保存在磁盘上（见 db.get_collection_version），其他进程写入或替换分块（即使文档数量不变）也会使缓存失效
+    参数:
+        collection: ChromaDB集合实例
+        collection_name (str): 集合名称
+    返回:
+        Tuple[int, int]: (文档数量, 集合版本号)
+    """
+    return collection.count(), db.get_collection_version(collection_name)
+
+
+class _Entry:
+    __slots__ = ("embedding", "chunk_ids", "answer", "created")
+
+    def __init__(self, embedding: np.ndarray, chunk_ids: frozenset, answer: str, created: float):
+        # 归一化后的查询向量
+        self.embedding = embedding
+        # 生成该答案时检索到的文本块ID集合
+        self.chunk_ids = chunk_ids
+        # 大模型生成的答案
+        self.answer = answer
+        # 写入时间
+        self.created = created
+
+
+class SemanticAnswerCache:
+    """
+    以查询向量为键的语义答案缓存：
+    新查询的向量与已缓存查询的余弦距离不超过 max_distance，且检索到的文本块ID集合完全相同时，
+    直接返回缓存的答案，省去大模型调用。
+    每个集合的条目按LRU和TTL淘汰；集合的文档数量或版本号变化时，该集合的缓存整体失效；
+    用旧状态生成的答案不会写入，也不会清空按新状态缓存的答案。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_distance: float = DEFAULT_MAX_DISTANCE
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        # 集合名称 -> (条目序号 -> 条目)，按最近使用时间排列
+        self._entries: Dict[str, "OrderedDict[int, _Entry]"] = {}
+        # 集合名称 -> 写入缓存时的集合状态
+        self._states: Dict[str, Tuple[int, int]] = {}
+        # 集合名称 -> (条目序号列表, 向量矩阵)，条目变化时置空，查询时重建
+        self._matrices: Dict[str, Optional[Tuple[List[int], np.ndarray]]] = {}
+        # 下一个条目序号
+        self._next_id = 0
+
+    @staticmethod
+    def _normalize(embedding: Iterable[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _is_outdated(self, collection_name: str, state: Tuple[int, int]) -> bool:
+        # 状态比缓存当前的状态旧（请求开始后集合又发生了变化，其他请求已按新状态重置过缓存）
+        current = self._states.get(collection_name)
+        return current is not None and current != state and state[1] <= current[1]
+
+    def _check_state(self, collection_name: str, state: Tuple[int, int]):
+        # 集合发生变化时清空该集合的缓存
+        if self._states.get(collection_name) != state:
+            if self._entries.get(collection_name):
+                logger.info(f"集合{collection_name}已变化，清空{len(self._entries[collection_name])}条缓存的答案")
+            self._entries[collection_name] = OrderedDict()
+            self._matrices[collection_name] = None
+            self._states[collection_name] = state
+
+    def _expire(self, collection_name: str, now: float):
+        # 按写入时间顺序淘汰过期条目
+        if self.ttl_seconds <= 0:
+            return
+        entries = self._entries[collection_name]
+        expired = [entry_id for entry_id, entry in entries.items() if now - entry.created > self.ttl_seconds]
+        for entry_id in expired:
+            del entries[entry_id]
+        if expired:
+            self._matrices[collection_name] = None
+
+    def _matrix(self, collection_name: str) -> Tuple[List[int], np.ndarray]:
+        matrix = self._matrices.get(collection_name)
+        if matrix is None:
+            entries = self._entries[collection_name]
+            entry_ids = list(entries)
+            vectors = np.stack([entries[entry_id].embedding for entry_id in entry_ids]) if entry_ids else None
+            matrix = (entry_ids, vectors)
+            self._matrices[collection_name] = matrix
+        return matrix
+
+    def get(
+        self,
+        collection_name: str,
+        state: Tuple[int, int],
+        query_embedding: List[float],
+        chunk_ids: Iterable[str]
+    ) -> Optional[str]:
+        """
+        查找语义相近且检索结果相同的已缓存答案
+        参数:
+            collection_name (str): 集合名称
+            state (Tuple[int, int]): 集合当前状态，见 collection_state
+            query_embedding (List[float]): 查询向量
+            chunk_ids (Iterable[str]): 本次检索到的文本块ID
+        返回:
+            Optional[str]: 命中时返回缓存的答案，否则返回None
+        """
+        vector = self._normalize(query_embedding)
+        chunk_ids = frozenset(chunk_ids)
+        with self._lock:
+            if self._is_outdated(collection_name, state):
+                return None
+            self._check_state(collection_name, state)
+            self._expire(collection_name, time.monotonic())
+            entry_ids, vectors = self._matrix(collection_name)
+            if not entry_ids:
+                return None
+            # 一次矩阵乘法算出与所有缓存查询的余弦距离，按距离从近到远检查
+            distances = 1.0 - vectors @ vector
+            entries = self._entries[collection_name]
+            for row in np.argsort(distances):
+                if distances[row] > self.max_distance:
+                    break
+                entry = entries[entry_ids[row]]
+                if entry.chunk_ids == chunk_ids:
+                    entries.move_to_end(entry_ids[row])
+                    logger.info(f"命中答案缓存，余弦距离：{distances[row]:.4f}")
+                    return entry.answer
+        return None
+
+    def put(
+        self,
+        collection_name: str,
+        state: Tuple[int, int],
+        query_embedding: List[float],
+        chunk_ids: Iterable[str],
+        answer: str
+    ):
+        """
+        缓存一次查询的答案，超出容量时淘汰最久未使用的条目
+        参数:
+            collection_name (str): 集合名称
+            state (Tuple[int, int]): 生成答案时集合的状态，见 collection_state
+            query_embedding (List[float]): 查询向量
+            chunk_ids (Iterable[str]): 生成答案时检索到的文本块ID
+            answer (str): 大模型生成的答案
+        """
+        entry = _Entry(self._normalize(query_embedding), frozenset(chunk_ids), answer, time.monotonic())
+        with self._lock:
+            if self._is_outdated(collection_name, state):
+                # 生成答案期间集合已经变化：这个答案可能已过期，不缓存，也不清空按新状态缓存的答案
+                logger.debug(f"集合{collection_name}在生成答案期间发生了变化，不缓存该答案")
+                return
+            self._check_state(collection_name, state)
+            entries = self._entries[collection_name]
+            entries[self._next_id] = entry
+            self._next_id += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._matrices[collection_name] = None
+
+    def invalidate(self, collection_name: Optional[str] = None):
+        """
+        清空缓存
+        参数:
+            collection_name (str, optional): 集合名称，为None时清空所有集合
+        """
+        with self._lock:
+            names = [collection_name] if collection_name is not None else list(self._entries)
+            for name in names:
+                self._entries.pop(name, None)
+                self._states.pop(name, None)
+                self._matrices.pop(name, None)
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """
+    获取语义答案缓存实例（单例模式）
+    返回:
+        SemanticAnswerCache: 缓存实例
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticAnswerCache()
+        return _cache
@@ -0,0 +1,237 @@
+# 导入os模块，用于读取环境变量和检查文件
+import os
+# 导入json模块，用于读写JSONL
+import json
+# 导入time模块，用于统计耗时
+import time
+# 导入hashlib模块，用于为没有ID的问题生成稳定ID
+import hashlib
+# 导入argparse模块，用于解析命令行参数
+import argparse
+# 导入线程池，用于并发调用大模型
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+# 导入类型注解
+from typing import Dict, Iterable, List, Optional, Set, Union
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入项目模块
+import llm
+import query
+import rerank
+import context_builder
+
+logger = logging.getLogger(__name__)
+
+# 每批一起向量化和检索的问题数量
+DEFAULT_BATCH_SIZE = int(os.getenv("RAG_BATCH_QUERY_SIZE", "64"))
+# 同时等待大模型回复的问题数量，默认与大模型的并发上限相同（实际并发和速率仍受 llm 模块的全局限制）
+DEFAULT_CONCURRENCY = int(os.getenv("RAG_BATCH_QUERY_CONCURRENCY", str(llm.LLM_MAX_CONCURRENCY)))
+
+
+def question_id(question: str) -> str:
+    """
+    没有指定ID的问题用问题文本的md5作为ID，输入文件增删或调整顺序后仍能对应上已完成的结果
+    参数:
+        question (str): 问题文本
+    返回:
+        str: 问题ID
+    """
+    return hashlib.md5(question.encode("utf-8")).hexdigest()
+
+
+def load_questions(source: Union[str, Iterable[Union[str, dict]]]) -> List[dict]:
+    """
+    读取问题列表
+    参数:
+        source: 问题文件路径，或问题文本/字典的列表。
+            .jsonl 文件每行一个JSON对象，需包含 "question" 字段，可选 "id" 字段，其他字段原样写入结果（如评估用的标准答案）；
+            其他文件每行一个问题
+    返回:
+        List[dict]: 每个问题一个字典，包含 "id" 和 "question"，ID重复的问题只保留第一个
+    异常:
+        ValueError: JSONL中缺少 question 字段
+    """
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        items = [json.loads(line) for line in lines] if source.endswith(".jsonl") else lines
+    else:
+        items = list(source)
+    questions: Dict[str, dict] = {}
+    for item in items:
+        record = {"question": item} if isinstance(item, str) else dict(item)
+        if not record.get("question"):
+            raise ValueError(f"问题缺少 question 字段：{item}")
+        record["id"] = str(record.get("id") or question_id(record["question"]))
+        questions.setdefault(record["id"], record)
+    return list(questions.values())
+
+
+def load_completed(output_path: str) -> Set[str]:
+    """
+    读取输出文件中已经成功完成的问题ID，用于中断后续跑。
+    失败的问题和崩溃时写了一半的最后一行不算完成，续跑时重新处理
+    参数:
+        output_path (str): 输出JSONL文件路径
+    返回:
+        Set[str]: 已完成的问题ID
+    """
+    completed: Set[str] = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "answer" in record and "error" not in record:
+                completed.add(record["id"])
+    return completed
+
+
+def _terminate_last_line(output_path: str) -> None:
+    # 崩溃时最后一行可能只写了一半，先补上换行，避免续跑写入的第一条结果与之接在同一行
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def _answer(question: str, related_chunks: List[str]) -> str:
+    # 拼接prompt并调用大模型，并发和限流由 llm 模块统一控制
+    prompt = query.build_prompt(question, related_chunks)
+    return llm.invoke(prompt, system_prompt=context_builder.SYSTEM_PROMPT)
+
+
+def run_batch(
+    source: Union[str, Iterable[Union[str, dict]]],
+    output_path: str,
+    n_results: int = query.DEFAULT_N_RESULTS,
+    collection_name: str = query.DEFAULT_COLLECTION_NAME,
+    retrieval_mode: str = query.DEFAULT_RETRIEVAL_MODE,
+    where: Optional[dict] = None,
+    use_rerank: Optional[bool] = None,
+    neighbour_window: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY
+) -> dict:
+    """
+    批量问答：每批问题一次向量化、一次多向量检索，大模型调用并发进行；
+    每个问题完成后立即追加一行结果到输出JSONL，再次运行时跳过已成功完成的问题（可在中断后续跑）。
+    检索下一批问题与等待上一批的大模型回复同时进行，总耗时主要取决于大模型的并发数
+    参数:
+        source: 问题文件路径或问题列表，见 load_questions
+        output_path (str): 输出JSONL文件路径，每行包含 id、question、answer、chunk_ids，失败的问题包含 error
+        n_results (int): 每个问题检索的文本块数量，默认为3
+        collection_name (str): 集合名称，默认为 "rag"
+        retrieval_mode (str): 检索模式，"dense" 或 "hybrid"，默认为 "dense"
+        where (dict, optional): 元数据过滤条件，见 query.build_where
+        use_rerank (bool, optional): 是否召回更多候选并用交叉编码器重排序，默认读取环境变量 RAG_RERANK
+        neighbour_window (int, optional): 为每个检索到的文本块补充前后各多少个相邻文本块，默认读取环境变量 RAG_NEIGHBOUR_WINDOW
+        batch_size (int): 每批一起向量化和检索的问题数量
+        concurrency (int): 同时等待大模型回复的问题数量
+    返回:
+        dict: 统计信息：问题总数、跳过（已完成）、成功、失败的数量和总耗时
+    """
+    start = time.perf_counter()
+    questions = load_questions(source)
+    completed = load_completed(output_path)
+    pending = [record for record in questions if record["id"] not in completed]
+    use_rerank = rerank.RERANK_ENABLED if use_rerank is None else use_rerank
+    neighbour_window = query.DEFAULT_NEIGHBOUR_WINDOW if neighbour_window is None else neighbour_window
+    n_fetch = n_results * rerank.DEFAULT_OVERFETCH_FACTOR if use_rerank else n_results
+    logger.info(f"开始批量问答：共{len(questions)}个问题，{len(questions) - len(pending)}个已完成，待处理{len(pending)}个")
+    stats = {"total": len(questions), "skipped": len(questions) - len(pending), "answered": 0, "failed": 0}
+    _terminate_last_line(output_path)
+    # 正在等待大模型回复的问题：Future -> 结果记录
+    in_flight: Dict[Future, dict] = {}
+
+    def write(record: dict, output) -> None:
+        # 每条结果写完立即刷新，崩溃时最多丢失正在写的一行
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+        stats["failed" if "error" in record else "answered"] += 1
+
+    def drain(output, limit: int) -> None:
+        # 等待进行中的请求数降到limit以下，按完成顺序写出结果
+        while len(in_flight) > limit:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                record = in_flight.pop(future)
+                try:
+                    record["answer"] = future.result()
+                except Exception as e:
+                    record["error"] = str(e)
+                write(record, output)
+
+    with open(output_path, "a", encoding="utf-8") as output, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="rag-batch") as executor:
+        for batch_start in range(0, len(pending), batch_size):
+            batch = pending[batch_start:batch_start + batch_size]
+            texts = [record["question"] for record in batch]
+            try:
+                # 一批问题一次向量化、一次多向量检索
+                embeddings = query.get_query_embeddings(texts)
+                retrieved = query.retrieve_batch(texts, embeddings, n_fetch, collection_name, retrieval_mode, where)
+            except Exception as e:
+                logger.error(f"第{batch_start // batch_size + 1}批问题检索失败：{str(e)}")
+                for record in batch:
+                    write(dict(record, error=f"检索失败：{str(e)}"), output)
+                continue
+            for record, (chunk_ids, related_chunks) in zip(batch, retrieved):
+                try:
+                    if not chunk_ids:
+                        raise ValueError("未检索到相关内容，请先入库或检查数据库！")
+                    if use_rerank:
+                        chunk_ids, related_chunks, _ = rerank.get_reranker().rerank(
+                            record["question"], chunk_ids, related_chunks, n_results
+                        )
+                    if neighbour_window > 0:
+                        chunk_ids, related_chunks = query.expand_neighbours(
+                            chunk_ids, related_chunks, collection_name, neighbour_window
+                        )
+                except Exception as e:
+                    write(dict(record, error=str(e)), output)
+                    continue
+                result = dict(record, chunk_ids=chunk_ids)
+                in_flight[executor.submit(_answer, record["question"], related_chunks)] = result
+            # 只保留有限的进行中请求，控制内存并让结果尽早写出
+            drain(output, concurrency * 2)
+        drain(output, 0)
+    stats["seconds"] = time.perf_counter() - start
+    logger.info(
+        f"批量问答完成：成功{stats['answered']}个，失败{stats['failed']}个，跳过{stats['skipped']}个，"
+        f"耗时{stats['seconds']:.1f}s"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量问答：批量向量化和检索，并发调用大模型，结果流式写入JSONL，可中断续跑")
+    parser.add_argument("questions", help="问题文件：.jsonl（每行含 question，可选 id）或每行一个问题的文本文件")
+    parser.add_argument("output", help="输出JSONL文件，已存在时跳过其中已成功完成的问题")
+    parser.add_argument("--n-results", type=int, default=query.DEFAULT_N_RESULTS)
+    parser.add_argument("--collection", default=query.DEFAULT_COLLECTION_NAME)
+    parser.add_argument("--retrieval-mode", default=query.DEFAULT_RETRIEVAL_MODE, choices=["dense", "hybrid"])
+    parser.add_argument("--rerank", action="store_true", default=None, help="召回更多候选并用交叉编码器重排序")
+    parser.add_argument("--neighbour-window", type=int, help="为检索到的文本块补充的相邻文本块数量")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+
+    report = run_batch(
+        args.questions,
+        args.output,
+        n_results=args.n_results,
+        collection_name=args.collection,
+        retrieval_mode=args.retrieval_mode,
+        use_rerank=args.rerank,
+        neighbour_window=args.neighbour_window,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
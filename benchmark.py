@@ -0,0 +1,497 @@
+# 导入os模块，用于路径和文件操作
+import os
+# 导入sys模块，用于重定向调试输出
+import sys
+# 导入json模块，用于读取问题集和输出结果
+import json
+# 导入time模块，用于计时
+import time
+# 导入shutil模块，用于清理临时数据库目录
+import shutil
+# 导入tempfile模块，用于创建临时数据库目录
+import tempfile
+# 导入argparse模块，用于解析命令行参数
+import argparse
+# 导入subprocess模块，用于记录当前提交
+import subprocess
+# 导入contextlib模块，用于重定向调试输出
+import contextlib
+# 导入类型注解
+from typing import Dict, List, Optional, Sequence
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于计算分位数
+import numpy as np
+
+# 导入项目模块
+import db
+import llm
+import query
+import save
+import ingest
+import metrics
+import manifest
+import registry
+import bm25_index
+import simhash_index
+import embed_cache
+import answer_cache
+
+logger = logging.getLogger(__name__)
+
+# 默认的基准语料目录
+DEFAULT_DATA_DIR = "example_file"
+# 默认的问题集（每行一个 {"question": ..., "evidence": ...}，evidence为相关段落中的一段原文）
+DEFAULT_QUESTIONS_PATH = "bench_data/questions.jsonl"
+# 支持的入库入口："file" 逐个文件调用 save.doc_to_vectorstore，"dir" 调用 ingest.dir_to_vectorstore
+INGEST_ENTRIES = ("file", "dir")
+# 默认的入库入口
+DEFAULT_INGEST_ENTRY = "file"
+# 默认统计的召回位置
+DEFAULT_K_VALUES = (1, 3, 5)
+# 默认每个问题重复查询的次数（用于延迟分位数）
+DEFAULT_QUERY_REPEATS = 3
+# 基准测试使用的集合名称
+BENCH_COLLECTION_NAME = "rag_bench"
+# 替代大模型返回的固定答案
+STUB_ANSWER = "（基准测试：已跳过大模型调用）"
+# 向量库对比使用的随机向量维度（与all-MiniLM-L6-v2一致）
+DEFAULT_STORE_DIM = 384
+# 向量库对比中每个规模的查询次数
+DEFAULT_STORE_QUERIES = 200
+# 向量库对比中批量查询的批大小
+DEFAULT_STORE_BATCH = 32
+
+
+def load_questions(path: str = DEFAULT_QUESTIONS_PATH) -> List[dict]:
+    """
+    读取问题集
+    参数:
+        path (str): JSONL文件路径
+    返回:
+        List[dict]: 问题列表，每项包含 question 和 evidence
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def latency_summary(samples: Sequence[float]) -> Dict[str, float]:
+    """
+    统计延迟分布
+    参数:
+        samples (Sequence[float]): 每次调用的耗时（秒）
+    返回:
+        Dict[str, float]: 次数以及均值、p50、p90、p95、p99、最大值（毫秒）
+    """
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p90, p95, p99 = np.percentile(ms, [50, 90, 95, 99])
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(ms.max()),
+    }
+
+
+def _use_temporary_store(path: str, use_embed_cache: bool):
+    # 所有持久化数据都放到临时目录，不影响正式的 ./chroma_db
+    db.DEFAULT_DB_PATH = path
+    query.DEFAULT_DB_PATH = path
+    bm25_index.DEFAULT_BM25_DIR = os.path.join(path, "bm25")
+    simhash_index.DEFAULT_SIMHASH_DIR = os.path.join(path, "simhash")
+    manifest.DEFAULT_MANIFEST_PATH = os.path.join(path, "manifest.json")
+    # PDF页缓存在提取进程中也会用到，通过环境变量传给子进程
+    os.environ["RAG_PDF_PAGE_CACHE_PATH"] = os.path.join(path, "pdf_pages.sqlite")
+    embed_cache.DEFAULT_CACHE_DIR = os.path.join(path, "embed_cache")
+    # 默认关闭嵌入缓存，使编码耗时反映模型本身
+    embed_cache.EMBED_CACHE_ENABLED = use_embed_cache
+    # 答案缓存会跳过检索后的流程，基准测试中关闭
+    answer_cache.ANSWER_CACHE_ENABLED = False
+
+
+def _stub_llm():
+    # 离线运行：大模型调用直接返回固定答案
+    def invoke(prompt: str, model: Optional[str] = None, temperature: float = 0.7, **kwargs) -> str:
+        return STUB_ANSWER
+    llm.invoke = invoke
+
+
+def _stage_seconds(samples: List[dict]) -> Dict[str, dict]:
+    # 按stage标签汇总入库各阶段耗时直方图的累计秒数和观测次数
+    stages = {}
+    for sample in samples:
+        if sample["name"] == metrics.INGEST_STAGE_SECONDS:
+            stage = stages.setdefault(sample["labels"].get("stage", ""), {"seconds": 0.0, "count": 0})
+            stage["seconds"] += sample["sum"]
+            stage["count"] += sample["count"]
+    return stages
+
+
+def _counter_value(samples: List[dict], name: str, **labels) -> float:
+    wanted = {key: str(value) for key, value in labels.items()}
+    return sum(sample["value"] for sample in samples if sample["name"] == name and sample["labels"] == wanted)
+
+
+def bench_ingest(
+    data_dir: str,
+    collection_name: str = BENCH_COLLECTION_NAME,
+    entry: str = DEFAULT_INGEST_ENTRY,
+    chunk_size: int = save.DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = save.DEFAULT_CHUNK_OVERLAP,
+    splitter: str = save.DEFAULT_SPLITTER,
+    encode_batch_size: int = db.DEFAULT_ENCODE_BATCH_SIZE,
+    write_batch_size: int = db.DEFAULT_WRITE_BATCH_SIZE
+) -> dict:
+    """
+    通过正式的入库入口入库并计时，各阶段耗时（提取、分块、去重查询、编码、写入）取自入库流程本身记录的
+    metrics.INGEST_STAGE_SECONDS 直方图，测到的就是生产代码的性能
+    参数:
+        data_dir (str): 语料目录（只处理顶层目录中受支持的文件）
+        collection_name (str): 集合名称
+        entry (str): 入库入口，"file" 逐个文件调用 save.doc_to_vectorstore，"dir" 调用 ingest.dir_to_vectorstore 并行流水线
+        chunk_size (int): 分块大小
+        chunk_overlap (int): 分块重叠长度
+        splitter (str): 分块方式
+        encode_batch_size (int): 每批编码的分块数量
+        write_batch_size (int): 每批写入的分块数量（仅 "file" 入口，"dir" 入口按编码批次写入）
+    返回:
+        dict: 入库吞吐指标；"dir" 入口各阶段并发执行，阶段耗时之和可能大于总耗时
+    异常:
+        ValueError: 不支持的入库入口
+    """
+    if entry not in INGEST_ENTRIES:
+        raise ValueError(f"不支持的入库入口：{entry}，可选：{', '.join(INGEST_ENTRIES)}")
+    files = ingest.collect_files(data_dir, recursive=False)
+    total_bytes = sum(os.path.getsize(file_path) for file_path in files)
+    # 开启指标采集并清空之前的记录，只统计本次入库
+    metrics.enable(True)
+    metrics.reset()
+    start = time.perf_counter()
+    if entry == "file":
+        for file_path in files:
+            save.doc_to_vectorstore(
+                file_path,
+                collection_name=collection_name,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                encode_batch_size=encode_batch_size,
+                write_batch_size=write_batch_size,
+                splitter=splitter
+            )
+    else:
+        ingest.dir_to_vectorstore(
+            data_dir,
+            collection_name=collection_name,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            encode_batch_size=encode_batch_size,
+            recursive=False,
+            splitter=splitter
+        )
+    total_seconds = time.perf_counter() - start
+    samples = metrics.snapshot()
+    stages = _stage_seconds(samples)
+    # 写入成功（含数据库中已存在）、失败和近似重复跳过的分块都计入分块总数
+    total_chunks = int(sum(
+        _counter_value(samples, metrics.INGEST_CHUNKS_TOTAL, status=status)
+        for status in ("saved", "failed", "near_duplicate")
+    ))
+    unique_chunks = db._get_collection(collection_name).count()
+
+    def rate(amount: float, stage: str) -> float:
+        seconds = stages.get(stage, {}).get("seconds", 0.0)
+        return amount / seconds if seconds else 0.0
+
+    megabytes = total_bytes / (1024 * 1024)
+    return {
+        "entry": entry,
+        "files": len(files),
+        "megabytes": megabytes,
+        "chunks": total_chunks,
+        "unique_chunks": unique_chunks,
+        "seconds": total_seconds,
+        "chunks_per_second": total_chunks / total_seconds if total_seconds else 0.0,
+        "megabytes_per_second": megabytes / total_seconds if total_seconds else 0.0,
+        "stages": {
+            "extract": {**stages.get("extract", {}), "megabytes_per_second": rate(megabytes, "extract")},
+            "split": {**stages.get("split", {}), "chunks_per_second": rate(total_chunks, "split")},
+            "dedupe_lookup": {**stages.get("dedupe_lookup", {})},
+            "embed": {**stages.get("embed", {}), "chunks_per_second": rate(unique_chunks, "embed")},
+            "write": {**stages.get("write", {}), "chunks_per_second": rate(unique_chunks, "write")},
+        },
+    }
+
+
+def bench_queries(
+    questions: List[dict],
+    collection_name: str = BENCH_COLLECTION_NAME,
+    k_values: Sequence[int] = DEFAULT_K_VALUES,
+    repeats: int = DEFAULT_QUERY_REPEATS,
+    retrieval_mode: str = query.DEFAULT_RETRIEVAL_MODE
+) -> dict:
+    """
+    测量查询各阶段延迟，并按问题集计算recall@k和MRR
+    参数:
+        questions (List[dict]): 问题集，每项包含 question 和 evidence
+        collection_name (str): 集合名称
+        k_values (Sequence[int]): 统计的召回位置
+        repeats (int): 每个问题重复查询的次数
+        retrieval_mode (str): 检索模式
+    返回:
+        dict: 延迟分位数和检索质量指标
+    """
+    max_k = max(k_values)
+    timings = {"get_query_embedding": [], "retrieve": [], "query_rag": []}
+    # 每个问题中第一个包含evidence的分块的排名（从1开始），未命中为None
+    ranks: List[Optional[int]] = []
+    for repeat in range(repeats):
+        for item in questions:
+            start = time.perf_counter()
+            embedding = query.get_query_embedding(item["question"])
+            timings["get_query_embedding"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            chunks = query.retrieve(item["question"], embedding, max_k, collection_name, retrieval_mode)
+            timings["retrieve"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            query.query_rag(item["question"], max_k, collection_name, retrieval_mode, use_answer_cache=False)
+            timings["query_rag"].append(time.perf_counter() - start)
+            if repeat == 0:
+                ranks.append(next((idx + 1 for idx, chunk in enumerate(chunks) if item["evidence"] in chunk), None))
+    recall = {f"recall@{k}": float(np.mean([rank is not None and rank <= k for rank in ranks])) for k in k_values}
+    mrr = float(np.mean([1.0 / rank if rank else 0.0 for rank in ranks]))
+    return {
+        "questions": len(questions),
+        "retrieval_mode": retrieval_mode,
+        "latency": {name: latency_summary(samples) for name, samples in timings.items()},
+        "quality": {**recall, f"mrr@{max_k}": mrr},
+        "misses": [item["question"] for item, rank in zip(questions, ranks) if rank is None],
+    }
+
+
+def _rss_megabytes() -> Optional[float]:
+    # 读取当前进程的常驻内存（仅Linux），其他平台返回None
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _dir_megabytes(path: str) -> float:
+    total = 0
+    for root, _, names in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return total / (1024 * 1024)
+
+
+def bench_vector_stores(
+    sizes: Sequence[int],
+    store_dir: str,
+    dim: int = DEFAULT_STORE_DIM,
+    n_queries: int = DEFAULT_STORE_QUERIES,
+    k: int = 10,
+    batch_size: int = DEFAULT_STORE_BATCH,
+    stores: Sequence[str] = ("chroma", "local")
+) -> List[dict]:
+    """
+    用相同的随机单位向量对比各向量库引擎：写入耗时、单条查询延迟、批量查询的单条平均耗时、
+    内存增长、磁盘占用，以及相对精确检索（本地引擎）的recall@k
+    参数:
+        sizes (Sequence[int]): 向量条数
+        store_dir (str): 存放各引擎数据的目录
+        dim (int): 向量维度
+        n_queries (int): 查询次数
+        k (int): 每次查询返回的结果数量
+        batch_size (int): 批量查询的批大小
+        stores (Sequence[str]): 参与对比的引擎
+    返回:
+        List[dict]: 每个规模、每个引擎一项结果
+    """
+    results = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        vectors = rng.standard_normal((size, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = rng.standard_normal((n_queries, dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        ids = [f"v{idx}" for idx in range(size)]
+        documents = [f"doc {idx}" for idx in range(size)]
+        # 精确的top-k，作为recall的基准
+        exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+        for store in stores:
+            path = os.path.join(store_dir, f"{store}_{size}")
+            rss_before = _rss_megabytes()
+            collection = registry.get_collection(f"bench_{size}", path, store=store)
+            start = time.perf_counter()
+            for offset in range(0, size, db.DEFAULT_WRITE_BATCH_SIZE):
+                collection.add(
+                    ids=ids[offset:offset + db.DEFAULT_WRITE_BATCH_SIZE],
+                    embeddings=vectors[offset:offset + db.DEFAULT_WRITE_BATCH_SIZE],
+                    documents=documents[offset:offset + db.DEFAULT_WRITE_BATCH_SIZE]
+                )
+            write_seconds = time.perf_counter() - start
+            single = []
+            found = []
+            for query_vector in queries:
+                start = time.perf_counter()
+                result = collection.query(query_embeddings=[query_vector.tolist()], n_results=k)
+                single.append(time.perf_counter() - start)
+                found.append(result["ids"][0])
+            start = time.perf_counter()
+            for offset in range(0, n_queries, batch_size):
+                collection.query(query_embeddings=queries[offset:offset + batch_size].tolist(), n_results=k)
+            batched_ms = (time.perf_counter() - start) * 1000.0 / n_queries
+            rss_after = _rss_megabytes()
+            recall = float(np.mean([
+                len(set(row) & {ids[idx] for idx in truth}) / k for row, truth in zip(found, exact)
+            ]))
+            results.append({
+                "store": store,
+                "size": size,
+                "write_seconds": write_seconds,
+                "query": latency_summary(single),
+                "batched_ms_per_query": batched_ms,
+                "recall@k": recall,
+                "rss_delta_mb": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+                "disk_mb": _dir_megabytes(path if store == "chroma" else f"{path}_local"),
+            })
+            logger.info(f"向量库对比：{store} {size}条，单条查询p50 {results[-1]['query']['p50_ms']:.2f}ms")
+    return results
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(
+    data_dir: str = DEFAULT_DATA_DIR,
+    questions_path: str = DEFAULT_QUESTIONS_PATH,
+    chunk_size: int = save.DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = save.DEFAULT_CHUNK_OVERLAP,
+    splitter: str = save.DEFAULT_SPLITTER,
+    ingest_entry: str = DEFAULT_INGEST_ENTRY,
+    k_values: Sequence[int] = DEFAULT_K_VALUES,
+    repeats: int = DEFAULT_QUERY_REPEATS,
+    retrieval_mode: str = query.DEFAULT_RETRIEVAL_MODE,
+    use_embed_cache: bool = False,
+    keep_store: bool = False,
+    vector_store: Optional[str] = None,
+    store_sizes: Sequence[int] = ()
+) -> dict:
+    """
+    在临时数据库上运行完整的入库+查询基准测试（大模型调用被替换为固定答案，可离线运行）
+    参数:
+        data_dir (str): 语料目录
+        questions_path (str): 问题集路径
+        chunk_size (int): 分块大小
+        chunk_overlap (int): 分块重叠长度
+        splitter (str): 分块方式
+        ingest_entry (str): 入库入口，见 bench_ingest
+        k_values (Sequence[int]): 统计的召回位置
+        repeats (int): 每个问题重复查询的次数
+        retrieval_mode (str): 检索模式
+        use_embed_cache (bool): 是否启用嵌入缓存，默认关闭
+        keep_store (bool): 是否保留临时数据库目录
+        vector_store (str, optional): 语料入库和查询使用的向量库引擎，默认为 registry.DEFAULT_VECTOR_STORE
+        store_sizes (Sequence[int]): 额外用随机向量对比各向量库引擎的规模，为空时跳过
+    返回:
+        dict: 基准测试结果
+    """
+    store = tempfile.mkdtemp(prefix="rag_bench_")
+    _use_temporary_store(store, use_embed_cache)
+    if vector_store:
+        registry.DEFAULT_VECTOR_STORE = vector_store
+    _stub_llm()
+    try:
+        # 模型加载单独计时，不计入入库和查询
+        start = time.perf_counter()
+        registry.get_model(db.DEFAULT_MODEL_NAME)
+        model_load_seconds = time.perf_counter() - start
+        ingest_result = bench_ingest(
+            data_dir, entry=ingest_entry, chunk_size=chunk_size, chunk_overlap=chunk_overlap, splitter=splitter
+        )
+        queries = bench_queries(load_questions(questions_path), k_values=k_values, repeats=repeats, retrieval_mode=retrieval_mode)
+        stores = bench_vector_stores(store_sizes, os.path.join(store, "stores")) if store_sizes else None
+        return {
+            "revision": _git_revision(),
+            "config": {
+                "data_dir": data_dir,
+                "questions": questions_path,
+                "model": db.DEFAULT_MODEL_NAME,
+                "embed_backend": registry.DEFAULT_EMBED_BACKEND,
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "splitter": splitter,
+                "ingest_entry": ingest_entry,
+                "retrieval_mode": retrieval_mode,
+                "repeats": repeats,
+                "embed_cache": use_embed_cache,
+                "vector_store": registry.DEFAULT_VECTOR_STORE,
+            },
+            "model_load_seconds": model_load_seconds,
+            "ingest": ingest_result,
+            "query": queries,
+            "vector_stores": stores,
+        }
+    finally:
+        if keep_store:
+            logger.info(f"临时数据库已保留：{store}")
+        else:
+            shutil.rmtree(store, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAG入库吞吐、查询延迟与检索质量基准测试")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS_PATH)
+    parser.add_argument("--chunk-size", type=int, default=save.DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=save.DEFAULT_CHUNK_OVERLAP)
+    parser.add_argument("--splitter", default=save.DEFAULT_SPLITTER, choices=["recursive", "semantic", "cdc"])
+    parser.add_argument("--ingest-entry", default=DEFAULT_INGEST_ENTRY, choices=list(INGEST_ENTRIES),
+                        help="入库入口：file 逐个文件调用 doc_to_vectorstore，dir 调用 dir_to_vectorstore 并行流水线")
+    parser.add_argument("--k", default=",".join(str(k) for k in DEFAULT_K_VALUES), help="逗号分隔的召回位置")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_QUERY_REPEATS)
+    parser.add_argument("--retrieval-mode", default=query.DEFAULT_RETRIEVAL_MODE, choices=["dense", "hybrid"])
+    parser.add_argument("--embed-cache", action="store_true", help="启用嵌入缓存（默认关闭，以测量模型本身的编码耗时）")
+    parser.add_argument("--keep-store", action="store_true", help="保留临时数据库目录")
+    parser.add_argument("--vector-store", choices=["chroma", "local"], help="语料入库和查询使用的向量库引擎")
+    parser.add_argument("--store-sizes", default="", help="逗号分隔的向量条数，用随机向量对比chroma和local引擎，如 10000,100000")
+    parser.add_argument("--output", help="将JSON结果写入文件")
+    args = parser.parse_args()
+
+    # 运行过程中的调试输出重定向到stderr，保证stdout只有JSON结果
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run_benchmark(
+            data_dir=args.data_dir,
+            questions_path=args.questions,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            splitter=args.splitter,
+            ingest_entry=args.ingest_entry,
+            k_values=[int(k) for k in args.k.split(",")],
+            repeats=args.repeats,
+            retrieval_mode=args.retrieval_mode,
+            use_embed_cache=args.embed_cache,
+            keep_store=args.keep_store,
+            vector_store=args.vector_store,
+            store_sizes=[int(size) for size in args.store_sizes.split(",") if size]
+        )
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    print(report)
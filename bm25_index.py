@@ -0,0 +1,303 @@
+# 导入os模块，用于路径和文件操作
+import os
+# 导入re模块，用于分词
+import re
+# 导入math模块，用于计算idf
+import math
+# 导入pickle模块，用于持久化索引
+import pickle
+# 导入threading模块，保证索引读写的线程安全
+import threading
+# 导入atexit模块，进程退出时保存增量更新过的索引
+import atexit
+# 导入类型注解
+from typing import Dict, List, Optional, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入数据库相关的函数和默认配置
+import db
+
+logger = logging.getLogger(__name__)
+
+# 默认的BM25索引目录，与ChromaDB数据目录放在一起
+DEFAULT_BM25_DIR = f"{db.DEFAULT_DB_PATH}_bm25"
+# BM25的词频饱和参数（与rank_bm25.BM25Okapi的默认值一致）
+DEFAULT_K1 = 1.5
+# BM25的文档长度归一化参数（与rank_bm25.BM25Okapi的默认值一致）
+DEFAULT_B = 0.75
+# 从集合同步文档时每批读取的数量
+_SYNC_BATCH_SIZE = 1000
+
+# 中文字符（含扩展区常用部分）
+_CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+# 英文单词和数字
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+
+# 全局索引实例：集合名称 -> BM25Index
+_indexes: Dict[str, "BM25Index"] = {}
+# 创建索引实例时使用的锁
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    面向中英文混合文本的分词：中文按单字和相邻双字切分（能较好地匹配人名、专有名词），
+    英文和数字按单词切分并转为小写
+    参数:
+        text (str): 待分词的文本
+    返回:
+        List[str]: 词项列表
+    """
+    tokens = [word.lower() for word in _WORD_PATTERN.findall(text)]
+    for run in _CJK_PATTERN.findall(text):
+        # 单字
+        tokens.extend(run)
+        # 双字
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    可增量更新、可持久化的BM25倒排索引。
+    rank_bm25.BM25Okapi 需要在构造时传入完整语料，且每次打分都要遍历所有文档，
+    因此这里自行维护倒排表，沿用Okapi BM25的打分公式，查询只遍历命中词项的倒排列表。
+    """
+
+    def __init__(self, path: str, k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        # 索引文件路径
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        # 文档ID -> 文档长度（词项数）
+        self.doc_lens: Dict[str, int] = {}
+        # 文档ID -> 文档包含的词项（用于删除文档时清理倒排表）
+        self.doc_terms: Dict[str, List[str]] = {}
+        # 词项 -> {文档ID: 词频}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        # 所有文档的总长度
+        self.total_len = 0
+        # 索引已包含的集合版本号，None表示还没有与集合全量比对过
+        self.synced_version: Optional[int] = None
+        # 增量更新后尚未保存到磁盘
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self.doc_lens)
+
+    def add(self, ids: List[str], documents: List[str]):
+        """
+        向索引中添加文档，已存在的文档会先删除再添加
+        参数:
+            ids (List[str]): 文档ID列表
+            documents (List[str]): 文档内容列表
+        """
+        with self._lock:
+            self.remove([doc_id for doc_id in ids if doc_id in self.doc_lens])
+            for doc_id, document in zip(ids, documents):
+                tokens = tokenize(document or "")
+                freqs: Dict[str, int] = {}
+                for token in tokens:
+                    freqs[token] = freqs.get(token, 0) + 1
+                for token, freq in freqs.items():
+                    self.postings.setdefault(token, {})[doc_id] = freq
+                self.doc_lens[doc_id] = len(tokens)
+                self.doc_terms[doc_id] = list(freqs)
+                self.total_len += len(tokens)
+
+    def remove(self, ids: List[str]):
+        """
+        从索引中删除文档
+        参数:
+            ids (List[str]): 文档ID列表
+        """
+        with self._lock:
+            for doc_id in ids:
+                if doc_id not in self.doc_lens:
+                    continue
+                for token in self.doc_terms.pop(doc_id):
+                    posting = self.postings.get(token)
+                    if posting is not None:
+                        posting.pop(doc_id, None)
+                        if not posting:
+                            del self.postings[token]
+                self.total_len -= self.doc_lens.pop(doc_id)
+
+    def search(self, query: str, top_n: int) -> List[Tuple[str, float]]:
+        """
+        BM25检索
+        参数:
+            query (str): 查询文本
+            top_n (int): 返回的结果数量
+        返回:
+            List[Tuple[str, float]]: 按得分从高到低排列的 (文档ID, 得分)
+        """
+        with self._lock:
+            n_docs = len(self.doc_lens)
+            if n_docs == 0:
+                return []
+            avg_len = self.total_len / n_docs
+            scores: Dict[str, float] = {}
+            # 查询中重复的词项只计算一次
+            for token in set(tokenize(query)):
+                posting = self.postings.get(token)
+                if not posting:
+                    continue
+                # 使用恒为正的idf，避免高频词得到负分
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, freq in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_n]
+
+    def apply_change(self, version: int, added_ids: List[str], added_documents: List[str], removed_ids: List[str]) -> bool:
+        """
+        应用本进程对集合的一次写入或删除（由 db 的集合变化监听调用），不读取集合。
+        索引不是紧接在这次变化之前的版本时（还没同步过，或中间有其他写入）不做处理，留给下次 sync 全量比对
+        参数:
+            version (int): 这次变化之后的集合版本号
+            added_ids (List[str]): 新增的文档ID
+            added_documents (List[str]): 与added_ids一一对应的文档内容
+            removed_ids (List[str]): 删除的文档ID
+        返回:
+            bool: 是否已应用
+        """
+        with self._lock:
+            if self.synced_version is None or self.synced_version != version - 1:
+                return False
+            self.remove(removed_ids)
+            self.add(added_ids, added_documents)
+            self.synced_version = version
+            self._dirty = True
+            return True
+
+    def sync(self, collection, collection_name: str, force: bool = False) -> bool:
+        """
+        与ChromaDB集合同步：本进程的写入已由 apply_change 增量应用，集合版本号与索引一致且文档数量相同时直接返回；
+        冷启动、有未能增量应用的写入或 force=True 时，只读取ID全量比对，新增文档才读取内容，并删除集合中已不存在的文档
+        参数:
+            collection: ChromaDB集合实例
+            collection_name (str): 集合名称
+            force (bool): 是否强制比对全部ID，默认为 False
+        返回:
+            bool: 索引是否发生了变化
+        """
+        with self._lock:
+            version = db.get_collection_version(collection_name)
+            if not force and version == self.synced_version and collection.count() == len(self):
+                return False
+            # 只读取ID，比对出新增和已删除的文档
+            all_ids = []
+            offset = 0
+            while True:
+                page = collection.get(include=[], limit=_SYNC_BATCH_SIZE, offset=offset)
+                ids = page.get("ids") or []
+                all_ids.extend(ids)
+                if len(ids) < _SYNC_BATCH_SIZE:
+                    break
+                offset += _SYNC_BATCH_SIZE
+            current = set(all_ids)
+            removed = [doc_id for doc_id in self.doc_lens if doc_id not in current]
+            added = [doc_id for doc_id in all_ids if doc_id not in self.doc_lens]
+            self.remove(removed)
+            # 只为新增文档读取内容
+            for start in range(0, len(added), _SYNC_BATCH_SIZE):
+                page = collection.get(ids=added[start:start + _SYNC_BATCH_SIZE], include=["documents"])
+                self.add(page["ids"], page["documents"])
+            self.synced_version = version
+            changed = bool(removed or added)
+            if changed:
+                logger.info(f"BM25索引已同步：新增{len(added)}个文档，删除{len(removed)}个文档，共{len(self)}个文档")
+                self.save()
+            return changed
+
+    def save(self):
+        """
+        将索引原子地写入磁盘
+        """
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {
+                        "doc_lens": self.doc_lens,
+                        "doc_terms": self.doc_terms,
+                        "postings": self.postings,
+                        "total_len": self.total_len,
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def save_if_dirty(self):
+        """
+        增量更新过的索引写回磁盘（每次写入都保存整个索引的代价与集合大小成正比，因此推迟到同步或进程退出时）
+        """
+        with self._lock:
+            if self._dirty:
+                self.save()
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        从磁盘加载索引，文件不存在时返回空索引
+        参数:
+            path (str): 索引文件路径
+        返回:
+            BM25Index: 索引实例
+        """
+        index = cls(path)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            index.doc_lens = data["doc_lens"]
+            index.doc_terms = data["doc_terms"]
+            index.postings = data["postings"]
+            index.total_len = data["total_len"]
+            logger.info(f"已加载BM25索引：{path}，共{len(index)}个文档")
+        return index
+
+
+def get_bm25_index(collection_name: str, collection) -> BM25Index:
+    """
+    获取指定集合的BM25索引（延迟加载，单例模式），并与集合做增量同步
+    参数:
+        collection_name (str): 集合名称
+        collection: ChromaDB集合实例
+    返回:
+        BM25Index: 索引实例
+    """
+    with _indexes_lock:
+        index = _indexes.get(collection_name)
+        if index is None:
+            index = BM25Index.load(os.path.join(DEFAULT_BM25_DIR, f"{collection_name}.pkl"))
+            _indexes[collection_name] = index
+    index.sync(collection, collection_name)
+    return index
+
+
+def _on_collection_change(
+    collection_name: str,
+    version: int,
+    added_ids: List[str],
+    added_documents: List[str],
+    removed_ids: List[str]
+):
+    # 只更新本进程已加载的索引，未加载的索引在第一次使用时全量比对
+    index = _indexes.get(collection_name)
+    if index is not None:
+        index.apply_change(version, added_ids, added_documents, removed_ids)
+
+
+def _save_all():
+    for index in list(_indexes.values()):
+        index.save_if_dirty()
+
+
+db.add_change_listener(_on_collection_change)
+atexit.register(_save_all)
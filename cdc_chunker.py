@@ -0,0 +1,109 @@
+# 导入math模块，用于计算切分概率对应的掩码位数
+import math
+# 导入类型注解
+from typing import List, Optional
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于向量化计算滚动哈希
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认的最大分块长度（字符数），与递归字符分割器的 chunk_size 含义相同
+DEFAULT_MAX_SIZE = 200
+# 滚动哈希的窗口长度（字符数）：切分点只由其前面这么多个字符决定
+DEFAULT_WINDOW = 32
+# 生成gear表使用的固定随机种子，修改后所有切分点都会变化
+_GEAR_SEED = 20240617
+# gear表大小，覆盖基本多文种平面，其余字符按码位取模
+_GEAR_SIZE = 1 << 16
+
+# gear表：每个字符对应一个64位随机数，延迟生成
+_gear: Optional[np.ndarray] = None
+
+
+def _get_gear() -> np.ndarray:
+    global _gear
+    if _gear is None:
+        _gear = np.random.default_rng(_GEAR_SEED).integers(0, np.iinfo(np.uint64).max, _GEAR_SIZE, dtype=np.uint64)
+    return _gear
+
+
+class ContentDefinedChunker:
+    """
+    内容定义分块（gear滚动哈希）：在每个字符位置计算其前 window 个字符的滚动哈希，
+    哈希的高位全为0的位置作为切分点，并限制分块的最小和最大长度。
+    切分点只取决于附近的文本内容，与文本在文档中的位置无关：在文档前面插入或删除内容后，
+    只有编辑位置附近的分块发生变化，其余分块的文本和ID（内容md5）保持不变，增量入库时不需要重新生成向量。
+    分块之间没有重叠（重叠会让分块依赖前一个切分点，破坏切分点的稳定性）
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        min_size: Optional[int] = None,
+        avg_size: Optional[int] = None,
+        window: int = DEFAULT_WINDOW
+    ):
+        """
+        参数:
+            max_size (int): 最大分块长度（字符数），超过时强制切分，默认为200
+            min_size (int, optional): 最小分块长度，默认为 max_size 的一半（且不小于 window）
+            avg_size (int, optional): 期望的平均分块长度，默认为 max_size 的3/4
+            window (int): 滚动哈希的窗口长度，默认为32
+        异常:
+            ValueError: 参数不合法
+        """
+        self.window = window
+        self.max_size = max_size
+        # 最小长度不小于窗口长度，保证每个候选切分点的哈希都覆盖完整窗口，与分块起点无关
+        self.min_size = max(min_size if min_size is not None else max_size // 2, window)
+        if self.min_size >= self.max_size:
+            raise ValueError(f"最小分块长度{self.min_size}必须小于最大分块长度{self.max_size}")
+        avg_size = avg_size if avg_size is not None else max_size * 3 // 4
+        # 越过最小长度后，每个位置成为切分点的概率为 2^-bits
+        self.bits = max(1, round(math.log2(max(avg_size - self.min_size, 2))))
+        logger.debug(f"ContentDefinedChunker初始化，最小/最大长度：{self.min_size}/{self.max_size}，掩码位数：{self.bits}")
+
+    def boundaries(self, text: str) -> np.ndarray:
+        """
+        计算所有候选切分点（不考虑长度限制）
+        参数:
+            text (str): 文本
+        返回:
+            np.ndarray: 升序的候选切分位置，位置p表示在第p个字符之前切分
+        """
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        if len(codes) < self.window:
+            return np.zeros(0, dtype=np.int64)
+        gear = _get_gear()[codes % _GEAR_SIZE]
+        # 位置i的哈希 = Σ gear[i-j] << j（j < window，按2^64取模），窗口外的字符不参与
+        hashes = np.zeros(len(codes) - self.window + 1, dtype=np.uint64)
+        for shift in range(self.window):
+            hashes += gear[self.window - 1 - shift:len(codes) - shift] << np.uint64(shift)
+        hits = np.flatnonzero((hashes >> np.uint64(64 - self.bits)) == 0)
+        # 哈希位置i对应第i+window-1个字符，在其后切分
+        return hits + self.window
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        按内容定义的切分点分块，只由空白字符组成的分块被丢弃，其余分块都是原文的子串
+        参数:
+            text (str): 原始文本
+        返回:
+            List[str]: 分块后的文本列表
+        """
+        candidates = self.boundaries(text)
+        chunks = []
+        start = 0
+        while start < len(text):
+            # 最小长度之后的第一个候选切分点，超过最大长度仍没有时强制切分，剩余文本不足时作为最后一块
+            idx = np.searchsorted(candidates, start + self.min_size)
+            end = int(candidates[idx]) if idx < len(candidates) else len(text)
+            end = min(end, start + self.max_size, len(text))
+            chunks.append(text[start:end])
+            start = end
+        result = [chunk for chunk in chunks if chunk.strip()]
+        logger.debug(f"内容定义分块完成：{len(text)}个字符，共{len(result)}个块")
+        return result
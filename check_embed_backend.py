@@ -0,0 +1,124 @@
+# 导入argparse模块，用于解析命令行参数
+import argparse
+# 导入json模块，用于输出结果
+import json
+# 导入time模块，用于测量吞吐
+import time
+# 导入类型注解
+from typing import Dict, List, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于计算相似度和近邻
+import numpy as np
+
+# 导入模型注册表中的后端加载函数
+import registry
+# 导入分块函数，用于从样例文档构造语料
+from save import extract_text_auto, split_text
+
+logger = logging.getLogger(__name__)
+
+# 默认的样例文档
+DEFAULT_SAMPLE_FILE = "example_file/红楼梦.txt"
+# 默认比较的近邻数量
+DEFAULT_TOP_K = 5
+# 查询文本取每个分块开头的字符数
+_QUERY_PREFIX_CHARS = 30
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _encode(model, texts: List[str], batch_size: int) -> Tuple[np.ndarray, float]:
+    # 先预热一次，排除首次推理的图优化/内存分配开销
+    model.encode(texts[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    vectors = np.asarray(model.encode(texts, batch_size=batch_size), dtype=np.float32)
+    return _normalize(vectors), time.perf_counter() - start
+
+
+def _top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, kth=min(k, scores.shape[1] - 1), axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def compare_backends(
+    texts: List[str],
+    queries: List[str],
+    backends: List[str],
+    model_name: str = registry.DEFAULT_MODEL_NAME,
+    top_k: int = DEFAULT_TOP_K,
+    batch_size: int = 64,
+    threads: int = 0
+) -> Dict[str, dict]:
+    """
+    以第一个后端为基准，比较各推理后端的向量一致性、检索结果一致性和编码吞吐
+    参数:
+        texts (List[str]): 语料文本
+        queries (List[str]): 查询文本，queries[i] 取自 texts[i]
+        backends (List[str]): 推理后端列表，第一个作为基准
+        model_name (str): 模型名称
+        top_k (int): 比较的近邻数量
+        batch_size (int): 编码批量大小
+        threads (int): 限制PyTorch推理线程数（用于测量单核吞吐），0表示不限制
+    返回:
+        Dict[str, dict]: 后端 -> 指标
+    """
+    if threads > 0:
+        import torch
+        torch.set_num_threads(threads)
+    results = {}
+    reference = None
+    for backend in backends:
+        logger.info(f"正在加载推理后端：{backend}")
+        model = registry.load_model(model_name, backend)
+        corpus, corpus_seconds = _encode(model, texts, batch_size)
+        query_vectors, _ = _encode(model, queries, batch_size)
+        neighbours = _top_k(query_vectors, corpus, top_k)
+        # 查询来源分块出现在前k个结果中的比例
+        self_recall = float(np.mean([i in row for i, row in enumerate(neighbours)]))
+        metrics = {
+            "texts_per_second": len(texts) / corpus_seconds,
+            f"self_recall@{top_k}": self_recall,
+        }
+        if reference is None:
+            reference = (corpus, neighbours)
+        else:
+            ref_corpus, ref_neighbours = reference
+            # 同一文本在两个后端下的向量余弦相似度
+            cosine = np.einsum("ij,ij->i", corpus, ref_corpus)
+            # 与基准后端前k个检索结果的重合率
+            overlap = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(neighbours, ref_neighbours)])
+            metrics.update({
+                "mean_cosine_to_reference": float(cosine.mean()),
+                "min_cosine_to_reference": float(cosine.min()),
+                f"top{top_k}_overlap_with_reference": float(overlap),
+                "speedup_vs_reference": metrics["texts_per_second"] / results[backends[0]]["texts_per_second"],
+            })
+        results[backend] = metrics
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比较嵌入推理后端的检索一致性和吞吐")
+    parser.add_argument("--file", default=DEFAULT_SAMPLE_FILE, help="用于构造语料的样例文档")
+    parser.add_argument("--backends", default=",".join(registry.EMBED_BACKENDS), help="逗号分隔的后端列表，第一个为基准")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="限制PyTorch推理线程数，用于测量单核吞吐（ONNX Runtime请同时设置 OMP_NUM_THREADS）")
+    args = parser.parse_args()
+
+    chunks = split_text(extract_text_auto(args.file))
+    report = compare_backends(
+        chunks,
+        [chunk[:_QUERY_PREFIX_CHARS] for chunk in chunks],
+        args.backends.split(","),
+        top_k=args.top_k,
+        batch_size=args.batch_size,
+        threads=args.threads
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
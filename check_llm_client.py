@@ -0,0 +1,206 @@
+# 导入asyncio，用于检查流式调用
+import asyncio
+# 导入json模块，用于解析和构造接口数据
+import json
+# 导入sys模块，用于设置退出码
+import sys
+# 导入time模块，用于模拟延迟和测量耗时
+import time
+# 导入threading模块，用于在后台运行模拟服务
+import threading
+# 导入HTTP服务相关类，用于实现OpenAI兼容的本地模拟服务
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# 导入类型注解
+from typing import Dict, List
+
+# 导入大模型调用模块
+import llm
+
+
+class StubState:
+    """
+    模拟服务的状态：每个prompt前几次请求返回429/503，统计同时处理的请求数
+    """
+
+    def __init__(self, failures_per_prompt: int = 2, latency: float = 0.05):
+        # 每个prompt在成功之前失败的次数
+        self.failures_per_prompt = failures_per_prompt
+        # 每个请求的处理延迟（秒）
+        self.latency = latency
+        self.lock = threading.Lock()
+        # prompt -> 已收到的请求次数
+        self.attempts: Dict[str, int] = {}
+        # 当前和历史最大的同时处理请求数
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # 收到的请求总数
+        self.requests = 0
+
+
+def _make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: Dict[str, str] = None):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, text: str):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            events = [
+                {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                 "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                for piece in (text[:len(text) // 2], text[len(text) // 2:])
+            ]
+            for event in [f"data: {json.dumps(event)}\n\n" for event in events] + ["data: [DONE]\n\n"]:
+                data = event.encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt = body["messages"][-1]["content"][0]["text"]
+            with state.lock:
+                state.requests += 1
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+                attempt = state.attempts.get(prompt, 0)
+                state.attempts[prompt] = attempt + 1
+            try:
+                time.sleep(2.0 if prompt.startswith("slow") else state.latency)
+                if prompt.startswith("bad"):
+                    self._send_json(400, {"error": {"message": "bad request", "type": "invalid_request_error"}})
+                elif attempt < state.failures_per_prompt:
+                    # 交替返回限流和服务不可用
+                    if attempt % 2 == 0:
+                        self._send_json(429, {"error": {"message": "rate limited"}}, {"Retry-After": "0"})
+                    else:
+                        self._send_json(503, {"error": {"message": "unavailable"}})
+                elif body.get("stream"):
+                    self._send_stream(f"echo:{prompt}")
+                else:
+                    self._send_json(200, {
+                        "id": "x", "object": "chat.completion", "created": 0, "model": "stub",
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": f"echo:{prompt}"},
+                                     "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                    })
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端超时断开
+                pass
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+    return Handler
+
+
+def start_stub_server(state: StubState) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动OpenAI兼容的模拟服务（随机端口）
+    参数:
+        state (StubState): 模拟服务的状态
+    返回:
+        ThreadingHTTPServer: 服务实例，server_address[1] 为端口
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="llm-stub-server", daemon=True).start()
+    return server
+
+
+def check(n_prompts: int = 40, max_concurrency: int = 8) -> List[str]:
+    """
+    针对本地模拟服务检查：重试、并发限制、批量调用、超时、限流和流式调用
+    参数:
+        n_prompts (int): 批量调用的请求数
+        max_concurrency (int): 并发上限
+    返回:
+        List[str]: 未通过的检查项，全部通过时为空列表
+    """
+    state = StubState()
+    server = start_stub_server(state)
+    llm.OPENAI_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    llm.LLM_MAX_CONCURRENCY = max_concurrency
+    llm.LLM_MAX_RETRIES = 3
+    # 缩短退避时间，使检查快速完成
+    llm.LLM_BACKOFF_BASE = 0.01
+    llm.LLM_BACKOFF_MAX = 0.1
+    llm.LLM_RATE_LIMIT = 0
+    llm._reset_clients()
+    problems = []
+    try:
+        # 批量调用：每个请求先失败两次再成功，同时处理的请求数不超过并发上限
+        prompts = [f"q{idx}" for idx in range(n_prompts)]
+        start = time.perf_counter()
+        answers = llm.invoke_many(prompts)
+        elapsed = time.perf_counter() - start
+        print(f"invoke_many：{n_prompts}个请求，{state.requests}次HTTP请求，"
+              f"最大并发{state.max_in_flight}，耗时{elapsed:.2f}s")
+        if answers != [f"echo:{prompt}" for prompt in prompts]:
+            problems.append("invoke_many 返回的回复与请求不对应")
+        if state.requests != n_prompts * (state.failures_per_prompt + 1):
+            problems.append(f"429/503 重试次数不符：收到{state.requests}次请求")
+        if state.max_in_flight > max_concurrency:
+            problems.append(f"同时处理的请求数{state.max_in_flight}超过并发上限{max_concurrency}")
+
+        # 400等客户端错误不重试
+        before = state.requests
+        results = llm.invoke_many(["bad-1"], return_exceptions=True)
+        if not isinstance(results[0], Exception) or state.requests - before != 1:
+            problems.append("400 错误不应重试，且 return_exceptions=True 时应返回异常对象")
+
+        # 单次请求超时：超时后重试，最终抛出异常
+        state.failures_per_prompt = 0
+        start = time.perf_counter()
+        try:
+            llm.invoke("slow-1", timeout=0.3)
+            problems.append("超时的请求没有抛出异常")
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            print(f"超时请求：{type(e).__name__}，耗时{elapsed:.2f}s")
+            if elapsed > 2.0:
+                problems.append(f"单次请求超时没有生效，耗时{elapsed:.2f}s")
+
+        # 令牌桶限流：每秒20个请求、容量1，20个请求至少需要约0.95秒
+        llm.LLM_RATE_LIMIT = 20
+        llm.LLM_RATE_BURST = 1
+        llm._reset_clients()
+        start = time.perf_counter()
+        llm.invoke_many([f"r{idx}" for idx in range(20)])
+        elapsed = time.perf_counter() - start
+        print(f"限流20请求/秒：20个请求耗时{elapsed:.2f}s")
+        if elapsed < 0.9:
+            problems.append(f"限流没有生效，20个请求耗时{elapsed:.2f}s")
+        llm.LLM_RATE_LIMIT = 0
+        llm._reset_clients()
+
+        # 流式调用：收到第一段内容之前的429/503会重试
+        state.failures_per_prompt = 2
+        answer = asyncio.run(llm.ainvoke("stream-1"))
+        if answer != "echo:stream-1":
+            problems.append(f"流式调用重试后的回复不正确：{answer}")
+    finally:
+        server.shutdown()
+        llm._reset_clients()
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check()
+    for problem in problems:
+        print(problem)
+    print("全部检查通过" if not problems else f"{len(problems)}项检查未通过")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,656 @@
+# 导入os模块，用于路径和环境变量
+import os
+# 导入json模块，用于保存索引参数
+import json
+# 导入time模块，用于统计构建和检索耗时
+import time
+# 导入shutil模块，用于替换和清理索引目录
+import shutil
+# 导入argparse模块，用于命令行构建和评估索引
+import argparse
+# 导入threading模块，保证索引实例只加载一次
+import threading
+# 导入抽象基类，约定各压缩方式需要实现的方法
+from abc import ABC, abstractmethod
+# 导入类型注解
+from typing import Dict, List, Optional, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于量化、k-means和检索计算
+import numpy as np
+
+# 导入数据库相关的函数和默认配置
+import db
+
+logger = logging.getLogger(__name__)
+
+# 是否在向量检索时使用压缩索引，设置环境变量 RAG_COMPRESSED_INDEX=1 开启（需先构建索引）
+COMPRESSED_INDEX_ENABLED = os.getenv("RAG_COMPRESSED_INDEX", "0") == "1"
+# 默认的压缩方式："int8" 标量量化（每个向量 dim 字节，约4倍压缩）；"ivfpq" 倒排+乘积量化（默认约16倍压缩）
+DEFAULT_INDEX_MODE = os.getenv("RAG_COMPRESSED_MODE", "ivfpq")
+# 支持的压缩方式
+INDEX_MODES = ("int8", "ivfpq")
+# IVF检索时探查的倒排列表数，越大召回越高、越慢
+DEFAULT_NPROBE = int(os.getenv("RAG_COMPRESSED_NPROBE", "16"))
+# 用全精度向量重新打分的候选数量，越大召回越高、越慢，0表示不重新打分
+DEFAULT_RERANK_DEPTH = int(os.getenv("RAG_COMPRESSED_RERANK_DEPTH", "100"))
+# 乘积量化每个子向量的维度：384维、每段4维时为96段，每个向量96字节（float32的1/16）
+DEFAULT_PQ_SUBVECTOR_DIM = 4
+# 每段子向量的码本大小（一个字节）
+_PQ_CODEBOOK_SIZE = 256
+# 训练k-means使用的最大样本数
+DEFAULT_TRAIN_SIZE = 100000
+# 训练乘积量化码本使用的最大样本数（每个码本中心平均32个样本已足够，样本越多构建越慢）
+DEFAULT_PQ_TRAIN_SIZE = 8192
+# k-means的迭代次数
+DEFAULT_KMEANS_ITERATIONS = 15
+# 评估时允许的recall@10下降：压缩索引的recall@10不应低于 1 - 该值（以全精度精确检索为基准）
+DEFAULT_RECALL_TOLERANCE = 0.05
+# 分块计算时每块的行数，限制临时内存
+_BLOCK_ROWS = 65536
+# 从集合读取向量时每批的数量
+_READ_BATCH_SIZE = 5000
+
+# 全局索引实例：集合名称 -> (索引, 加载时参数文件的修改时间)
+_indexes: Dict[str, Tuple["CompressedIndex", float]] = {}
+# 加载索引实例时使用的锁
+_indexes_lock = threading.Lock()
+# 已提示过索引过期的集合状态，避免每次查询都记录警告
+_stale_warned: Dict[str, Tuple[int, int]] = {}
+
+
+def index_dir(collection_name: str = db.DEFAULT_COLLECTION_NAME, path: Optional[str] = None) -> str:
+    """
+    压缩索引的目录：与ChromaDB数据目录放在一起，每个集合一个子目录
+    参数:
+        collection_name (str): 集合名称
+        path (str, optional): 数据库路径，默认为 db.DEFAULT_DB_PATH
+    返回:
+        str: 目录路径
+    """
+    return os.path.join(f"{path or db.DEFAULT_DB_PATH}_compressed", collection_name)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    # 归一化为单位向量，内积即为余弦相似度
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    分块计算每个向量最近的中心（欧氏距离）
+    参数:
+        data (np.ndarray): 向量矩阵
+        centroids (np.ndarray): 中心矩阵
+    返回:
+        np.ndarray: 每个向量最近的中心序号
+    """
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    nearest = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), _BLOCK_ROWS):
+        block = np.asarray(data[start:start + _BLOCK_ROWS], dtype=np.float32)
+        # ||x - c||² = ||x||² - 2x·c + ||c||²，||x||²与中心无关，省略
+        nearest[start:start + len(block)] = np.argmin(centroid_norms - 2.0 * block @ centroids.T, axis=1)
+    return nearest
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = DEFAULT_KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """
+    k-means聚类（Lloyd算法），空的簇用随机样本重新初始化
+    参数:
+        data (np.ndarray): 训练样本
+        k (int): 簇的数量，样本不足时取样本数
+        iterations (int): 迭代次数
+        seed (int): 随机种子
+    返回:
+        np.ndarray: 中心矩阵 (k, 维度)
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(data, centroids)
+        counts = np.bincount(assign, minlength=k)
+        # 按簇排序后用reduceat求和，比逐行累加快得多
+        order = np.argsort(assign, kind="stable")
+        starts = np.searchsorted(assign[order], np.arange(k))
+        nonempty = counts > 0
+        sums = np.add.reduceat(data[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+def _encode_ids(ids: List[str]) -> Tuple[np.ndarray, str]:
+    # 文本ID是32位十六进制的md5，按16字节二进制存放；其他格式的ID按定长字符串存放
+    if all(len(text_id) == 32 for text_id in ids):
+        try:
+            return np.frombuffer(b"".join(bytes.fromhex(text_id) for text_id in ids), dtype="S16").copy(), "md5"
+        except ValueError:
+            pass
+    return np.asarray(ids, dtype=str), "str"
+
+
+def _decode_id(value, id_format: str) -> str:
+    return value.hex() if id_format == "md5" else str(value)
+
+
+class CompressedIndex(ABC):
+    """
+    压缩向量索引的公共部分：检索时先用压缩编码近似打分（非对称距离：查询向量保持全精度，
+    只有库中的向量被压缩），再用磁盘上的全精度向量（内存映射，只读取候选行）对前rerank_depth个候选重新打分。
+    常驻内存的只有压缩编码和码本；ID和全精度向量按需从内存映射文件中读取。
+    """
+
+    mode = ""
+
+    def __init__(self, directory: str, meta: dict):
+        # 索引目录
+        self.directory = directory
+        # 索引参数：维度、条数、ID格式、构建时的集合状态等
+        self.meta = meta
+        self.dim = int(meta["dim"])
+        # 文本ID和全精度向量（与压缩编码按相同顺序排列）
+        self._ids = np.load(os.path.join(directory, "ids.npy"), mmap_mode="r")
+        self._vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return int(self.meta["count"])
+
+    @abstractmethod
+    def bytes_per_vector(self) -> float:
+        """
+        返回:
+            float: 每个向量常驻内存的压缩编码字节数
+        """
+
+    def compression_ratio(self) -> float:
+        """
+        返回:
+            float: 相对float32向量的压缩倍数
+        """
+        return self.dim * 4 / self.bytes_per_vector()
+
+    @abstractmethod
+    def _candidates(self, queries: np.ndarray, depth: int, nprobe: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        用压缩编码近似打分，返回每个查询的候选位置和近似得分
+        参数:
+            queries (np.ndarray): 归一化后的查询向量 (查询数, 维度)
+            depth (int): 每个查询保留的候选数量
+            nprobe (int): 探查的倒排列表数（仅IVF）
+        返回:
+            List[Tuple[np.ndarray, np.ndarray]]: 每个查询的 (候选位置, 近似得分)
+        """
+
+    def search(
+        self,
+        query_embeddings,
+        n_results: int,
+        nprobe: Optional[int] = None,
+        rerank_depth: Optional[int] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        检索最相似的向量
+        参数:
+            query_embeddings: 一个或多个查询向量
+            n_results (int): 每个查询返回的结果数量
+            nprobe (int, optional): 探查的倒排列表数，默认读取环境变量 RAG_COMPRESSED_NPROBE
+            rerank_depth (int, optional): 用全精度向量重新打分的候选数量，默认读取环境变量 RAG_COMPRESSED_RERANK_DEPTH
+        返回:
+            List[List[Tuple[str, float]]]: 每个查询按相似度从高到低排列的 (文本ID, 余弦相似度)
+        """
+        nprobe = DEFAULT_NPROBE if nprobe is None else nprobe
+        rerank_depth = DEFAULT_RERANK_DEPTH if rerank_depth is None else rerank_depth
+        queries = _normalize(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        id_format = self.meta["id_format"]
+        results = []
+        for query, (positions, scores) in zip(queries, self._candidates(queries, max(n_results, rerank_depth), nprobe)):
+            if rerank_depth > 0 and len(positions):
+                # 按位置排序后读取，内存映射文件的访问更接近顺序读
+                positions = np.sort(positions)
+                scores = np.asarray(self._vectors[positions], dtype=np.float32) @ query
+            top = np.argsort(-scores, kind="stable")[:n_results]
+            results.append([(_decode_id(self._ids[positions[idx]], id_format), float(scores[idx])) for idx in top])
+        return results
+
+    @staticmethod
+    def _top(scores: np.ndarray, depth: int) -> np.ndarray:
+        # 得分最高的depth个位置（不排序）
+        if depth >= len(scores):
+            return np.arange(len(scores))
+        return np.argpartition(-scores, depth - 1)[:depth]
+
+
+class ScalarQuantizedIndex(CompressedIndex):
+    """
+    int8标量量化：每一维按训练样本的最小值/最大值线性量化为一个字节，每个向量 dim 字节（float32的1/4）。
+    近似得分 q·x̂ = q·min + (q*scale)·code，所有查询在一次遍历编码矩阵中完成。
+    """
+
+    mode = "int8"
+
+    def __init__(self, directory: str, meta: dict):
+        super().__init__(directory, meta)
+        # 量化编码常驻内存
+        self.codes = np.load(os.path.join(directory, "codes.npy"))
+        self.minimum = np.load(os.path.join(directory, "minimum.npy"))
+        self.scale = np.load(os.path.join(directory, "scale.npy"))
+
+    def bytes_per_vector(self) -> float:
+        return float(self.codes.shape[1])
+
+    @staticmethod
+    def train(sample: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        训练量化参数
+        参数:
+            sample (np.ndarray): 训练样本
+        返回:
+            Tuple[np.ndarray, np.ndarray]: (每一维的最小值, 每一维的量化步长)
+        """
+        minimum = sample.min(axis=0)
+        scale = np.maximum(sample.max(axis=0) - minimum, 1e-12) / 255.0
+        return minimum.astype(np.float32), scale.astype(np.float32)
+
+    @staticmethod
+    def encode(vectors: np.ndarray, minimum: np.ndarray, scale: np.ndarray) -> np.ndarray:
+        """
+        量化向量，超出训练范围的值截断
+        参数:
+            vectors (np.ndarray): 向量
+            minimum (np.ndarray): 每一维的最小值
+            scale (np.ndarray): 每一维的量化步长
+        返回:
+            np.ndarray: uint8编码
+        """
+        return np.clip(np.rint((vectors - minimum) / scale), 0, 255).astype(np.uint8)
+
+    def _candidates(self, queries: np.ndarray, depth: int, nprobe: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        scaled = (queries * self.scale).T
+        offsets = queries @ self.minimum
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), _BLOCK_ROWS):
+            block = self.codes[start:start + _BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = (block @ scaled).T
+        scores += offsets[:, None]
+        candidates = []
+        for row in scores:
+            positions = self._top(row, depth)
+            candidates.append((positions, row[positions]))
+        return candidates
+
+
+class IVFPQIndex(CompressedIndex):
+    """
+    倒排+乘积量化（IVF-PQ）：k-means把向量划分到n_lists个倒排列表，
+    每个向量相对所属中心的残差切成m段，每段用256个中心的码本编码为一个字节，每个向量m字节。
+    检索时只探查与查询最相近的nprobe个列表；每个查询预先计算 (m, 256) 的查询-码本内积表，
+    近似得分 q·x ≈ q·中心 + Σ 表[段, 编码]（非对称距离计算）。
+    """
+
+    mode = "ivfpq"
+
+    def __init__(self, directory: str, meta: dict):
+        super().__init__(directory, meta)
+        self.centroids = np.load(os.path.join(directory, "centroids.npy"))
+        # 码本 (m, 256, 每段维度)
+        self.codebooks = np.load(os.path.join(directory, "codebooks.npy"))
+        # 编码按倒排列表排序存放，第i个列表的编码位于 offsets[i]:offsets[i+1]
+        self.codes = np.load(os.path.join(directory, "codes.npy"))
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"))
+
+    def bytes_per_vector(self) -> float:
+        return float(self.codes.shape[1])
+
+    def _candidates(self, queries: np.ndarray, depth: int, nprobe: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        n_lists = len(self.centroids)
+        n_sub, _, sub_dim = self.codebooks.shape
+        nprobe = max(1, min(nprobe, n_lists))
+        coarse_all = queries @ self.centroids.T
+        candidates = []
+        for query, coarse in zip(queries, coarse_all):
+            lists = self._top(coarse, nprobe)
+            lengths = self.offsets[lists + 1] - self.offsets[lists]
+            positions = np.concatenate([np.arange(self.offsets[idx], self.offsets[idx + 1]) for idx in lists])
+            if not len(positions):
+                candidates.append((positions, np.empty(0, dtype=np.float32)))
+                continue
+            # 查询每段子向量与该段码本中每个中心的内积
+            table = np.einsum("skd,sd->sk", self.codebooks, query.reshape(n_sub, sub_dim))
+            scores = np.repeat(coarse[lists], lengths) + table[np.arange(n_sub), self.codes[positions]].sum(axis=1)
+            top = self._top(scores, depth)
+            candidates.append((positions[top], scores[top]))
+        return candidates
+
+
+_INDEX_CLASSES = {cls.mode: cls for cls in (ScalarQuantizedIndex, IVFPQIndex)}
+
+
+def load_index(directory: str) -> Optional[CompressedIndex]:
+    """
+    从目录加载压缩索引
+    参数:
+        directory (str): 索引目录
+    返回:
+        Optional[CompressedIndex]: 索引实例，目录中没有索引时为None
+    """
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    index = _INDEX_CLASSES[meta["mode"]](directory, meta)
+    logger.info(f"已加载压缩索引（{meta['mode']}）：{directory}，共{len(index)}条向量，每条{index.bytes_per_vector():.0f}字节")
+    return index
+
+
+def _read_collection(collection, vectors_path: str) -> Tuple[List[str], np.ndarray]:
+    """
+    分批读出集合中的全部ID和向量，向量归一化后写入内存映射文件，不需要一次性载入内存
+    参数:
+        collection: ChromaDB集合实例
+        vectors_path (str): 全精度向量文件路径
+    返回:
+        Tuple[List[str], np.ndarray]: (ID列表, 内存映射的向量矩阵)
+    异常:
+        ValueError: 集合为空
+    """
+    total = collection.count()
+    if total == 0:
+        raise ValueError("集合为空，无法构建压缩索引")
+    ids: List[str] = []
+    vectors = None
+    offset = 0
+    while len(ids) < total:
+        page = collection.get(include=["embeddings"], limit=_READ_BATCH_SIZE, offset=offset)
+        page_ids = page.get("ids") or []
+        if not page_ids:
+            break
+        page_ids = page_ids[:total - len(ids)]
+        embeddings = _normalize(np.asarray(page["embeddings"], dtype=np.float32)[:len(page_ids)])
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(total, embeddings.shape[1]))
+        vectors[len(ids):len(ids) + len(page_ids)] = embeddings
+        ids.extend(page_ids)
+        offset += len(page_ids)
+    vectors.flush()
+    # 读取过程中集合变小时，只保留实际读到的行
+    return ids, vectors[:len(ids)]
+
+
+def build_index(
+    collection_name: str = db.DEFAULT_COLLECTION_NAME,
+    mode: str = DEFAULT_INDEX_MODE,
+    n_lists: Optional[int] = None,
+    pq_subvector_dim: int = DEFAULT_PQ_SUBVECTOR_DIM,
+    train_size: int = DEFAULT_TRAIN_SIZE,
+    iterations: int = DEFAULT_KMEANS_ITERATIONS,
+    directory: Optional[str] = None,
+    collection=None
+) -> CompressedIndex:
+    """
+    从集合中读出全部向量，构建压缩索引并原子地替换旧索引
+    参数:
+        collection_name (str): 集合名称，默认为 "rag"
+        mode (str): 压缩方式，"int8" 或 "ivfpq"
+        n_lists (int, optional): IVF倒排列表数，默认为 4*sqrt(向量条数)
+        pq_subvector_dim (int): 乘积量化每段子向量的维度，需整除向量维度，默认为4（约16倍压缩）
+        train_size (int): 训练使用的最大样本数
+        iterations (int): k-means的迭代次数
+        directory (str, optional): 索引目录，默认为 index_dir(collection_name)
+        collection (optional): 集合实例，默认通过 db._get_collection 获取
+    返回:
+        CompressedIndex: 新构建的索引
+    异常:
+        ValueError: 不支持的压缩方式、集合为空或参数不合法
+    """
+    if mode not in INDEX_MODES:
+        raise ValueError(f"不支持的压缩方式：{mode}，可选：{', '.join(INDEX_MODES)}")
+    directory = directory or index_dir(collection_name)
+    collection = collection if collection is not None else db._get_collection(collection_name)
+    # 开始构建时的集合状态：条数和持久化的版本号（见 db.get_collection_version），
+    # 记录在索引参数中，任何进程之后的写入或删除（即使条数不变）都会使索引过期
+    count_before = collection.count()
+    version_before = db.get_collection_version(collection_name)
+    start = time.perf_counter()
+    tmp_dir = f"{directory}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        ids, vectors = _read_collection(collection, os.path.join(tmp_dir, "vectors.npy"))
+        count, dim = vectors.shape
+        logger.info(f"开始构建压缩索引（{mode}）：{count}条{dim}维向量")
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[np.sort(rng.choice(count, min(count, train_size), replace=False))])
+        meta = {"mode": mode, "dim": dim, "count": count}
+        if mode == "int8":
+            minimum, scale = ScalarQuantizedIndex.train(sample)
+            codes = np.empty((count, dim), dtype=np.uint8)
+            for block_start in range(0, count, _BLOCK_ROWS):
+                block = np.asarray(vectors[block_start:block_start + _BLOCK_ROWS])
+                codes[block_start:block_start + len(block)] = ScalarQuantizedIndex.encode(block, minimum, scale)
+            np.save(os.path.join(tmp_dir, "minimum.npy"), minimum)
+            np.save(os.path.join(tmp_dir, "scale.npy"), scale)
+            order = None
+        else:
+            if dim % pq_subvector_dim:
+                raise ValueError(f"子向量维度{pq_subvector_dim}不能整除向量维度{dim}")
+            n_sub = dim // pq_subvector_dim
+            n_lists = n_lists or max(1, int(4 * np.sqrt(count)))
+            centroids = kmeans(sample, n_lists, iterations)
+            # 按所属倒排列表排序，同一列表的编码连续存放
+            assign = _nearest(vectors, centroids)
+            order = np.argsort(assign, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))])
+            # 用残差训练码本：每段子向量独立做k-means
+            # 样本按行号排序（即按入库顺序），码本的训练子集需从整个样本中随机抽取，不能取前面的部分
+            pq_rows = rng.choice(len(sample), min(len(sample), DEFAULT_PQ_TRAIN_SIZE), replace=False)
+            pq_sample = sample[pq_rows]
+            residual_sample = pq_sample - centroids[_nearest(pq_sample, centroids)]
+            residual_sample = residual_sample.reshape(-1, n_sub, pq_subvector_dim)
+            codebooks = np.stack([
+                kmeans(residual_sample[:, sub], _PQ_CODEBOOK_SIZE, iterations, seed=sub) for sub in range(n_sub)
+            ])
+            if codebooks.shape[1] < _PQ_CODEBOOK_SIZE:
+                # 样本太少时码本不足256个中心，用无穷远的中心补齐，保证编码仍是一个字节
+                padding = np.full((n_sub, _PQ_CODEBOOK_SIZE - codebooks.shape[1], pq_subvector_dim), 1e6, dtype=np.float32)
+                codebooks = np.concatenate([codebooks, padding], axis=1)
+            codes = np.empty((count, n_sub), dtype=np.uint8)
+            for block_start in range(0, count, _BLOCK_ROWS):
+                rows = order[block_start:block_start + _BLOCK_ROWS]
+                residual = np.asarray(vectors[rows]) - centroids[assign[rows]]
+                residual = residual.reshape(len(rows), n_sub, pq_subvector_dim)
+                for sub in range(n_sub):
+                    codes[block_start:block_start + len(rows), sub] = _nearest(residual[:, sub], codebooks[sub])
+            np.save(os.path.join(tmp_dir, "centroids.npy"), centroids)
+            np.save(os.path.join(tmp_dir, "codebooks.npy"), codebooks.astype(np.float32))
+            np.save(os.path.join(tmp_dir, "offsets.npy"), offsets.astype(np.int64))
+            meta.update({"n_lists": int(len(centroids)), "pq_subvector_dim": pq_subvector_dim})
+            # 全精度向量和ID也按倒排列表的顺序重排，与编码位置一致
+            sorted_path = os.path.join(tmp_dir, "vectors.sorted.npy")
+            sorted_vectors = np.lib.format.open_memmap(sorted_path, mode="w+", dtype=np.float32, shape=(count, dim))
+            for block_start in range(0, count, _BLOCK_ROWS):
+                sorted_vectors[block_start:block_start + _BLOCK_ROWS] = vectors[order[block_start:block_start + _BLOCK_ROWS]]
+            sorted_vectors.flush()
+            del sorted_vectors, vectors
+            os.replace(sorted_path, os.path.join(tmp_dir, "vectors.npy"))
+        np.save(os.path.join(tmp_dir, "codes.npy"), codes)
+        ordered_ids = ids if order is None else [ids[idx] for idx in order]
+        encoded_ids, meta["id_format"] = _encode_ids(ordered_ids)
+        np.save(os.path.join(tmp_dir, "ids.npy"), encoded_ids)
+        meta["collection_count"] = count_before
+        meta["collection_version"] = version_before
+        meta["build_seconds"] = time.perf_counter() - start
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        logger.error(f"构建压缩索引失败：{str(e)}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    # 先把旧索引移开再换上新索引，正在使用旧索引的进程持有的内存映射不受影响
+    old_dir = f"{directory}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_dir)
+    os.replace(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    index = load_index(directory)
+    logger.info(
+        f"压缩索引构建完成：{count}条向量，每条{index.bytes_per_vector():.0f}字节"
+        f"（压缩{index.compression_ratio():.0f}倍），耗时{meta['build_seconds']:.1f}s"
+    )
+    return index
+
+
+def _is_current(index: CompressedIndex, count: int, version: int) -> bool:
+    # 与构建索引时记录的集合状态比较；旧版本构建的索引没有记录版本号，视为过期
+    return index.meta.get("collection_count") == count and index.meta.get("collection_version") == version
+
+
+def refresh_index(collection_name: str = db.DEFAULT_COLLECTION_NAME, **kwargs) -> Optional[CompressedIndex]:
+    """
+    集合的向量条数或版本号与构建索引时不同（或还没有索引）时重新构建，参数沿用旧索引
+    参数:
+        collection_name (str): 集合名称
+        **kwargs: 传给 build_index 的参数，覆盖旧索引的参数
+    返回:
+        Optional[CompressedIndex]: 重新构建的索引，没有变化时为None
+    """
+    collection = kwargs.pop("collection", None)
+    collection = collection if collection is not None else db._get_collection(collection_name)
+    directory = kwargs.get("directory") or index_dir(collection_name)
+    current = load_index(directory)
+    if current is not None and _is_current(
+        current, collection.count(), db.get_collection_version(collection_name)
+    ):
+        logger.info(f"集合{collection_name}没有变化，压缩索引无需重建")
+        return None
+    if current is not None:
+        kwargs.setdefault("mode", current.meta["mode"])
+        kwargs.setdefault("n_lists", current.meta.get("n_lists"))
+        kwargs.setdefault("pq_subvector_dim", current.meta.get("pq_subvector_dim", DEFAULT_PQ_SUBVECTOR_DIM))
+    return build_index(collection_name, collection=collection, **kwargs)
+
+
+def get_index(collection_name: str, collection) -> Optional[CompressedIndex]:
+    """
+    获取集合可用的压缩索引（延迟加载；索引目录被重建后自动重新加载）。
+    集合在索引构建后发生了变化（条数或版本号与构建时记录的不同）时返回None，调用方退回到集合本身的检索
+    参数:
+        collection_name (str): 集合名称
+        collection: ChromaDB集合实例
+    返回:
+        Optional[CompressedIndex]: 索引实例，没有索引或索引已过期时为None
+    """
+    directory = index_dir(collection_name)
+    meta_path = os.path.join(directory, "meta.json")
+    try:
+        mtime = os.path.getmtime(meta_path)
+    except OSError:
+        return None
+    with _indexes_lock:
+        cached = _indexes.get(collection_name)
+        if cached is None or cached[1] != mtime:
+            index = load_index(directory)
+            if index is None:
+                return None
+            cached = (index, mtime)
+            _indexes[collection_name] = cached
+    index = cached[0]
+    state = (collection.count(), db.get_collection_version(collection_name))
+    if not _is_current(index, *state):
+        if _stale_warned.get(collection_name) != state:
+            _stale_warned[collection_name] = state
+            logger.warning(f"集合{collection_name}在压缩索引构建后发生了变化，暂时改用集合检索，请运行 compressed_index.py refresh")
+        return None
+    return index
+
+
+def evaluate(
+    index: CompressedIndex,
+    n_queries: int = 200,
+    k: int = 10,
+    nprobe: Optional[int] = None,
+    rerank_depth: Optional[int] = None,
+    noise: float = 0.05,
+    seed: int = 0
+) -> dict:
+    """
+    评估压缩索引相对全精度精确检索的recall@k和延迟。
+    查询向量取库中随机向量加少量噪声（模拟与已有文本相近的问题）
+    参数:
+        index (CompressedIndex): 压缩索引
+        n_queries (int): 查询数量
+        k (int): 召回位置
+        nprobe (int, optional): 探查的倒排列表数
+        rerank_depth (int, optional): 重新打分的候选数量
+        noise (float): 噪声的标准差（相对单位向量）
+        seed (int): 随机种子
+    返回:
+        dict: recall@k、每次查询的平均耗时、每个向量的字节数和压缩倍数
+    """
+    rng = np.random.default_rng(seed)
+    vectors = index._vectors
+    picks = rng.choice(len(index), min(n_queries, len(index)), replace=False)
+    queries = _normalize(np.asarray(vectors[np.sort(picks)]) + rng.normal(0, noise, (len(picks), index.dim)))
+    # 全精度精确检索的结果作为基准
+    exact_scores = np.empty((len(queries), len(index)), dtype=np.float32)
+    for start in range(0, len(index), _BLOCK_ROWS):
+        exact_scores[:, start:start + _BLOCK_ROWS] = queries @ np.asarray(vectors[start:start + _BLOCK_ROWS]).T
+    id_format = index.meta["id_format"]
+    truth = [
+        {_decode_id(index._ids[idx], id_format) for idx in np.argpartition(-row, k - 1)[:k]}
+        for row in exact_scores
+    ]
+    start = time.perf_counter()
+    found = [index.search(query, k, nprobe, rerank_depth)[0] for query in queries]
+    seconds = time.perf_counter() - start
+    recall = float(np.mean([len({text_id for text_id, _ in row} & expected) / k for row, expected in zip(found, truth)]))
+    return {
+        "mode": index.mode,
+        "count": len(index),
+        f"recall@{k}": recall,
+        "ms_per_query": seconds * 1000.0 / len(queries),
+        "bytes_per_vector": index.bytes_per_vector(),
+        "compression_ratio": index.compression_ratio(),
+        "nprobe": DEFAULT_NPROBE if nprobe is None else nprobe,
+        "rerank_depth": DEFAULT_RERANK_DEPTH if rerank_depth is None else rerank_depth,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="构建、刷新和评估集合的压缩向量索引（int8 / IVF-PQ）")
+    parser.add_argument("command", choices=["build", "refresh", "eval"])
+    parser.add_argument("--collection", default=db.DEFAULT_COLLECTION_NAME)
+    parser.add_argument("--mode", choices=INDEX_MODES)
+    parser.add_argument("--n-lists", type=int, help="IVF倒排列表数，默认为 4*sqrt(向量条数)")
+    parser.add_argument("--pq-subvector-dim", type=int, help="乘积量化每段子向量的维度，默认为4")
+    parser.add_argument("--nprobe", type=int, help="评估时探查的倒排列表数")
+    parser.add_argument("--rerank-depth", type=int, help="评估时重新打分的候选数量")
+    parser.add_argument("--queries", type=int, default=200, help="评估使用的查询数量")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_RECALL_TOLERANCE, help="允许的recall@10下降")
+    args = parser.parse_args()
+
+    options = {key: value for key, value in (
+        ("mode", args.mode), ("n_lists", args.n_lists), ("pq_subvector_dim", args.pq_subvector_dim)
+    ) if value is not None}
+    if args.command == "build":
+        build_index(args.collection, **options)
+    elif args.command == "refresh":
+        refresh_index(args.collection, **options)
+    else:
+        index = load_index(index_dir(args.collection))
+        if index is None:
+            raise SystemExit(f"集合{args.collection}还没有压缩索引，请先运行 build")
+        report = evaluate(index, args.queries, 10, args.nprobe, args.rerank_depth)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        # recall@10 低于容差时以非零状态退出，便于在部署前检查
+        if report["recall@10"] < 1.0 - args.tolerance:
+            raise SystemExit(f"recall@10 = {report['recall@10']:.3f}，低于 {1.0 - args.tolerance:.3f}")
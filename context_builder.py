@@ -0,0 +1,178 @@
+# 导入os模块，用于读取环境变量
+import os
+# 导入正则表达式，用于估算token数量
+import re
+# 导入类型注解
+from typing import Callable, List, Optional, Set
+# 导入logging模块，用于日志记录
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 上下文的默认token预算，超出预算的低相关文本块不放入prompt
+DEFAULT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "3000"))
+# 判定两个文本块首尾重叠所需的最少字符数（过短的重叠可能只是巧合）
+DEFAULT_MIN_OVERLAP = int(os.getenv("RAG_CONTEXT_MIN_OVERLAP", "8"))
+# 两个文本块的字符n-gram Jaccard相似度不低于该值时视为近似重复
+DEFAULT_DUPLICATE_THRESHOLD = float(os.getenv("RAG_CONTEXT_DUPLICATE_THRESHOLD", "0.9"))
+# 近似去重使用的字符n-gram长度
+_SHINGLE_SIZE = 3
+# 上下文中文本块之间的分隔符
+CONTEXT_SEPARATOR = "\n"
+# 固定的系统提示词：每次调用都以完全相同的内容开头，服务端的前缀缓存（DeepSeek/OpenAI兼容接口）才能命中
+SYSTEM_PROMPT = (
+    "你是一个基于知识库的问答助手。用户消息中会先给出“已知信息”，再给出问题。"
+    "请只根据已知信息回答问题；已知信息不足以回答时，请直接说明无法从已知信息中找到答案，不要编造。"
+)
+
+# 一个中日韩字符约为一个token，其余文本按空白和标点切分后每个单词约为一个token
+# 中日韩字符的Unicode范围：平假名/片假名、扩展A、基本汉字、兼容汉字、韩文音节
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_CJK_PATTERN = re.compile(f"[{_CJK_RANGES}]")
+_WORD_PATTERN = re.compile(f"[A-Za-z0-9_]+|[^\\sA-Za-z0-9_{_CJK_RANGES}]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    不依赖分词器估算文本的token数量：中日韩字符每字计1个，英文单词/数字每个计1个，标点每个计1个
+    参数:
+        text (str): 文本
+    返回:
+        int: 估算的token数量
+    """
+    return len(_CJK_PATTERN.findall(text)) + len(_WORD_PATTERN.findall(text))
+
+
+def _overlap_length(left: str, right: str, min_overlap: int) -> int:
+    """
+    计算left的末尾与right的开头重叠的最长字符数
+    参数:
+        left (str): 前一个文本块
+        right (str): 后一个文本块
+        min_overlap (int): 最少重叠字符数
+    返回:
+        int: 重叠字符数，小于min_overlap时为0
+    """
+    for size in range(min(len(left), len(right)) - 1, min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_overlapping(chunks: List[str], min_overlap: int = DEFAULT_MIN_OVERLAP) -> List[str]:
+    """
+    把首尾重叠的文本块（分块时的chunk_overlap部分）拼回连续的片段，并去掉被其他文本块完全包含的文本块。
+    合并后的片段位于其中相关性最高的文本块所在的位置。
+    参数:
+        chunks (List[str]): 按相关性从高到低排列的文本块
+        min_overlap (int): 判定重叠所需的最少字符数
+    返回:
+        List[str]: 合并后的片段，按相关性从高到低排列
+    """
+    spans = [chunk for chunk in chunks if chunk and chunk.strip()]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(spans)):
+            for j in range(len(spans)):
+                if i == j:
+                    continue
+                left, right = spans[i], spans[j]
+                if right in left:
+                    # right已被left完整包含
+                    text = left
+                else:
+                    size = _overlap_length(left, right, min_overlap)
+                    if not size:
+                        continue
+                    text = left + right[size:]
+                # 合并后的片段保留在较靠前（相关性较高）的位置
+                keep, drop = min(i, j), max(i, j)
+                spans[keep] = text
+                del spans[drop]
+                merged = True
+                break
+            if merged:
+                break
+    return spans
+
+
+def _shingles(text: str, size: int = _SHINGLE_SIZE) -> Set[str]:
+    text = "".join(text.split())
+    if len(text) <= size:
+        return {text}
+    return {text[idx:idx + size] for idx in range(len(text) - size + 1)}
+
+
+def drop_near_duplicates(chunks: List[str], threshold: float = DEFAULT_DUPLICATE_THRESHOLD) -> List[str]:
+    """
+    去掉与更相关的文本块近似重复的文本块（字符n-gram的Jaccard相似度不低于threshold）
+    参数:
+        chunks (List[str]): 按相关性从高到低排列的文本块
+        threshold (float): 近似重复的相似度阈值
+    返回:
+        List[str]: 去重后的文本块，顺序不变
+    """
+    kept: List[str] = []
+    kept_shingles: List[Set[str]] = []
+    for chunk in chunks:
+        shingles = _shingles(chunk)
+        duplicate = any(
+            len(shingles & other) / max(len(shingles | other), 1) >= threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(chunk)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def pack_context(
+    chunks: List[str],
+    token_budget: Optional[int] = None,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+    min_overlap: int = DEFAULT_MIN_OVERLAP,
+    duplicate_threshold: float = DEFAULT_DUPLICATE_THRESHOLD
+) -> List[str]:
+    """
+    构建上下文：合并重叠/相邻的文本块、去掉近似重复，再按相关性顺序填充token预算
+    参数:
+        chunks (List[str]): 按相关性从高到低排列的文本块
+        token_budget (int, optional): 上下文的token预算，默认读取环境变量 RAG_CONTEXT_TOKEN_BUDGET，小于等于0表示不限制
+        count_tokens (Callable[[str], int]): token计数函数，默认使用 estimate_tokens，可替换为模型的分词器
+        min_overlap (int): 判定重叠所需的最少字符数
+        duplicate_threshold (float): 近似重复的相似度阈值
+    返回:
+        List[str]: 放入上下文的片段，按相关性从高到低排列
+    """
+    if token_budget is None:
+        token_budget = DEFAULT_TOKEN_BUDGET
+    spans = drop_near_duplicates(merge_overlapping(chunks, min_overlap), duplicate_threshold)
+    if token_budget <= 0:
+        return spans
+    packed = []
+    used = 0
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+    for span in spans:
+        cost = count_tokens(span) + (separator_tokens if packed else 0)
+        # 放不下的片段跳过，后面更短的片段仍可能放得下
+        if used + cost > token_budget:
+            continue
+        packed.append(span)
+        used += cost
+    if len(packed) < len(spans):
+        logger.info(f"上下文超出token预算{token_budget}，保留{len(packed)}/{len(spans)}个片段，约{used}个token")
+    logger.debug(f"上下文构建完成：{len(chunks)}个文本块合并去重为{len(spans)}个片段，约{used}个token")
+    return packed
+
+
+def build_context(chunks: List[str], token_budget: Optional[int] = None) -> str:
+    """
+    构建拼接好的上下文文本，见 pack_context
+    参数:
+        chunks (List[str]): 按相关性从高到低排列的文本块
+        token_budget (int, optional): 上下文的token预算
+    返回:
+        str: 上下文文本
+    """
+    return CONTEXT_SEPARATOR.join(pack_context(chunks, token_budget))
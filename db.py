@@ -1,15 +1,26 @@
-# 导入chromadb库
-import chromadb
-# 导入Optional类型
-from typing import Optional
+# 导入Optional、List、Dict、Callable类型
+from typing import Optional, List, Dict, Callable, TYPE_CHECKING
 # 导入 logging 模块，用于记录日志
 import logging
 
-from huggingface_hub import metadata_save
-# 导入 sentence_transformers 库中的 SentenceTransformer 类
-from sentence_transformers import SentenceTransformer
+# chromadb和sentence_transformers（含torch）导入很慢，只在类型检查时导入，
+# 运行时由registry在第一次使用时导入
+if TYPE_CHECKING:
+    import chromadb
+    from sentence_transformers import SentenceTransformer
 # 导入hash计算唯一id
 import hashlib
+# 导入os模块，用于创建版本号数据库所在的目录
+import os
+# 导入sqlite3模块，用于跨进程共享集合版本号
+import sqlite3
+# 导入threading模块，保证版本号读写的线程安全
+import threading
+
+# 导入进程内共享的模型/客户端注册表
+import registry
+# 导入指标模块，记录入库各阶段耗时
+import metrics
 
 logger = logging.getLogger(__name__)
 # 设置默认的集合名称
@@ -18,46 +29,189 @@ DEFAULT_COLLECTION_NAME = "rag"
 DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
 # 设置默认的数据库文件路径
 DEFAULT_DB_PATH = "./chroma_db"
+# 设置默认的批量编码大小（每次送入模型的文本条数）
+DEFAULT_ENCODE_BATCH_SIZE = 64
+# 设置默认的批量写入大小（每次collection.get/add的最大条数）
+DEFAULT_WRITE_BATCH_SIZE = 1000
+
+# 定义全局变量 _version_conns，版本号数据库路径 -> SQLite连接（数据库路径可能在运行时被修改，按路径分别打开）
+_version_conns: Dict[str, sqlite3.Connection] = {}
+# 读写版本号使用的锁，同时保证监听函数按版本号顺序收到变化
+_version_lock = threading.RLock()
+# 定义全局变量 _change_listeners，集合内容变化时调用的监听函数
+_change_listeners: List[Callable[..., None]] = []
+
+def _get_version_conn() -> sqlite3.Connection:
+    # 版本号保存在与ChromaDB数据目录放在一起的SQLite文件中，所有进程共享
+    path = f"{DEFAULT_DB_PATH}_versions.sqlite"
+    conn = _version_conns.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS versions (collection TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        _version_conns[path] = conn
+    return conn
+
+def get_collection_version(collection_name: str = DEFAULT_COLLECTION_NAME) -> int:
+    """
+    获取集合的写入版本号：每次写入或删除后递增，保存在磁盘上，其他进程的写入同样可见，
+    依赖集合内容的索引和缓存据此判断是否过期
+    参数:
+        collection_name (str): 集合名称
+    返回:
+        int: 版本号
+    """
+    try:
+        with _version_lock:
+            row = _get_version_conn().execute(
+                "SELECT version FROM versions WHERE collection = ?", (collection_name,)
+            ).fetchone()
+        return row[0] if row else 0
+    except sqlite3.Error as e:
+        logger.error(f"读取集合版本号失败：{str(e)}")
+        raise
 
-# 定义全局变量 _model，用于存放 SentenceTransformer 实例，初始为 None
-_model: Optional[SentenceTransformer] = None
-# 定义全局变量 _client，用于存放 chromadb 的 PersistentClient 实例，初始为 None
-_client: Optional[chromadb.PersistentClient] = None
+def add_change_listener(listener: Callable[..., None]):
+    """
+    注册集合内容变化的监听函数，本进程每次写入或删除成功后调用，
+    依赖集合内容的索引（BM25、SimHash等）据此增量更新，不必重新读取整个集合
+    参数:
+        listener: 监听函数，参数为 (集合名称, 新版本号, 新增ID列表, 新增文本列表, 删除ID列表)
+    """
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+def _bump_collection_version(
+    collection_name: str,
+    added_ids: Optional[List[str]] = None,
+    added_documents: Optional[List[str]] = None,
+    removed_ids: Optional[List[str]] = None
+):
+    """
+    集合内容发生变化后递增版本号，并把本次变化通知给监听函数
+    参数:
+        collection_name (str): 集合名称
+        added_ids (List[str], optional): 新增（或覆盖写入）的文本ID
+        added_documents (List[str], optional): 与added_ids一一对应的文本
+        removed_ids (List[str], optional): 删除的文本ID
+    """
+    try:
+        with _version_lock:
+            conn = _get_version_conn()
+            # 在写事务中递增并读回，多个进程同时写入时每次变化得到不同的版本号
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO versions VALUES (?, 1) ON CONFLICT(collection) DO UPDATE SET version = version + 1",
+                    (collection_name,)
+                )
+                version = conn.execute("SELECT version FROM versions WHERE collection = ?", (collection_name,)).fetchone()[0]
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            for listener in list(_change_listeners):
+                try:
+                    listener(collection_name, version, added_ids or [], added_documents or [], removed_ids or [])
+                except Exception as e:
+                    # 监听函数失败不影响写入本身，相关索引会在下次全量比对时修正
+                    logger.warning(f"集合变化监听函数执行失败：{str(e)}")
+    except sqlite3.Error as e:
+        logger.error(f"更新集合版本号失败：{str(e)}")
+        raise
 
-def _get_model() -> SentenceTransformer:
+def _get_model() -> "SentenceTransformer":
     """
-    获取嵌入模型实例（单例模式）
+    获取嵌入模型实例（由注册表统一管理，进程内只加载一次；推理后端由环境变量 RAG_EMBED_BACKEND 决定）
     返回:
         SentenceTransformer: 嵌入模型实例
     """
-    # 声明使用全局变量 _model
-    global _model
-    if _model is None:
-        logger.info(f"正在加载嵌入模型：{DEFAULT_MODEL_NAME}")
-        _model = SentenceTransformer(DEFAULT_MODEL_NAME)
-        logger.info("嵌入模型加载完成")
-    return _model
+    return registry.get_model(DEFAULT_MODEL_NAME)
 
-def _get_client():
+def _get_client() -> "chromadb.ClientAPI":
     """
-    获取ChromaDB客户端实例（单例模式）
+    获取ChromaDB客户端实例（由注册表统一管理，同一路径只打开一次）
     返回:
         chromadb.PersistentClient: 客户端实例
     """
-    global _client
-    if _client is None:
-        logger.info(f"正在初始化Chromadb客户端,路径：{DEFAULT_DB_PATH}")
-        _client = chromadb.PersistentClient(path = DEFAULT_DB_PATH)
-        logger.info("Chromadb客户端初始化完成")
-    return _client
+    return registry.get_client(DEFAULT_DB_PATH)
+
+def _get_collection(collection_name: str = DEFAULT_COLLECTION_NAME) -> "chromadb.Collection":
+    """
+    获取指定名称的集合，不存在时创建（由注册表按名称缓存）
+    参数:
+        collection_name (str): 集合名称
+    返回:
+        chromadb.Collection: 集合实例
+    """
+    return registry.get_collection(collection_name, DEFAULT_DB_PATH)
+
+def encode_texts(texts: List[str], batch_size: int = DEFAULT_ENCODE_BATCH_SIZE) -> List[List[float]]:
+    """
+    使用全局模型批量生成文本的embedding，优先读取磁盘嵌入缓存
+    参数:
+        texts (List[str]): 文本列表
+        batch_size (int): 每批送入模型编码的文本数量，默认为 64
+    返回:
+        List[List[float]]: 与texts一一对应的embedding列表
+    """
+    # 延迟导入，避免embed_cache与db之间循环导入
+    import embed_cache
+    # 缓存按模型名称和推理后端区分
+    namespace = registry.cache_namespace(DEFAULT_MODEL_NAME)
+    return embed_cache.encode_with_cache(_get_model(), namespace, texts, batch_size=batch_size).tolist()
+
+def _compute_text_id(text: str) -> str:
+    """
+    使用文本内容的md5哈希值生成唯一的文本ID
+    参数:
+        text (str): 文本内容
+    返回:
+        str: 十六进制的文本ID
+    """
+    # text.encode() 将字符串转换为字节串（bytes）
+    # hexdigest() 转换为十六进制字符串
+    return hashlib.md5(text.encode()).hexdigest()
+
+def _get_existing_ids(collection, ids: List[str], batch_size: int = DEFAULT_WRITE_BATCH_SIZE) -> set:
+    """
+    批量查询集合中已存在的ID
+    参数:
+        collection: ChromaDB集合实例
+        ids (List[str]): 待检查的ID列表
+        batch_size (int): 每次查询的最大ID数量
+    返回:
+        set: 已存在于集合中的ID集合
+    """
+    existing = set()
+    # 按批次查询，避免单次请求的ID数量过多
+    for start in range(0, len(ids), batch_size):
+        # 只需要ID，不需要返回文档和元数据
+        result = collection.get(ids=ids[start:start + batch_size], include=[])
+        existing.update(result.get("ids") or [])
+    return existing
 
-def save_text_to_db(text:str, collection_name:str = DEFAULT_COLLECTION_NAME, source:Optional[str] = None) -> str:
+def _build_metadata(metadata: Optional[dict], source: Optional[str]) -> dict:
+    # 去掉值为None的字段（Chroma的元数据不允许None），并补齐数据来源
+    result = {key: value for key, value in (metadata or {}).items() if value is not None}
+    result.setdefault("source", source or "document")
+    return result
+
+def save_text_to_db(
+    text:str,
+    collection_name:str = DEFAULT_COLLECTION_NAME,
+    source:Optional[str] = None,
+    metadata: Optional[dict] = None
+) -> str:
     """
     将文本保存到ChromaDB指定集合中，使用sentence_transformers生成embedding。
     参数:
         text (str): 要保存的文本
         collection_name (str): 集合名称，默认为 "rag"
         source (str, optional): 数据来源标识，默认为 "document"
+        metadata (dict, optional): 文本的元数据（例如 save.iter_chunks_with_metadata 生成的位置信息），
+            没有 "source" 字段时使用参数 source
     返回:
         str: 保存的文本ID
     异常:
@@ -69,30 +223,25 @@ def save_text_to_db(text:str, collection_name:str = DEFAULT_COLLECTION_NAME, sou
             logger.warning("尝试保存空文本，已跳过")
             return ""
 
-        # 获取全局模型实例
-        model = _get_model()
-        # 获取全局客户端实例
-        client = _get_client()
         # 获取指定名称的集合，如果集合不存在就创建集合
-        collection = client.get_or_create_collection(collection_name)
-        # 使用文本内容的哈希值生成唯一的文本ID（）
-        # text.encode() 将字符串转换为字节串（bytes）
-        # hexdigest() 转换为十六进制字符串
-        text_id = hashlib.md5(text.encode()).hexdigest()
+        collection = _get_collection(collection_name)
+        # 使用文本内容的哈希值生成唯一的文本ID
+        text_id = _compute_text_id(text)
         # 检查数据库中是否已存在相同的ID
         existing = collection.get(ids = [text_id])
         if existing and existing.get("ids"):
             logger.debug(f"文本已存在，跳过保存，id={text_id}")
             return text_id
-        # 生成文本的 embedding，模型处理结果为 ndarray，通过tolist 转换为列表
-        embedding = model.encode([text])[0].tolist()
+        # 生成文本的 embedding（优先读取嵌入缓存），结果已转换为列表
+        embedding = encode_texts([text])[0]
         # 向集合中添加文本、元数据、ID以及embedding
         collection.add(
             documents = [text],
-            metadatas = [{"source": source or "document"}],
+            metadatas = [_build_metadata(metadata, source)],
             ids = [text_id],
             embeddings = [embedding]
         )
+        _bump_collection_version(collection_name, [text_id], [text])
         # 记录成功保存的调试日志，包含文本id和集合名称
         logger.debug(f"文本已保存到ChromaDB，id={text_id}, collection={collection_name}")
         # 返回本次保存的文本ID
@@ -102,3 +251,153 @@ def save_text_to_db(text:str, collection_name:str = DEFAULT_COLLECTION_NAME, sou
         logger.error(f"保存文本到数据库失败：{str(e)}")
         raise
 
+
+def save_texts_to_db(
+    texts: List[str],
+    collection_name: str = DEFAULT_COLLECTION_NAME,
+    source: Optional[str] = None,
+    encode_batch_size: int = DEFAULT_ENCODE_BATCH_SIZE,
+    write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+    metadatas: Optional[List[dict]] = None
+) -> List[Optional[str]]:
+    """
+    批量将文本保存到ChromaDB指定集合中：一次性计算哈希、批量去重、分批编码、分批写入。
+    参数:
+        texts (List[str]): 要保存的文本列表
+        collection_name (str): 集合名称，默认为 "rag"
+        source (str, optional): 数据来源标识，默认为 "document"
+        encode_batch_size (int): 每批送入模型编码的文本数量，默认为 64
+        write_batch_size (int): 每批写入数据库的文本数量，默认为 1000
+        metadatas (List[dict], optional): 与texts一一对应的元数据，没有 "source" 字段时使用参数 source。
+            同一批内重复的文本使用第一次出现位置的元数据，数据库中已存在的文本不修改元数据
+    返回:
+        List[Optional[str]]: 与texts一一对应的文本ID；空文本为""，保存失败的文本为None
+    异常:
+        Exception: 获取模型、客户端或集合失败
+    """
+    # 初始化返回结果，与输入文本一一对应
+    results: List[Optional[str]] = [None] * len(texts)
+    # 记录每个待处理ID对应的输入位置（同一批内重复的文本共享一个ID）
+    positions = {}
+    for idx, text in enumerate(texts):
+        # 空文本直接跳过，与save_text_to_db保持一致返回空字符串
+        if not text or not text.strip():
+            logger.warning(f"第{idx + 1}条文本为空，已跳过")
+            results[idx] = ""
+            continue
+        positions.setdefault(_compute_text_id(text), []).append(idx)
+    if not positions:
+        return results
+
+    try:
+        # 获取全局模型实例
+        _get_model()
+        # 获取指定名称的集合，如果集合不存在就创建集合
+        collection = _get_collection(collection_name)
+        # 批量查询已存在的ID
+        with metrics.timer(metrics.INGEST_STAGE_SECONDS, stage="dedupe_lookup"):
+            existing = _get_existing_ids(collection, list(positions), write_batch_size)
+    except Exception as e:
+        logger.error(f"批量保存文本到数据库失败：{str(e)}")
+        raise
+
+    # 已存在的文本直接视为保存成功
+    for text_id in existing:
+        for idx in positions[text_id]:
+            results[idx] = text_id
+    # 需要新写入的ID列表（保持输入顺序）
+    new_ids = [text_id for text_id in positions if text_id not in existing]
+    logger.debug(f"批量保存：共{len(positions)}条不重复文本，已存在{len(existing)}条，待写入{len(new_ids)}条")
+
+    # 按写入批次处理，单个批次失败不影响其他批次
+    for start in range(0, len(new_ids), write_batch_size):
+        batch_ids = new_ids[start:start + write_batch_size]
+        batch_texts = [texts[positions[text_id][0]] for text_id in batch_ids]
+        try:
+            # 分批生成embedding（优先读取嵌入缓存）
+            with metrics.timer(metrics.INGEST_STAGE_SECONDS, stage="embed"):
+                embeddings = encode_texts(batch_texts, batch_size=encode_batch_size)
+            # 向集合中批量添加文本、元数据、ID以及embedding
+            with metrics.timer(metrics.INGEST_STAGE_SECONDS, stage="write"):
+                collection.add(
+                    documents=batch_texts,
+                    metadatas=[
+                        _build_metadata(metadatas[positions[text_id][0]] if metadatas else None, source)
+                        for text_id in batch_ids
+                    ],
+                    ids=batch_ids,
+                    embeddings=embeddings
+                )
+            _bump_collection_version(collection_name, batch_ids, batch_texts)
+        except Exception as e:
+            # 记录失败批次对应的输入位置，便于定位
+            failed = sorted(idx for text_id in batch_ids for idx in positions[text_id])
+            logger.error(f"批量写入失败，涉及第{failed[0] + 1}~{failed[-1] + 1}条中的{len(failed)}条文本：{str(e)}")
+            continue
+        for text_id in batch_ids:
+            for idx in positions[text_id]:
+                results[idx] = text_id
+        logger.debug(f"已批量写入{len(batch_ids)}条文本到ChromaDB，collection={collection_name}")
+    return results
+
+def update_metadatas_in_db(
+    ids: List[str],
+    metadatas: List[dict],
+    collection_name: str = DEFAULT_COLLECTION_NAME,
+    write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE
+) -> int:
+    """
+    按ID批量更新集合中已有文本的元数据（不重新生成向量），用于增量入库时刷新未变化分块的位置信息
+    参数:
+        ids (List[str]): 文本ID列表
+        metadatas (List[dict]): 与ids一一对应的元数据
+        collection_name (str): 集合名称，默认为 "rag"
+        write_batch_size (int): 每批更新的ID数量，默认为 1000
+    返回:
+        int: 请求更新的ID数量
+    异常:
+        Exception: 更新失败
+    """
+    if not ids:
+        return 0
+    try:
+        collection = _get_collection(collection_name)
+        for start in range(0, len(ids), write_batch_size):
+            collection.update(
+                ids=ids[start:start + write_batch_size],
+                metadatas=[_build_metadata(metadata, None) for metadata in metadatas[start:start + write_batch_size]]
+            )
+        logger.debug(f"已更新{len(ids)}条文本的元数据，collection={collection_name}")
+        return len(ids)
+    except Exception as e:
+        logger.error(f"更新文本元数据失败：{str(e)}")
+        raise
+
+def delete_texts_from_db(
+    ids: List[str],
+    collection_name: str = DEFAULT_COLLECTION_NAME,
+    write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE
+) -> int:
+    """
+    按ID批量删除集合中的文本
+    参数:
+        ids (List[str]): 要删除的文本ID列表
+        collection_name (str): 集合名称，默认为 "rag"
+        write_batch_size (int): 每批删除的ID数量，默认为 1000
+    返回:
+        int: 请求删除的ID数量
+    异常:
+        Exception: 删除失败
+    """
+    if not ids:
+        return 0
+    try:
+        collection = _get_collection(collection_name)
+        for start in range(0, len(ids), write_batch_size):
+            collection.delete(ids=ids[start:start + write_batch_size])
+        _bump_collection_version(collection_name, removed_ids=ids)
+        logger.debug(f"已从ChromaDB删除{len(ids)}条文本，collection={collection_name}")
+        return len(ids)
+    except Exception as e:
+        logger.error(f"从数据库删除文本失败：{str(e)}")
+        raise
@@ -0,0 +1,124 @@
+# 导入queue模块，用于收集待编码的请求
+import queue
+# 导入threading模块，用于后台批处理线程
+import threading
+# 导入time模块，用于计算批处理的等待窗口
+import time
+# 导入Future，用于把批处理结果交还给每个调用方
+from concurrent.futures import Future
+# 导入类型注解
+from typing import Callable, List, Optional, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于向量结果
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认的最大批量大小
+DEFAULT_MAX_BATCH_SIZE = 32
+# 默认的批处理等待窗口（毫秒）
+DEFAULT_MAX_WAIT_MS = 2.0
+
+
+class MicroBatcher:
+    """
+    编码请求的微批处理器：后台线程收集在很短的时间窗口内到达的请求（或凑满最大批量），
+    一次调用encode_fn完成整批编码，再通过Future把结果分别交还给每个调用方。
+    空闲时第一个请求最多额外等待 max_wait_ms；高并发时编码期间到达的请求会自然合并到下一批。
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+        name: str = "embed-batcher"
+    ):
+        # 批量编码函数：输入文本列表，返回与之对应的向量矩阵
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # 第一次提交请求时才启动后台线程
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """
+        提交一条待编码的文本
+        参数:
+            text (str): 文本
+        返回:
+            Future: 结果为该文本的向量
+        """
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """
+        提交文本并阻塞等待其向量
+        参数:
+            text (str): 文本
+            timeout (float, optional): 最长等待秒数
+        返回:
+            np.ndarray: 向量
+        """
+        return self.submit(text).result(timeout)
+
+    def close(self):
+        """
+        停止后台线程，已提交的请求会先处理完
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _collect(self, first: Tuple[str, Future]) -> Tuple[List[Tuple[str, Future]], bool]:
+        # 以第一个请求的到达时间为起点，最多等待max_wait或凑满max_batch_size
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # 已有积压时不等待，直接取走
+                item = self._queue.get_nowait() if remaining <= 0 else self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stop = self._collect(first)
+            # 跳过调用方已取消的请求
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                try:
+                    vectors = self.encode_fn([text for text, _ in batch])
+                    for (_, future), vector in zip(batch, vectors):
+                        future.set_result(vector)
+                    logger.debug(f"{self.name}：批量编码{len(batch)}条文本")
+                except Exception as e:
+                    logger.error(f"{self.name}：批量编码失败：{str(e)}")
+                    for _, future in batch:
+                        future.set_exception(e)
+            if stop:
+                return
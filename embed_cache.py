@@ -0,0 +1,291 @@
+# 导入os模块，用于路径和环境变量
+import os
+# 导入re模块，用于生成安全的文件名
+import re
+# 导入hashlib模块，用于计算文本哈希
+import hashlib
+# 导入sqlite3模块，用于保存缓存索引
+import sqlite3
+# 导入threading模块，保证缓存读写的线程安全
+import threading
+# 导入atexit模块，进程退出时写回攒下的最近使用记录
+import atexit
+# 导入类型注解
+from typing import Dict, List, Optional
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于内存映射的向量文件
+import numpy as np
+
+# 导入默认的数据库路径
+from db import DEFAULT_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# 是否启用嵌入缓存，设置环境变量 RAG_EMBED_CACHE=0 可关闭
+EMBED_CACHE_ENABLED = os.getenv("RAG_EMBED_CACHE", "1") != "0"
+# 缓存目录，默认与ChromaDB数据目录放在一起
+DEFAULT_CACHE_DIR = os.getenv("RAG_EMBED_CACHE_DIR", f"{DEFAULT_DB_PATH}_embed_cache")
+# 每个模型最多缓存的向量条数（LRU淘汰预算）
+DEFAULT_CACHE_CAPACITY = int(os.getenv("RAG_EMBED_CACHE_CAPACITY", "200000"))
+# 向量的存储精度：float16 或 float32
+DEFAULT_CACHE_DTYPE = os.getenv("RAG_EMBED_CACHE_DTYPE", "float16")
+
+# 攒够这么多条命中记录后写回一次最近使用时间
+_TOUCH_FLUSH_SIZE = 1024
+# 等待其他进程释放缓存锁的最长时间（秒）
+_LOCK_TIMEOUT = 60
+
+# 全局缓存实例：模型名称 -> EmbeddingCache
+_caches: Dict[str, "EmbeddingCache"] = {}
+# 创建缓存实例时使用的锁
+_caches_lock = threading.Lock()
+
+
+def text_key(text: str) -> str:
+    """
+    计算文本的缓存键（文本内容的md5）
+    参数:
+        text (str): 文本
+    返回:
+        str: 十六进制哈希
+    """
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    单个模型的磁盘嵌入缓存：
+    向量存放在内存映射的 .npy 文件中（容量固定，float16/float32），
+    文本哈希 -> 槽位 的索引和最近使用时间存放在SQLite中，满了以后按LRU淘汰。
+    多个进程（并行入库的工作进程、与入库任务同时运行的查询服务）可以共享同一个缓存目录：
+    写入在SQLite的排他事务中重新读取已用槽位后再分配并写入向量，读取在共享事务中完成，
+    SQLite的文件锁保证读取期间槽位不会被其他进程改写
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        capacity: int = DEFAULT_CACHE_CAPACITY,
+        dtype: str = DEFAULT_CACHE_DTYPE
+    ):
+        # 模型名称，不同模型的向量分开存放
+        self.model_name = model_name
+        # 最多缓存的向量条数
+        self.capacity = capacity
+        # 存储精度
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # 模型名称中可能包含 / 等字符，转换为安全的文件名
+        slug = re.sub(r"[^0-9A-Za-z_.-]+", "_", model_name)
+        self._vectors_path = os.path.join(cache_dir, f"{slug}.{self.dtype.name}.npy")
+        # 手动控制事务；使用默认的回滚日志模式（不能用WAL）：写事务提交前会等待所有读事务结束
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, f"{slug}.{self.dtype.name}.sqlite"),
+            timeout=_LOCK_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON entries (last_used)")
+        # 命中但尚未写回的最近使用记录：文本哈希 -> 本进程内的命中顺序，攒够一批或下次写入时再更新，避免每次命中都写盘
+        self._pending_touch: Dict[str, int] = {}
+        self._touch_seq = 0
+        # 向量文件在第一次写入时才知道维度，可能由其他进程创建，在事务中延迟打开
+        self._vectors: Optional[np.memmap] = None
+        atexit.register(self.flush_touches)
+
+    def _open_vectors(self):
+        # 向量文件已存在（包括由其他进程创建）时以内存映射方式打开，以已有文件的容量为准。
+        # 需要在事务中调用：文件在写事务中创建，事务外可能看到写了一半的文件
+        if self._vectors is None and os.path.exists(self._vectors_path):
+            self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+            self.capacity = self._vectors.shape[0]
+
+    def _lookup_slots(self, keys: List[str]) -> Dict[str, int]:
+        # SQLite单条语句的参数个数有限，分批查询
+        slots = {}
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            slots.update(self._conn.execute(f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", part).fetchall())
+        return slots
+
+    def _apply_touches(self) -> int:
+        # 在写事务中把攒下的命中记录写回，返回下一个可用的时钟值（各进程共用数据库中的最大值）
+        clock = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM entries").fetchone()[0] + 1
+        if self._pending_touch:
+            ordered = sorted(self._pending_touch, key=self._pending_touch.get)
+            self._conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(clock + i, key) for i, key in enumerate(ordered)]
+            )
+            clock += len(ordered)
+            self._pending_touch.clear()
+        return clock
+
+    def flush_touches(self):
+        """
+        把攒下的最近使用记录写回缓存索引（写入新向量时也会顺带写回）
+        """
+        with self._lock:
+            if not self._pending_touch:
+                return
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._apply_touches()
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                # 最近使用时间只影响淘汰顺序，写回失败不影响正确性
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                logger.warning(f"嵌入缓存写回最近使用时间失败：{str(e)}")
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        批量读取缓存的向量，命中的条目记入最近使用（延迟批量写回）
+        参数:
+            keys (List[str]): 文本哈希列表
+        返回:
+            Dict[str, np.ndarray]: 命中的 文本哈希 -> float32向量
+        """
+        if not keys:
+            return {}
+        with self._lock:
+            # 在读事务中查询槽位并读取向量，期间其他进程不能提交对槽位的改写
+            self._conn.execute("BEGIN")
+            try:
+                slots = self._lookup_slots(keys)
+                if not slots:
+                    return {}
+                self._open_vectors()
+                # 一次性从内存映射文件中取出所有命中的向量
+                ordered_slots = sorted(slots.values())
+                vectors = np.asarray(self._vectors[ordered_slots], dtype=np.float32)
+            finally:
+                self._conn.execute("COMMIT")
+            row_of = {slot: row for row, slot in enumerate(ordered_slots)}
+            found = {key: vectors[row_of[slot]] for key, slot in slots.items()}
+            for key in slots:
+                self._touch_seq += 1
+                self._pending_touch[key] = self._touch_seq
+            flush = len(self._pending_touch) >= _TOUCH_FLUSH_SIZE
+        if flush:
+            self.flush_touches()
+        return found
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        """
+        批量写入向量，缓存已满时淘汰最久未使用的条目
+        参数:
+            keys (List[str]): 文本哈希列表
+            vectors (np.ndarray): 与keys对应的向量矩阵
+        """
+        if not keys:
+            return
+        with self._lock:
+            # 排他事务：其他进程的读写都要等待，槽位在事务内根据数据库的最新状态分配
+            self._conn.execute("BEGIN EXCLUSIVE")
+            try:
+                self._open_vectors()
+                if self._vectors is None:
+                    # 第一次写入时按向量维度创建固定容量的内存映射文件
+                    self._vectors = np.lib.format.open_memmap(
+                        self._vectors_path, mode="w+", dtype=self.dtype, shape=(self.capacity, vectors.shape[1])
+                    )
+                tick = self._apply_touches()
+                # 已存在的键（包括其他进程刚写入的）不重复写入
+                present = self._lookup_slots(keys)
+                items = [(key, vector) for key, vector in zip(keys, vectors) if key not in present]
+                # 单次写入超过容量时只保留最后的部分
+                items = items[-self.capacity:]
+                # 先使用空闲槽位，不够时淘汰最久未使用的条目
+                next_slot = self._conn.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM entries").fetchone()[0]
+                free = min(self.capacity - next_slot, len(items))
+                slots = list(range(next_slot, next_slot + free))
+                shortage = len(items) - free
+                if shortage > 0:
+                    evicted = self._conn.execute(
+                        "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (shortage,)
+                    ).fetchall()
+                    self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                    slots.extend(slot for _, slot in evicted)
+                    logger.debug(f"嵌入缓存已满，淘汰{len(evicted)}条最久未使用的向量")
+                for (key, vector), slot in zip(items, slots):
+                    self._vectors[slot] = vector
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                    [(key, slot, tick) for (key, _), slot in zip(items, slots)]
+                )
+                self._vectors.flush()
+                self._conn.execute("COMMIT")
+            except Exception as e:
+                self._conn.execute("ROLLBACK")
+                logger.error(f"写入嵌入缓存失败：{str(e)}")
+                raise
+
+
+def get_cache(model_name: str) -> EmbeddingCache:
+    """
+    获取指定模型的嵌入缓存实例（单例模式）
+    参数:
+        model_name (str): 模型名称
+    返回:
+        EmbeddingCache: 缓存实例
+    """
+    with _caches_lock:
+        if model_name not in _caches:
+            logger.info(f"正在打开嵌入缓存：{DEFAULT_CACHE_DIR}，模型：{model_name}")
+            _caches[model_name] = EmbeddingCache(model_name, cache_dir=DEFAULT_CACHE_DIR)
+        return _caches[model_name]
+
+
+def lookup(model_name: str, text: str) -> Optional[np.ndarray]:
+    """
+    只查询缓存，不触发编码
+    参数:
+        model_name (str): 模型名称
+        text (str): 文本
+    返回:
+        Optional[np.ndarray]: 命中时返回float32向量，否则返回None
+    """
+    if not EMBED_CACHE_ENABLED:
+        return None
+    key = text_key(text)
+    return get_cache(model_name).get_many([key]).get(key)
+
+
+def encode_with_cache(model, model_name: str, texts: List[str], batch_size: int = 32) -> np.ndarray:
+    """
+    带缓存的批量编码：命中缓存的文本直接读取向量，未命中的文本批量送入模型编码后写回缓存；
+    新编码的向量同样按缓存的存储精度（默认float16）取整，与命中时读到的向量一致
+    参数:
+        model: SentenceTransformer模型实例
+        model_name (str): 模型名称，作为缓存的命名空间
+        texts (List[str]): 待编码的文本列表
+        batch_size (int): 模型编码的批量大小，默认为 32
+    返回:
+        np.ndarray: 形状为 (len(texts), 维度) 的float32向量矩阵
+    """
+    if not EMBED_CACHE_ENABLED:
+        return np.asarray(model.encode(texts, batch_size=batch_size), dtype=np.float32)
+    cache = get_cache(model_name)
+    keys = [text_key(text) for text in texts]
+    found = cache.get_many(list(dict.fromkeys(keys)))
+    # 未命中的文本去重后再编码
+    missing = list(dict.fromkeys(key for key in keys if key not in found))
+    hits = sum(1 for key in keys if key in found)
+    if missing:
+        texts_by_key = dict(zip(keys, texts))
+        encoded = np.asarray(model.encode([texts_by_key[key] for key in missing], batch_size=batch_size), dtype=np.float32)
+        # 按缓存的存储精度取整后再返回，同一文本无论是否命中缓存得到的向量都完全相同
+        encoded = encoded.astype(cache.dtype).astype(np.float32)
+        cache.put_many(missing, encoded)
+        found.update(zip(missing, encoded))
+    logger.debug(f"嵌入缓存：共{len(texts)}条文本，命中{hits}条，编码{len(missing)}条")
+    return np.stack([found[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
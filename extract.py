@@ -1,13 +1,18 @@
-# 导入PyMuPDF库（fitz），用于处理PDF文件
-import fitz  # PyMuPDF
-# 导入Optional类型提示
-from typing import Optional
+# 各格式的解析库（PyMuPDF、python-docx、openpyxl、python-pptx、BeautifulSoup、lxml）
+# 都在对应的提取函数中延迟导入，只有第一次处理该格式的文件时才加载
+# 导入Optional、Iterator等类型提示
+from typing import Optional, Iterator, List, Tuple
 # 导入日志logging功能
 import logging
 
 # 获取当前模块日志记录器
 logger = logging.getLogger(__name__)
 
+# 流式读取Excel/CSV时每个文本段包含的行数
+DEFAULT_ROW_BLOCK = 200
+# 流式读取文本文件时每个文本段包含的行数
+DEFAULT_LINE_BLOCK = 200
+
 # 定义用于提取PDF所有文本内容的函数
 def extract_pdf_text(pdf_path: str) -> str:
     """
@@ -24,22 +29,8 @@ def extract_pdf_text(pdf_path: str) -> str:
         Exception: PDF文件读取失败
     """
     try:
-        # 打开PDF文件
-        pdf = fitz.open(pdf_path)
-        try:
-            # 新建一个空列表，用来存储每页文本
-            text_list = []
-            # 遍历每一页
-            for page in pdf:
-                # 获取当前页文本，并加入列表
-                text_list.append(page.get_text("text"))  # type: ignore
-            # 将每页文本用换行拼接成一个大字符串
-            all_text = "\n".join(text_list)
-            # 返回拼接后的文本
-            return all_text
-        finally:
-            # 确保关闭PDF文件
-            pdf.close()
+        # 逐页提取（页数较多时多进程并行、按页缓存）后用换行拼接成一个大字符串
+        return "\n".join(iter_pdf_pages(pdf_path))
     except FileNotFoundError:
         # 如果文件未找到，记录错误日志
         logger.error(f"PDF文件不存在: {pdf_path}")
@@ -51,8 +42,76 @@ def extract_pdf_text(pdf_path: str) -> str:
         # 抛出异常
         raise
 
-# 导入python-docx的Document类
-from docx import Document
+# 定义逐页流式提取PDF文本的函数
+def iter_pdf_pages(pdf_path: str) -> Iterator[str]:
+    """
+    按页码顺序逐页产出PDF文件的文本内容。
+    页数较多时按页码范围分给多个进程并行提取，每页的文本按 (文件哈希, 页码) 缓存，见 pdf_pages.iter_pdf_pages
+
+    参数:
+        pdf_path (str): PDF文件路径
+
+    返回:
+        Iterator[str]: 逐页产出的文本
+
+    异常:
+        FileNotFoundError: 文件不存在
+        Exception: PDF文件读取失败
+    """
+    # 延迟导入并行提取和页缓存模块
+    import pdf_pages
+    for _, text in pdf_pages.iter_pdf_pages(pdf_path):
+        yield text
+
+# 定义获取PDF页数的函数
+def get_pdf_page_count(pdf_path: str) -> int:
+    """
+    获取PDF文件的页数
+
+    参数:
+        pdf_path (str): PDF文件路径
+
+    返回:
+        int: 页数
+
+    异常:
+        FileNotFoundError: 文件不存在
+        Exception: PDF文件读取失败
+    """
+    try:
+        # 延迟导入PyMuPDF库（fitz），用于处理PDF文件
+        import fitz
+        with fitz.open(pdf_path) as pdf:
+            return pdf.page_count
+    except Exception as e:
+        logger.error(f"读取PDF页数失败: {pdf_path}, 错误: {str(e)}")
+        raise
+
+# 定义提取PDF指定页码范围文本的函数
+def extract_pdf_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    提取PDF文件中一段连续页码的文本，每次调用单独打开文档，可以在多个进程中同时调用
+
+    参数:
+        pdf_path (str): PDF文件路径
+        start (int): 起始页码（从1开始，包含）
+        end (int): 结束页码（包含）
+
+    返回:
+        List[Tuple[int, str]]: 按页码顺序排列的 (页码, 文本)
+
+    异常:
+        FileNotFoundError: 文件不存在
+        Exception: PDF文件读取失败
+    """
+    try:
+        # 延迟导入PyMuPDF库（fitz），用于处理PDF文件
+        import fitz
+        with fitz.open(pdf_path) as pdf:
+            return [(number, pdf.load_page(number - 1).get_text("text")) for number in range(start, end + 1)]  # type: ignore
+    except Exception as e:
+        logger.error(f"提取PDF第{start}~{end}页文本失败: {pdf_path}, 错误: {str(e)}")
+        raise
 
 # 定义提取Word文档所有段落文本的函数
 def extract_text_from_word(file_path: str) -> str:
@@ -70,6 +129,8 @@ def extract_text_from_word(file_path: str) -> str:
         Exception: Word文件读取失败
     """
     try:
+        # 延迟导入python-docx的Document类
+        from docx import Document
         # 加载Word文档
         doc = Document(file_path)
         # 取所有段落的文本，并用换行符拼接
@@ -87,9 +148,6 @@ def extract_text_from_word(file_path: str) -> str:
         # 抛出异常
         raise
 
-# 导入openpyxl库，用于操作Excel文件
-import openpyxl
-
 # 定义函数提取Excel文件中的所有文本
 def extract_text_from_excel(file_path: str) -> str:
     """
@@ -106,6 +164,8 @@ def extract_text_from_excel(file_path: str) -> str:
         Exception: Excel文件读取失败
     """
     try:
+        # 延迟导入openpyxl库，用于操作Excel文件
+        import openpyxl
         # 加载Excel工作簿
         wb = openpyxl.load_workbook(file_path, data_only=True)
         try:
@@ -133,8 +193,78 @@ def extract_text_from_excel(file_path: str) -> str:
         logger.error(f"提取Excel文本失败: {file_path}, 错误: {str(e)}")
         raise
 
-# 导入python-pptx库的Presentation类
-from pptx import Presentation
+# 定义按行块流式提取Excel文本的函数
+def iter_excel_rows(file_path: str, block_rows: int = DEFAULT_ROW_BLOCK) -> Iterator[str]:
+    """
+    以只读模式打开Excel文件，按行块流式产出文本，避免整表载入内存
+
+    参数:
+        file_path (str): Excel文件路径
+        block_rows (int): 每个文本段包含的行数，默认为 200
+
+    返回:
+        Iterator[str]: 每个行块拼接后的文本（行内用Tab分隔，行间用换行分隔）
+
+    异常:
+        FileNotFoundError: 文件不存在
+        Exception: Excel文件读取失败
+    """
+    try:
+        import openpyxl
+        # 只读模式加载工作簿，按需读取行
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            # 取得活动工作表
+            ws = wb.active
+            rows = []
+            for row in ws.iter_rows(values_only=True):
+                rows.append("\t".join([str(cell) if cell is not None else "" for cell in row]))
+                # 累计够一个行块就产出
+                if len(rows) >= block_rows:
+                    yield "\n".join(rows)
+                    rows = []
+            # 产出剩余的行
+            if rows:
+                yield "\n".join(rows)
+        finally:
+            # 关闭Excel工作簿
+            wb.close()
+    except FileNotFoundError:
+        logger.error(f"Excel文件不存在: {file_path}")
+        raise
+    except Exception as e:
+        logger.error(f"提取Excel文本失败: {file_path}, 错误: {str(e)}")
+        raise
+
+# 定义获取Excel活动工作表名称的函数
+def get_excel_sheet_name(file_path: str) -> str:
+    """
+    获取Excel文件活动工作表（iter_excel_rows 读取的工作表）的名称
+
+    参数:
+        file_path (str): Excel文件路径
+
+    返回:
+        str: 工作表名称
+
+    异常:
+        FileNotFoundError: 文件不存在
+        Exception: Excel文件读取失败
+    """
+    try:
+        import openpyxl
+        # 只读模式加载工作簿，只读取工作簿结构
+        wb = openpyxl.load_workbook(file_path, read_only=True)
+        try:
+            return wb.active.title
+        finally:
+            wb.close()
+    except FileNotFoundError:
+        logger.error(f"Excel文件不存在: {file_path}")
+        raise
+    except Exception as e:
+        logger.error(f"读取Excel工作表名称失败: {file_path}, 错误: {str(e)}")
+        raise
 
 # 定义函数提取PPT文件所有文本内容
 def extract_ppt_text(file_path: str) -> str:
@@ -152,6 +282,8 @@ def extract_ppt_text(file_path: str) -> str:
         Exception: PPT文件读取失败
     """
     try:
+        # 延迟导入python-pptx库的Presentation类
+        from pptx import Presentation
         # 加载PPT文件
         ppt = Presentation(file_path)
         # 新建列表存储所有文本内容
@@ -177,8 +309,36 @@ def extract_ppt_text(file_path: str) -> str:
         logger.error(f"提取PPT文本失败: {file_path}, 错误: {str(e)}")
         raise
 
-# 导入BeautifulSoup用于解析HTML
-from bs4 import BeautifulSoup  # BeautifulSoup用于解析HTML
+# 定义逐张幻灯片提取PPT文本的函数
+def iter_ppt_slides(file_path: str) -> Iterator[Tuple[int, str]]:
+    """
+    逐张幻灯片提取PPT文件的文本内容，跳过没有文本的幻灯片。
+    所有幻灯片的文本用换行符拼接后与 extract_ppt_text 的结果一致
+
+    参数:
+        file_path (str): PPT文件路径
+
+    返回:
+        Iterator[Tuple[int, str]]: (幻灯片序号（从1开始）, 该幻灯片的文本（形状之间以换行符分隔）)
+
+    异常:
+        FileNotFoundError: 文件不存在
+        Exception: PPT文件读取失败
+    """
+    try:
+        from pptx import Presentation
+        ppt = Presentation(file_path)
+        for slide_number, slide in enumerate(ppt.slides, start=1):
+            # 只保留含有非空文本的形状
+            texts = [shape.text for shape in slide.shapes if hasattr(shape, "text") and shape.text.strip()]
+            if texts:
+                yield slide_number, "\n".join(texts)
+    except FileNotFoundError:
+        logger.error(f"PPT文件不存在: {file_path}")
+        raise
+    except Exception as e:
+        logger.error(f"提取PPT文本失败: {file_path}, 错误: {str(e)}")
+        raise
 
 # 定义函数，从HTML文件提取所有文本内容
 def extract_text_from_html(file_path: str) -> str:
@@ -200,6 +360,8 @@ def extract_text_from_html(file_path: str) -> str:
         with open(file_path, "r", encoding="utf-8") as f:
             # 读取HTML文件所有内容
             html = f.read()
+        # 延迟导入BeautifulSoup用于解析HTML
+        from bs4 import BeautifulSoup
         # 创建BeautifulSoup对象
         soup = BeautifulSoup(html, "html.parser")
         # 用换行分隔符获取全部文本
@@ -251,9 +413,6 @@ def extract_text_from_json(filename: str) -> str:
         logger.error(f"JSON解析失败: {filename}, 错误: {str(e)}")
         raise
 
-# 导入lxml库的etree模块用于XML处理
-from lxml import etree
-
 # 定义函数，从XML文件提取所有文本内容
 def extract_xml_text(file_path: str) -> str:
     """
@@ -267,8 +426,10 @@ def extract_xml_text(file_path: str) -> str:
 
     异常:
         FileNotFoundError: 文件不存在
-        etree.XMLSyntaxError: XML解析失败
+        lxml.etree.XMLSyntaxError: XML解析失败
     """
+    # 延迟导入lxml库的etree模块用于XML处理（except子句中也需要用到，放在try之前）
+    from lxml import etree
     try:
         # 用utf-8编码打开XML文件
         with open(file_path, "r", encoding="utf-8") as f:
@@ -330,6 +491,38 @@ def read_csv_to_text(filename: str) -> str:
         logger.error(f"读取CSV文件失败: {filename}, 错误: {str(e)}")
         raise
 
+# 定义按行块流式读取CSV文本的函数
+def iter_csv_rows(filename: str, block_rows: int = DEFAULT_ROW_BLOCK) -> Iterator[str]:
+    """
+    按行块流式读取CSV文件，每行用逗号连接
+
+    参数:
+        filename (str): CSV文件路径
+        block_rows (int): 每个文本段包含的行数，默认为 200
+
+    返回:
+        Iterator[str]: 每个行块拼接后的文本
+
+    异常:
+        FileNotFoundError: 文件不存在
+    """
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            rows = []
+            for row in csv.reader(f):
+                rows.append(", ".join(row))
+                if len(rows) >= block_rows:
+                    yield "\n".join(rows)
+                    rows = []
+            if rows:
+                yield "\n".join(rows)
+    except FileNotFoundError:
+        logger.error(f"CSV文件不存在: {filename}")
+        raise
+    except Exception as e:
+        logger.error(f"读取CSV文件失败: {filename}, 错误: {str(e)}")
+        raise
+
 # 定义读取文本文件内容的函数
 def read_text_file(filename: str) -> str:
     """
@@ -360,6 +553,38 @@ def read_text_file(filename: str) -> str:
         logger.error(f"读取文本文件失败: {filename}, 错误: {str(e)}")
         raise
 
+# 定义按行块流式读取文本文件的函数
+def iter_text_file(filename: str, block_lines: int = DEFAULT_LINE_BLOCK) -> Iterator[str]:
+    """
+    按行块流式读取文本文件，避免一次性f.read()整个文件
+
+    参数:
+        filename (str): 文件路径
+        block_lines (int): 每个文本段包含的行数，默认为 200
+
+    返回:
+        Iterator[str]: 每个行块的文本（保留原有换行符）
+
+    异常:
+        FileNotFoundError: 文件不存在
+    """
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            lines = []
+            for line in f:
+                lines.append(line)
+                if len(lines) >= block_lines:
+                    yield "".join(lines)
+                    lines = []
+            if lines:
+                yield "".join(lines)
+    except FileNotFoundError:
+        logger.error(f"文本文件不存在: {filename}")
+        raise
+    except Exception as e:
+        logger.error(f"读取文本文件失败: {filename}, 错误: {str(e)}")
+        raise
+
 # 定义读取Markdown文件内容的函数
 def read_markdown_file(file_path: str) -> str:
     """
@@ -0,0 +1,588 @@
+# 导入os模块，用于路径和文件操作
+import os
+# 导入glob模块，用于按通配符匹配文件
+import glob
+# 导入queue模块，用于阶段之间的有界队列
+import queue
+# 导入threading模块，用于嵌入线程和写入线程
+import threading
+# 导入multiprocessing模块，用于指定进程池的启动方式
+import multiprocessing
+# 导入进程池
+from concurrent.futures import ProcessPoolExecutor, Future
+# 导入类型注解
+from typing import Dict, List, Optional, Tuple, Union
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入数据库相关的函数和默认配置
+import db
+# 导入指标模块，记录入库各阶段耗时
+import metrics
+# 导入入库清单，用于增量入库
+from manifest import get_manifest, compute_file_hash
+# 导入文本提取和分块函数
+from save import (
+    iter_located_text,
+    iter_chunks_with_metadata,
+    SUPPORTED_EXTENSIONS,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_SPLITTER,
+    NEAR_DUP_ENABLED,
+)
+
+logger = logging.getLogger(__name__)
+
+# 默认的进程池大小（提取+分块阶段）
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+# 默认的有界队列长度（以分块批次为单位）
+DEFAULT_QUEUE_SIZE = 16
+# 提取进程每次发回主进程的最大分块数量
+DEFAULT_STREAM_BATCH_SIZE = 256
+# 队列结束标记
+_SENTINEL = None
+
+
+def collect_files(path_or_pattern: str, recursive: bool = True) -> List[str]:
+    """
+    根据目录或通配符收集待入库的文件
+    参数:
+        path_or_pattern (str): 目录路径或glob通配符（如 "docs/**/*.pdf"）
+        recursive (bool): 目录模式下是否递归子目录，默认为 True
+    返回:
+        List[str]: 排序后的受支持文件路径列表
+    """
+    files = []
+    if os.path.isdir(path_or_pattern):
+        # 目录模式：遍历目录下的所有文件
+        for root, _, names in os.walk(path_or_pattern):
+            for name in names:
+                files.append(os.path.join(root, name))
+            # 不递归时只处理顶层目录
+            if not recursive:
+                break
+    elif os.path.isfile(path_or_pattern):
+        # 单个文件
+        files.append(path_or_pattern)
+    else:
+        # 通配符模式
+        files = glob.glob(path_or_pattern, recursive=recursive)
+    # 只保留受支持的文件类型
+    return sorted(f for f in files if os.path.splitext(f)[-1].lower() in SUPPORTED_EXTENSIONS)
+
+
+def _extract_and_split(
+    file_path: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    known_hash: Optional[str] = None,
+    splitter: Union[str, object] = DEFAULT_SPLITTER,
+    result_queue=None,
+    batch_size: int = DEFAULT_STREAM_BATCH_SIZE
+):
+    """
+    在子进程中执行：提取文件文本并分块，分块结果按批次流式放入结果队列，
+    队列有界，主进程处理不过来时在这里阻塞，子进程内存只与批次大小相关而与文件大小无关。
+    子进程中的指标无法直接写入主进程，耗时随结束消息一起发送。
+    发送的消息依次为：
+        ("chunks", 文件路径, [(分块文本, 元数据), ...])，可能有多条；
+        ("done", 文件路径, 文件内容哈希（未开启增量时为None）, (提取耗时, 分块耗时))；
+        内容哈希与known_hash相同时不提取，只发送 ("unchanged", 文件路径, 文件内容哈希)
+    参数:
+        file_path (str): 文件路径
+        chunk_size (int): 分块大小
+        chunk_overlap (int): 分块重叠长度
+        known_hash (str, optional): 上次入库时的文件内容哈希，传入时先比较哈希
+        splitter (str | object): 分块方式，见 save.get_splitter
+        result_queue: 主进程创建的有界队列（multiprocessing.Manager().Queue）
+        batch_size (int): 每条消息包含的最大分块数量
+    异常:
+        Exception: 提取或分块失败，已发送的批次仍然有效，由主进程将该文件记为失败
+    """
+    content_hash = None
+    if known_hash is not None:
+        # 内容未变化时不再提取
+        content_hash = compute_file_hash(file_path)
+        if content_hash == known_hash:
+            result_queue.put(("unchanged", file_path, content_hash))
+            return
+    # 流式提取并分块，攒够一批就发送
+    segments = metrics.TimedIterator(iter_located_text(file_path))
+    chunks = metrics.TimedIterator(
+        iter_chunks_with_metadata(file_path, chunk_size, chunk_overlap, splitter, located_segments=segments)
+    )
+    batch = []
+    for item in chunks:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            result_queue.put(("chunks", file_path, batch))
+            batch = []
+    if batch:
+        result_queue.put(("chunks", file_path, batch))
+    # 分块迭代器的耗时包含其内部提取迭代器的耗时
+    result_queue.put(("done", file_path, content_hash, (segments.seconds, chunks.seconds - segments.seconds)))
+
+
+class _IngestStats:
+    """
+    线程安全的入库统计：记录每个文件的分块总数和成功保存数
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 文件路径 -> 分块总数
+        self.total: Dict[str, int] = {}
+        # 文件路径 -> 成功保存的分块数
+        self.saved: Dict[str, int] = {}
+        # 提取失败的文件
+        self.failed_files: List[str] = []
+
+    def add_file(self, file_path: str, chunk_count: int):
+        with self._lock:
+            self.total[file_path] = chunk_count
+            self.saved.setdefault(file_path, 0)
+
+    def remove_file(self, file_path: str):
+        # 内容未变化而跳过的文件不计入统计
+        with self._lock:
+            self.total.pop(file_path, None)
+            self.saved.pop(file_path, None)
+
+    def add_chunks(self, file_path: str, chunk_count: int):
+        # 分块按批次流式到达，分块总数逐批累加
+        with self._lock:
+            self.total[file_path] += chunk_count
+
+    def add_saved(self, file_paths: List[str]):
+        with self._lock:
+            for file_path in file_paths:
+                self.saved[file_path] += 1
+
+    def skip_chunks(self, file_path: str, chunk_count: int):
+        # 近似重复而跳过的分块不计入分块总数
+        with self._lock:
+            self.total[file_path] -= chunk_count
+
+    def add_failed_file(self, file_path: str):
+        with self._lock:
+            self.failed_files.append(file_path)
+
+
+def _embed_worker(
+    in_queue: queue.Queue,
+    out_queue: queue.Queue,
+    collection,
+    encode_batch_size: int,
+    stats: _IngestStats,
+    errors: List[Exception]
+):
+    """
+    嵌入线程：跨文件聚合分块，去重后批量编码，再交给写入线程
+    参数:
+        in_queue (queue.Queue): 输入队列，元素为 [(文件路径, 分块文本, 元数据), ...]
+        out_queue (queue.Queue): 输出队列，元素为 (ID列表, 文本列表, embedding列表, 文件路径列表, 元数据列表)
+        collection: ChromaDB集合实例
+        encode_batch_size (int): 每批编码的分块数量
+        stats (_IngestStats): 入库统计
+        errors (List[Exception]): 用于向主线程汇报异常
+    """
+    # 跨文件累积的待编码分块
+    pending: List[Tuple[str, str, dict]] = []
+
+    def flush():
+        # 批内按ID去重，同一文本只编码一次，元数据取第一次出现的位置
+        positions: Dict[str, List[str]] = {}
+        texts: Dict[str, str] = {}
+        metadatas: Dict[str, dict] = {}
+        for file_path, text, metadata in pending:
+            text_id = db._compute_text_id(text)
+            positions.setdefault(text_id, []).append(file_path)
+            texts.setdefault(text_id, text)
+            metadatas.setdefault(text_id, metadata)
+        pending.clear()
+        # 批量查询已存在的ID，已存在的直接计为保存成功
+        with metrics.timer(metrics.INGEST_STAGE_SECONDS, stage="dedupe_lookup"):
+            existing = db._get_existing_ids(collection, list(positions))
+        for text_id in existing:
+            stats.add_saved(positions[text_id])
+        new_ids = [text_id for text_id in positions if text_id not in existing]
+        if not new_ids:
+            return
+        batch_texts = [texts[text_id] for text_id in new_ids]
+        try:
+            with metrics.timer(metrics.INGEST_STAGE_SECONDS, stage="embed"):
+                embeddings = db.encode_texts(batch_texts, batch_size=encode_batch_size)
+        except Exception as e:
+            logger.error(f"批量编码{len(batch_texts)}个分块失败：{str(e)}")
+            return
+        # 交给写入线程，队列已满时阻塞（背压）
+        out_queue.put((
+            new_ids,
+            batch_texts,
+            embeddings,
+            [positions[text_id] for text_id in new_ids],
+            [metadatas[text_id] for text_id in new_ids]
+        ))
+
+    try:
+        while True:
+            item = in_queue.get()
+            if item is _SENTINEL:
+                break
+            pending.extend(item)
+            if len(pending) >= encode_batch_size:
+                flush()
+        if pending:
+            flush()
+    except Exception as e:
+        logger.error(f"嵌入线程异常退出：{str(e)}")
+        errors.append(e)
+        # 继续消费输入队列，避免上游阻塞
+        while in_queue.get() is not _SENTINEL:
+            pass
+    finally:
+        out_queue.put(_SENTINEL)
+
+
+def _write_worker(out_queue: queue.Queue, collection, collection_name: str, stats: _IngestStats):
+    """
+    写入线程：唯一持有写操作的线程，负责把embedding写入ChromaDB
+    参数:
+        out_queue (queue.Queue): 嵌入线程的输出队列
+        collection: ChromaDB集合实例
+        collection_name (str): 集合名称
+        stats (_IngestStats): 入库统计
+    """
+    while True:
+        item = out_queue.get()
+        if item is _SENTINEL:
+            break
+        ids, texts, embeddings, owners, metadatas = item
+        try:
+            # 使用upsert，跨批次出现的重复分块不会报错
+            with metrics.timer(metrics.INGEST_STAGE_SECONDS, stage="write"):
+                collection.upsert(
+                    documents=texts,
+                    metadatas=[db._build_metadata(metadata, None) for metadata in metadatas],
+                    ids=ids,
+                    embeddings=embeddings
+                )
+            db._bump_collection_version(collection_name, ids, texts)
+        except Exception as e:
+            # 单个批次写入失败不中断整个流程，失败的分块不计入成功数
+            logger.error(f"批量写入{len(ids)}个分块失败：{str(e)}")
+            continue
+        for file_paths in owners:
+            stats.add_saved(file_paths)
+
+
+def _prune_missing_files(manifest, collection_name: str, directory: str):
+    """
+    清理清单中位于目录下但已被删除的文件，并删除其独占的分块
+    参数:
+        manifest (IngestManifest): 入库清单
+        collection_name (str): 集合名称
+        directory (str): 目录路径
+    """
+    prefix = os.path.join(os.path.abspath(directory), "")
+    missing = [f for f in manifest.files(collection_name) if f.startswith(prefix) and not os.path.exists(f)]
+    for file_path in missing:
+        entry = manifest.remove(collection_name, file_path)
+        removed = set(entry.get("chunk_ids") or []) - manifest.referenced_ids(collection_name)
+        logger.info(f"文件已删除，清理其{len(removed)}个分块：{file_path}")
+        db.delete_texts_from_db(list(removed), collection_name)
+    if missing:
+        manifest.save()
+
+
+def _update_manifest(
+    manifest,
+    collection_name: str,
+    file_stats: Dict[str, os.stat_result],
+    file_hashes: Dict[str, str],
+    file_ids: Dict[str, List[str]],
+    stats: _IngestStats
+):
+    """
+    流水线结束后更新入库清单，并删除文件中已消失的分块
+    参数:
+        manifest (IngestManifest): 入库清单
+        collection_name (str): 集合名称
+        file_stats (Dict[str, os.stat_result]): 文件 -> 入库前的文件状态
+        file_hashes (Dict[str, str]): 文件 -> 内容哈希，提取完成的文件才有
+        file_ids (Dict[str, List[str]]): 文件 -> 本次产生的分块ID
+        stats (_IngestStats): 入库统计
+    """
+    for file_path, ids in file_ids.items():
+        stat = file_stats[file_path]
+        entry = manifest.get(collection_name, file_path)
+        old_ids = list((entry or {}).get("chunk_ids") or [])
+        if file_path not in file_hashes or stats.saved[file_path] < stats.total[file_path]:
+            # 入库不完整（提取中途失败或有分块保存失败）：清空内容哈希，下次重新处理，暂不删除旧分块；
+            # 本次已写入的分块也记入清单，下次重新入库时由清单比对清理
+            merged = list(dict.fromkeys(old_ids + ids))
+            manifest.update(collection_name, file_path, stat.st_size, stat.st_mtime, None, merged)
+            continue
+        removed = set(old_ids) - set(ids) - manifest.referenced_ids(collection_name, exclude=file_path)
+        if removed:
+            logger.info(f"删除文件中已消失的{len(removed)}个分块：{file_path}")
+            db.delete_texts_from_db(list(removed), collection_name)
+        manifest.update(collection_name, file_path, stat.st_size, stat.st_mtime, file_hashes[file_path], ids)
+    manifest.save()
+
+
+def dir_to_vectorstore(
+    path_or_pattern: str,
+    collection_name: str = db.DEFAULT_COLLECTION_NAME,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    encode_batch_size: int = db.DEFAULT_ENCODE_BATCH_SIZE,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    recursive: bool = True,
+    incremental: bool = False,
+    splitter: Union[str, object] = DEFAULT_SPLITTER
+) -> Dict[str, int]:
+    """
+    并行地将目录或通配符匹配到的所有文件入库。
+    流水线：进程池提取+分块（分块按批次流式发回） -> 有界队列 -> 单个嵌入线程跨文件批量编码 -> 有界队列 -> 单个写入线程
+    参数:
+        path_or_pattern (str): 目录路径或glob通配符
+        collection_name (str): 集合名称，默认为 "rag"
+        chunk_size (int): 分块大小，默认为 200
+        chunk_overlap (int): 分块重叠长度，默认为 30
+        max_workers (int): 提取进程数，默认为CPU核数
+        encode_batch_size (int): 每批编码的分块数量，默认为 64
+        queue_size (int): 阶段之间有界队列的长度，默认为 16
+        recursive (bool): 是否递归子目录，默认为 True
+        incremental (bool): 是否基于入库清单增量入库，默认为 False。开启后跳过未变化的文件，
+            只为新增分块生成向量，删除已消失的分块；目录模式下还会清理已被删除的文件的分块
+        splitter (str | object): 分块方式，"recursive"、"semantic" 或 "cdc"，自定义分割器需可被pickle传入子进程；
+            "semantic" 会在每个提取进程中各加载一份嵌入模型，默认为 "recursive"
+    返回:
+        Dict[str, int]: 文件路径 -> 成功保存的分块数量
+    异常:
+        RuntimeError: 嵌入线程异常退出
+    """
+    files = collect_files(path_or_pattern, recursive)
+    logger.info(f"共找到{len(files)}个待入库文件：{path_or_pattern}")
+    manifest = get_manifest() if incremental else None
+    # 未变化而跳过的文件 -> 分块数量
+    skipped: Dict[str, int] = {}
+    # 待处理文件 -> 入库前获取的文件状态
+    file_stats: Dict[str, os.stat_result] = {}
+    if manifest is not None:
+        if os.path.isdir(path_or_pattern):
+            # 目录模式下清理清单中已不存在的文件
+            _prune_missing_files(manifest, collection_name, path_or_pattern)
+        pending_files = []
+        for file_path in files:
+            stat = os.stat(file_path)
+            if manifest.is_unchanged(collection_name, file_path, stat):
+                skipped[file_path] = len(manifest.get(collection_name, file_path)["chunk_ids"])
+            else:
+                file_stats[file_path] = stat
+                pending_files.append(file_path)
+        logger.info(f"增量入库：{len(skipped)}个文件未变化已跳过，{len(pending_files)}个文件待处理")
+        files_to_process = pending_files
+    else:
+        files_to_process = files
+    if not files_to_process:
+        return skipped
+
+    # 在主线程中初始化模型和集合，子线程共享同一实例
+    db._get_model()
+    collection = db._get_collection(collection_name)
+    # 开启近似去重时加载SimHash索引（冷启动或有其他进程写入时全量比对一次），去重在主线程中进行，
+    # 写入线程的写入和清理旧分块的删除通过集合变化监听增量应用到索引
+    near_dup = None
+    if NEAR_DUP_ENABLED:
+        import simhash_index
+        near_dup = simhash_index.get_simhash_index(collection_name, collection)
+    # 与已入库内容近似重复而跳过的分块数量
+    near_dup_count = 0
+
+    stats = _IngestStats()
+    errors: List[Exception] = []
+    # 增量模式下记录每个文件的内容哈希和分块ID
+    file_hashes: Dict[str, str] = {}
+    file_ids: Dict[str, List[str]] = {}
+    # 增量模式下上次入库已存在的分块 -> 本次的元数据（位置可能变了），流水线结束后统一刷新
+    metadata_updates: Dict[str, dict] = {}
+    chunk_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    embed_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    embed_thread = threading.Thread(
+        target=_embed_worker,
+        args=(chunk_queue, embed_queue, collection, encode_batch_size, stats, errors),
+        name="ingest-embed",
+        daemon=True
+    )
+    write_thread = threading.Thread(
+        target=_write_worker,
+        args=(embed_queue, collection, collection_name, stats),
+        name="ingest-write",
+        daemon=True
+    )
+    embed_thread.start()
+    write_thread.start()
+
+    # 限制同时在途的提取任务数量
+    max_pending = max_workers * 2
+    # 使用spawn启动子进程，避免在已加载模型和线程的进程中fork
+    ctx = multiprocessing.get_context("spawn")
+    # 增量模式下每个文件上一次入库的分块ID，以及近似去重时不参与比较的分块
+    file_known_ids: Dict[str, set] = {}
+    file_exclude_ids: Dict[str, set] = {}
+
+    def handle_chunks(file_path: str, chunks: List[Tuple[str, dict]]):
+        nonlocal near_dup_count
+        stats.add_chunks(file_path, len(chunks))
+        known_ids = file_known_ids.get(file_path, set())
+        if manifest is not None:
+            # 上次入库已存在的分块直接计为保存成功，不再进入嵌入阶段
+            ids = [db._compute_text_id(chunk) for chunk, _ in chunks]
+            stats.add_saved([file_path for chunk_id in ids if chunk_id in known_ids])
+            for (_, metadata), chunk_id in zip(chunks, ids):
+                if chunk_id in known_ids:
+                    metadata_updates.setdefault(chunk_id, metadata)
+            chunks = [item for item, chunk_id in zip(chunks, ids) if chunk_id not in known_ids]
+            file_ids[file_path].extend(ids)
+        if near_dup is not None and chunks:
+            # 与已入库内容近似重复的分块不进入嵌入阶段，不计入分块总数；
+            # 本文件上一版本独占的分块稍后可能被删除，不参与比较
+            chunk_ids = [db._compute_text_id(chunk) for chunk, _ in chunks]
+            near_ids = near_dup.filter_new(chunk_ids, [chunk for chunk, _ in chunks], file_exclude_ids.get(file_path))
+            if near_ids:
+                duplicates = sum(1 for chunk_id in chunk_ids if chunk_id in near_ids)
+                stats.skip_chunks(file_path, duplicates)
+                near_dup_count += duplicates
+                chunks = [item for item, chunk_id in zip(chunks, chunk_ids) if chunk_id not in near_ids]
+                if manifest is not None:
+                    # 清单中改为记录与之近似重复的保留分块，保留分块所在的文件修改或删除后仍被本文件引用
+                    file_ids[file_path] = [near_ids.get(chunk_id, chunk_id) for chunk_id in file_ids[file_path]]
+        # 按编码批次切分后放入有界队列，队列满时阻塞（背压）
+        for start in range(0, len(chunks), encode_batch_size):
+            chunk_queue.put([
+                (file_path, chunk, metadata) for chunk, metadata in chunks[start:start + encode_batch_size]
+            ])
+
+    try:
+        with ctx.Manager() as manager, \
+                ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as executor:
+            # 提取进程发回分块批次的有界队列，主进程处理不过来时提取进程阻塞
+            result_queue = manager.Queue(maxsize=queue_size)
+            file_iter = iter(files_to_process)
+            # 文件路径 -> 提取任务
+            in_flight: Dict[str, Future] = {}
+            # 提取失败的文件，之后收到的该文件的消息直接丢弃
+            failed_files = set()
+
+            def submit_next() -> bool:
+                file_path = next(file_iter, None)
+                if file_path is None:
+                    return False
+                known_hash = None
+                if manifest is not None:
+                    entry = manifest.get(collection_name, file_path)
+                    # 空字符串表示需要计算哈希但没有可比较的旧哈希
+                    known_hash = (entry or {}).get("content_hash") or ""
+                    known_ids = set((entry or {}).get("chunk_ids") or [])
+                    file_known_ids[file_path] = known_ids
+                    if near_dup is not None and known_ids:
+                        file_exclude_ids[file_path] = known_ids - manifest.referenced_ids(collection_name, exclude=file_path)
+                    file_ids[file_path] = []
+                stats.add_file(file_path, 0)
+                in_flight[file_path] = executor.submit(
+                    _extract_and_split, file_path, chunk_size, chunk_overlap, known_hash, splitter,
+                    result_queue, DEFAULT_STREAM_BATCH_SIZE
+                )
+                return True
+
+            def finish(file_path: str):
+                # 每完成一个任务就补充一个新任务
+                in_flight.pop(file_path, None)
+                submit_next()
+
+            def fail(file_path: str, error: BaseException):
+                logger.error(f"提取文件内容失败：{file_path}, 错误：{str(error)}")
+                failed_files.add(file_path)
+                stats.add_failed_file(file_path)
+                # 已经发出的分块仍会写入；清单中记录为未完成，下次重新处理
+                file_hashes.pop(file_path, None)
+                finish(file_path)
+
+            while len(in_flight) < max_pending and submit_next():
+                pass
+            while in_flight:
+                try:
+                    message = result_queue.get(timeout=0.2)
+                except queue.Empty:
+                    message = None
+                if message is None:
+                    # 提取进程异常退出时不会发送结束消息，检查已结束的任务
+                    for file_path, future in list(in_flight.items()):
+                        if future.done() and future.exception() is not None:
+                            fail(file_path, future.exception())
+                    continue
+                kind, file_path = message[0], message[1]
+                if file_path in failed_files:
+                    continue
+                if kind == "chunks":
+                    handle_chunks(file_path, message[2])
+                elif kind == "unchanged":
+                    # 只是修改时间变了，内容没变，更新清单中的文件状态
+                    entry = manifest.get(collection_name, file_path)
+                    stat = file_stats[file_path]
+                    manifest.update(collection_name, file_path, stat.st_size, stat.st_mtime, message[2], entry["chunk_ids"])
+                    skipped[file_path] = len(entry["chunk_ids"])
+                    stats.remove_file(file_path)
+                    file_ids.pop(file_path, None)
+                    logger.info(f"文件内容未变化，跳过入库：{file_path}")
+                    finish(file_path)
+                elif kind == "done":
+                    _, _, content_hash, (extract_seconds, split_seconds) = message
+                    metrics.observe(metrics.INGEST_STAGE_SECONDS, extract_seconds, stage="extract")
+                    metrics.observe(metrics.INGEST_STAGE_SECONDS, split_seconds, stage="split")
+                    logger.info(f"文件提取分块完成：{file_path}，共{stats.total[file_path]}块")
+                    if manifest is not None:
+                        file_hashes[file_path] = content_hash
+                    finish(file_path)
+    finally:
+        chunk_queue.put(_SENTINEL)
+        embed_thread.join()
+        write_thread.join()
+
+    if near_dup is not None:
+        metrics.inc(metrics.INGEST_CHUNKS_TOTAL, near_dup_count, status="near_duplicate")
+        logger.info(f"共跳过{near_dup_count}个与已入库内容近似重复的分块")
+    if metadata_updates:
+        db.update_metadatas_in_db(list(metadata_updates), list(metadata_updates.values()), collection_name)
+    if manifest is not None:
+        _update_manifest(manifest, collection_name, file_stats, file_hashes, file_ids, stats)
+    if near_dup is not None:
+        # 整个目录入库结束后保存一次（包括清理旧分块的删除）
+        near_dup.save_if_dirty()
+
+    # 提取失败的文件不计入结果（中途失败前已发出的分块仍会写入，清单中记为未完成）
+    failed_files = set(stats.failed_files)
+    for file_path in files:
+        if file_path in stats.total and file_path not in failed_files:
+            metrics.inc(metrics.INGEST_CHUNKS_TOTAL, stats.saved[file_path], status="saved")
+            metrics.inc(metrics.INGEST_CHUNKS_TOTAL, stats.total[file_path] - stats.saved[file_path], status="failed")
+            logger.info(f"文件 {file_path} 已完成入库，成功保存 {stats.saved[file_path]}/{stats.total[file_path]} 个分块")
+    if stats.failed_files:
+        logger.error(f"共有{len(stats.failed_files)}个文件提取失败：{stats.failed_files}")
+    if errors:
+        raise RuntimeError(f"入库流水线异常：{str(errors[0])}")
+    results = {}
+    for file_path in files:
+        if file_path in skipped:
+            results[file_path] = skipped[file_path]
+        elif file_path in stats.total and file_path not in failed_files:
+            results[file_path] = stats.saved[file_path]
+    return results
+
+
+if __name__ == "__main__":
+    dir_to_vectorstore("example_file")
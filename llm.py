@@ -1,13 +1,28 @@
-# 导入OpenAI客户端库
-from openai import OpenAI
+# 导入asyncio，用于识别当前事件循环
+import asyncio
 # 导入os库，用于读取环境变量
 import os
+# 导入time模块，用于统计调用耗时
+import time
+# 导入random模块，用于重试退避的随机抖动
+import random
+# 导入threading模块，用于全局并发限制和限流
+import threading
+# 导入线程池，用于批量并发调用
+from concurrent.futures import ThreadPoolExecutor
+# 导入双端队列，用于并发名额的等待队列
+from collections import deque
 # 导入logging库，用于记录日志
 import logging
-# 导入Optional类型，便于类型注解
-from typing import Optional
+# 导入Optional等类型，便于类型注解
+from typing import Optional, AsyncIterator, Callable, Dict, List, Tuple, Union, TYPE_CHECKING
 
-from sympy import content
+# 导入指标模块，记录大模型调用耗时和token用量
+import metrics
+
+# OpenAI SDK导入较慢，只在类型检查时导入，运行时在第一次创建客户端时才导入
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
 
 # 获取当前模块的logger日志对象
 logger = logging.getLogger(__name__)
@@ -17,11 +32,223 @@ OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.deepseek.com")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY_DEEP", "sk-08eff3175bbb4741a6c957650e2c0bc0")
 # 从环境变量获取模型名称，若未设置则使用默认模型名
 MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "deepseek-chat")
+# 单次请求的读取/写入超时（秒），可在每次调用时通过timeout参数覆盖
+LLM_TIMEOUT = float(os.getenv("RAG_LLM_TIMEOUT", "60"))
+# 建立连接的超时（秒）
+LLM_CONNECT_TIMEOUT = float(os.getenv("RAG_LLM_CONNECT_TIMEOUT", "5"))
+# 连接池的最大连接数
+LLM_MAX_CONNECTIONS = int(os.getenv("RAG_LLM_MAX_CONNECTIONS", "64"))
+# 连接池中保持的最大空闲（keep-alive）连接数
+LLM_MAX_KEEPALIVE = int(os.getenv("RAG_LLM_MAX_KEEPALIVE", "32"))
+# 空闲连接的保持时间（秒）
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("RAG_LLM_KEEPALIVE_EXPIRY", "30"))
+# 遇到429/5xx/超时/连接错误时的最大重试次数
+LLM_MAX_RETRIES = int(os.getenv("RAG_LLM_MAX_RETRIES", "4"))
+# 指数退避的基础等待时间和最大等待时间（秒）
+LLM_BACKOFF_BASE = float(os.getenv("RAG_LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("RAG_LLM_BACKOFF_MAX", "20"))
+# 进程内同时进行的大模型请求数上限（同步和异步调用共享）
+LLM_MAX_CONCURRENCY = int(os.getenv("RAG_LLM_MAX_CONCURRENCY", "16"))
+# 每秒最多发起的请求数（令牌桶），小于等于0表示不限速
+LLM_RATE_LIMIT = float(os.getenv("RAG_LLM_RATE_LIMIT", "0"))
+# 令牌桶容量，允许的突发请求数
+LLM_RATE_BURST = int(os.getenv("RAG_LLM_RATE_BURST", str(max(1, LLM_MAX_CONCURRENCY))))
+# 流式调用时是否请求服务端在最后一个数据块中返回token用量（stream_options.include_usage），
+# 不支持该参数的兼容接口可设置环境变量 RAG_LLM_STREAM_USAGE=0 关闭
+LLM_STREAM_USAGE = os.getenv("RAG_LLM_STREAM_USAGE", "1") != "0"
 
 # 全局OpenAI客户端实例，初始为None，延迟初始化
-_client: Optional[OpenAI] = None
+_client: Optional["OpenAI"] = None
+# 每个事件循环对应的AsyncOpenAI客户端及负责在事件循环结束时关闭它的任务（异步连接池不能跨事件循环复用）
+_async_clients: Dict[asyncio.AbstractEventLoop, Tuple["AsyncOpenAI", "asyncio.Task"]] = {}
+# 创建客户端和限流器时使用的锁
+_init_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限流器，同步和异步调用共享同一个桶：
+    reserve 预占一个令牌并返回需要等待的时间，调用方自行 time.sleep 或 asyncio.sleep
+    """
+
+    def __init__(self, rate: float, burst: int):
+        # 每秒补充的令牌数
+        self.rate = rate
+        # 桶容量
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        预占一个令牌
+        返回:
+            float: 拿到令牌前需要等待的秒数，令牌充足时为0
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 令牌可以透支，透支的部分按补充速度折算为等待时间，先到的请求先拿到令牌
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+def _hand_over(future: asyncio.Future):
+    # 在等待者所属的事件循环中把名额交给它；等待者已被取消时由其自行归还名额
+    if not future.done():
+        future.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """
+    进程内同步和异步调用共享的并发上限（asyncio.Semaphore 只能在一个事件循环中使用，threading.BoundedSemaphore 会阻塞事件循环）。
+    同步调用在当前线程中等待，异步调用等待一个属于自己事件循环的Future，不阻塞事件循环；
+    释放名额时按先来后到直接交给下一个等待者
+    """
+
+    def __init__(self, limit: int):
+        # 同时进行的最大请求数
+        self.limit = limit
+        self._lock = threading.Lock()
+        # 正在使用（包括已交给等待者）的名额数
+        self._in_use = 0
+        # 等待者：同步调用为 threading.Event，异步调用为 (事件循环, Future)
+        self._waiters: deque = deque()
+
+    def acquire(self):
+        """
+        获取一个名额，名额用完时阻塞当前线程
+        """
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        # 被唤醒时名额已经计入 _in_use
+        event.wait()
+
+    async def acquire_async(self):
+        """
+        获取一个名额，名额用完时挂起当前协程而不阻塞事件循环
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove(waiter)
+                    handed_over = False
+                except ValueError:
+                    # 取消前名额已经交给了自己，归还给下一个等待者
+                    handed_over = True
+            if handed_over:
+                self.release()
+            raise
+
+    def release(self):
+        """
+        归还一个名额，有等待者时直接交给最早的等待者
+        """
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                # 事件循环已关闭的等待者不会再被调度，跳过
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(_hand_over, future)
+                    return
+            self._in_use -= 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+# 全局限流器实例，未配置限速时为None
+_rate_limiter: Optional[TokenBucket] = None
+# 全局并发上限，同步调用和所有事件循环中的异步调用共享
+_concurrency_limiter: Optional[ConcurrencyLimiter] = None
+
+
+def _get_rate_limiter() -> Optional[TokenBucket]:
+    global _rate_limiter
+    if LLM_RATE_LIMIT > 0 and _rate_limiter is None:
+        with _init_lock:
+            if _rate_limiter is None:
+                _rate_limiter = TokenBucket(LLM_RATE_LIMIT, LLM_RATE_BURST)
+    return _rate_limiter
+
+
+def _get_concurrency_limiter() -> ConcurrencyLimiter:
+    global _concurrency_limiter
+    if _concurrency_limiter is None:
+        with _init_lock:
+            if _concurrency_limiter is None:
+                _concurrency_limiter = ConcurrencyLimiter(LLM_MAX_CONCURRENCY)
+    return _concurrency_limiter
+
+
+def _reset_clients():
+    """
+    丢弃已创建的客户端、并发上限和限流器，下次调用时按当前配置重新创建（用于修改配置后或测试）
+    """
+    global _client, _rate_limiter, _concurrency_limiter
+    with _init_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        # 取消关闭任务，由各自的事件循环关闭异步客户端的连接池（可以从任意线程调用）
+        for loop, (_, closer) in _async_clients.items():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(closer.cancel)
+        _async_clients.clear()
+        _rate_limiter = None
+        _concurrency_limiter = None
+
+
+def _http_options() -> dict:
+    """
+    构建客户端的连接池和超时配置
+    返回:
+        dict: httpx的Timeout和Limits参数
+    """
+    import httpx
+    return {
+        "timeout": httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        "limits": httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+        ),
+    }
 
-def _get_client() -> OpenAI:
+def _get_client() -> "OpenAI":
     """
     获取OpenAI客户端实例（单例模式）
     返回:
@@ -33,26 +260,188 @@ def _get_client() -> OpenAI:
             raise ValueError(
                 "OPENAI_API_KEY 未设置。请设置环境变量 OPENAI_API_KEY 或在代码中配置。"
             )
-        # 使用指定的base_url和api_key初始化OpenAI客户端
-        _client = OpenAI(base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY)
-        # 记录客户端初始化成功的日志
-        logger.info(f"OpenAI客户端已初始化，base_url: {OPENAI_BASE_URL}")
+        with _init_lock:
+            if _client is None:
+                # 延迟导入OpenAI客户端库
+                from openai import OpenAI, DefaultHttpxClient
+                options = _http_options()
+                # 使用指定的base_url和api_key初始化OpenAI客户端；重试由本模块带抖动的退避负责，关闭SDK自带的重试
+                _client = OpenAI(
+                    base_url=OPENAI_BASE_URL,
+                    api_key=OPENAI_API_KEY,
+                    timeout=options["timeout"],
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=options["limits"], timeout=options["timeout"])
+                )
+                # 记录客户端初始化成功的日志
+                logger.info(f"OpenAI客户端已初始化，base_url: {OPENAI_BASE_URL}")
     return _client
 
+async def _close_on_loop_shutdown(loop: asyncio.AbstractEventLoop, client: "AsyncOpenAI"):
+    """
+    一直等待到被取消（asyncio.run 退出前会取消所有剩余任务，或 _reset_clients 主动取消），
+    然后在事件循环仍在运行时关闭异步客户端的连接池
+    参数:
+        loop (asyncio.AbstractEventLoop): 客户端所属的事件循环
+        client (AsyncOpenAI): 异步客户端实例
+    """
+    try:
+        await loop.create_future()
+    finally:
+        entry = _async_clients.get(loop)
+        if entry is not None and entry[0] is client:
+            del _async_clients[loop]
+        await client.close()
+        logger.debug("AsyncOpenAI客户端已关闭")
+
+def _get_async_client() -> "AsyncOpenAI":
+    """
+    获取当前事件循环下的AsyncOpenAI客户端实例（每个事件循环一个，事件循环结束时自动关闭）
+    返回:
+        AsyncOpenAI: 异步客户端实例
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        if not OPENAI_API_KEY:
+            raise ValueError(
+                "OPENAI_API_KEY 未设置。请设置环境变量 OPENAI_API_KEY 或在代码中配置。"
+            )
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        options = _http_options()
+        client = AsyncOpenAI(
+            base_url=OPENAI_BASE_URL,
+            api_key=OPENAI_API_KEY,
+            timeout=options["timeout"],
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=options["limits"], timeout=options["timeout"])
+        )
+        # 清理没有经过 asyncio.run 正常结束、已关闭的事件循环遗留的客户端
+        for closed in [item for item in _async_clients if item.is_closed()]:
+            del _async_clients[closed]
+        entry = (client, loop.create_task(_close_on_loop_shutdown(loop, client)))
+        _async_clients[loop] = entry
+        logger.info(f"AsyncOpenAI客户端已初始化，base_url: {OPENAI_BASE_URL}")
+    return entry[0]
+
+def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    判断调用失败后是否重试，并计算等待时间
+    参数:
+        error (Exception): 调用抛出的异常
+        attempt (int): 已经重试的次数
+    返回:
+        Optional[float]: 需要等待的秒数，不应重试时为None
+    """
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+    if attempt >= LLM_MAX_RETRIES:
+        return None
+    if isinstance(error, APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+        # 服务端给出Retry-After时按其等待
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), LLM_BACKOFF_MAX)
+            except ValueError:
+                pass
+    elif not isinstance(error, (APITimeoutError, APIConnectionError)):
+        return None
+    # 带完全随机抖动的指数退避，避免大量请求在同一时刻重试
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+def _retry_reason(error: Exception) -> str:
+    status_code = getattr(error, "status_code", None)
+    return str(status_code) if status_code else type(error).__name__
+
+def _record_usage(usage):
+    """
+    记录接口返回的token用量
+    参数:
+        usage: 接口返回的usage对象，可能为None
+    """
+    if usage is None:
+        return
+    metrics.inc(metrics.LLM_TOKENS_TOTAL, usage.prompt_tokens or 0, kind="prompt")
+    metrics.inc(metrics.LLM_TOKENS_TOTAL, usage.completion_tokens or 0, kind="completion")
+
+def _build_messages(prompt: str, system_prompt: Optional[str] = None) -> List[dict]:
+    """
+    构建聊天接口的消息列表
+    参数:
+        prompt (str): 输入的提示词
+        system_prompt (str, optional): 系统提示词，放在消息列表最前面。
+            内容固定不变时，各次请求共享相同的前缀，可命中服务端的前缀缓存
+    返回:
+        List[dict]: 消息列表
+    """
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append(
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt,
+                },
+            ],
+        }
+    )
+    return messages
+
+def _create_with_retry(client: "OpenAI", **kwargs):
+    """
+    在全局并发限制和限流下调用同步聊天接口，遇到429/5xx/超时/连接错误时按抖动退避重试
+    参数:
+        client (OpenAI): 客户端实例
+        **kwargs: 传给 chat.completions.create 的参数
+    返回:
+        ChatCompletion: 接口返回结果
+    """
+    attempt = 0
+    while True:
+        limiter = _get_rate_limiter()
+        if limiter is not None:
+            wait = limiter.reserve()
+            if wait > 0:
+                time.sleep(wait)
+        try:
+            with _get_concurrency_limiter():
+                return client.chat.completions.create(**kwargs)
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            metrics.inc(metrics.LLM_RETRIES_TOTAL, reason=_retry_reason(e))
+            logger.warning(f"调用大模型失败，{delay:.2f}秒后第{attempt}次重试：{str(e)}")
+            time.sleep(delay)
+
 # 定义调用大模型的函数
 
-def invoke(prompt:str, model:Optional[str] = None, temperature: float = 0.7) -> str:
+def invoke(
+    prompt:str,
+    model:Optional[str] = None,
+    temperature: float = 0.7,
+    system_prompt: Optional[str] = None,
+    timeout: Optional[float] = None
+) -> str:
     """
     调用大模型生成回复
     参数:
         prompt (str): 输入的提示词
         model (str, optional): 模型名称，默认使用环境变量或默认值
         temperature (float): 生成温度，默认0.7
+        system_prompt (str, optional): 系统提示词，默认不发送
+        timeout (float, optional): 本次请求的超时（秒），默认使用 RAG_LLM_TIMEOUT
     返回:
         str: 大模型生成的回复内容
     异常:
         ValueError: API密钥未设置
-        Exception: API调用失败
+        Exception: API调用失败（已重试 RAG_LLM_MAX_RETRIES 次）
     """
     try:
         # 获取OpenAI客户端对象
@@ -61,23 +450,17 @@ def invoke(prompt:str, model:Optional[str] = None, temperature: float = 0.7) ->
         model_name = model or MODEL_NAME
         # 记录调式日志，显示模型名和prompt长度
         logger.debug(f"调用大模型，model:{model_name},prompt长度：{len(prompt)}")
-        # 调用OpenAi聊天模型接口生成回复
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt,
-                        },
-                    ],
-                }
-            ],
-            temperature=temperature,
-        )
-        print(f"大模型回复response：{response}")
+        options = {"timeout": timeout} if timeout is not None else {}
+        # 调用OpenAi聊天模型接口生成回复（非流式调用没有首个token的时间点，只记录总耗时）
+        with metrics.timer(metrics.LLM_SECONDS, phase="total"):
+            response = _create_with_retry(
+                client,
+                model=model_name,
+                messages=_build_messages(prompt, system_prompt),
+                temperature=temperature,
+                **options
+            )
+        _record_usage(getattr(response, "usage", None))
         content = response.choices[0].message.content
         # 记录调式日志，标记恢复内容的长度
         logger.debug(f"大模型回复生成成功，长度：{len(content) if content else 0}")
@@ -89,3 +472,157 @@ def invoke(prompt:str, model:Optional[str] = None, temperature: float = 0.7) ->
         logger.error(f"调用大模型失败：{str(e)}")
         raise
 
+# 定义批量并发调用大模型的函数
+def invoke_many(
+    prompts: List[str],
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    system_prompt: Optional[str] = None,
+    timeout: Optional[float] = None,
+    max_workers: Optional[int] = None,
+    return_exceptions: bool = False
+) -> List[Union[str, Exception]]:
+    """
+    并发调用大模型，为每个prompt生成回复。
+    所有调用共享同一个连接池，同时进行的请求数受 RAG_LLM_MAX_CONCURRENCY 限制，速率受 RAG_LLM_RATE_LIMIT 限制
+    参数:
+        prompts (List[str]): 提示词列表
+        model (str, optional): 模型名称，默认使用环境变量或默认值
+        temperature (float): 生成温度，默认0.7
+        system_prompt (str, optional): 系统提示词，所有请求共用
+        timeout (float, optional): 每次请求的超时（秒），默认使用 RAG_LLM_TIMEOUT
+        max_workers (int, optional): 线程数，默认为 RAG_LLM_MAX_CONCURRENCY
+        return_exceptions (bool): 为True时失败的请求在结果中返回异常对象，否则抛出第一个异常
+    返回:
+        List[Union[str, Exception]]: 与prompts一一对应的回复
+    异常:
+        Exception: return_exceptions为False时，任一请求失败（已重试）
+    """
+    if not prompts:
+        return []
+    # 在主线程中初始化客户端，避免多个线程同时创建
+    _get_client()
+
+    def call(prompt: str) -> Union[str, Exception]:
+        try:
+            return invoke(prompt, model=model, temperature=temperature, system_prompt=system_prompt, timeout=timeout)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    workers = min(max_workers or LLM_MAX_CONCURRENCY, len(prompts))
+    logger.info(f"批量调用大模型：{len(prompts)}个请求，并发数{workers}")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-invoke") as executor:
+        return list(executor.map(call, prompts))
+
+# 定义流式调用大模型的异步函数
+async def astream(
+    prompt: str,
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    system_prompt: Optional[str] = None,
+    timeout: Optional[float] = None
+) -> AsyncIterator[str]:
+    """
+    异步流式调用大模型，逐段产出生成的内容。
+    只在收到第一段内容之前重试，已经产出内容后出错直接抛出，避免重复输出
+    参数:
+        prompt (str): 输入的提示词
+        model (str, optional): 模型名称，默认使用环境变量或默认值
+        temperature (float): 生成温度，默认0.7
+        system_prompt (str, optional): 系统提示词，默认不发送
+        timeout (float, optional): 本次请求的超时（秒），默认使用 RAG_LLM_TIMEOUT
+    返回:
+        AsyncIterator[str]: 逐段产出的回复内容
+    异常:
+        ValueError: API密钥未设置
+        Exception: API调用失败
+    """
+    try:
+        client = _get_async_client()
+        model_name = model or MODEL_NAME
+        logger.debug(f"流式调用大模型，model:{model_name},prompt长度：{len(prompt)}")
+        options = {"timeout": timeout} if timeout is not None else {}
+        if LLM_STREAM_USAGE:
+            # 流式响应默认不带usage，需要显式请求才能统计token用量
+            options["stream_options"] = {"include_usage": True}
+        attempt = 0
+        # 整个流式响应期间占用一个并发名额
+        async with _get_concurrency_limiter():
+            while True:
+                limiter = _get_rate_limiter()
+                if limiter is not None:
+                    wait = limiter.reserve()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                start = time.perf_counter()
+                first_token = True
+                try:
+                    stream = await client.chat.completions.create(
+                        model=model_name,
+                        messages=_build_messages(prompt, system_prompt),
+                        temperature=temperature,
+                        stream=True,
+                        **options
+                    )
+                    async for chunk in stream:
+                        # 请求了include_usage时，服务端在最后一个（choices为空的）数据块中返回usage
+                        _record_usage(getattr(chunk, "usage", None))
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if first_token:
+                                first_token = False
+                                metrics.observe(metrics.LLM_SECONDS, time.perf_counter() - start, phase="ttft")
+                            yield delta
+                    metrics.observe(metrics.LLM_SECONDS, time.perf_counter() - start, phase="total")
+                    return
+                except Exception as e:
+                    delay = _retry_delay(e, attempt) if first_token else None
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    metrics.inc(metrics.LLM_RETRIES_TOTAL, reason=_retry_reason(e))
+                    logger.warning(f"流式调用大模型失败，{delay:.2f}秒后第{attempt}次重试：{str(e)}")
+                    await asyncio.sleep(delay)
+    except ValueError as e:
+        logger.error(f"配置错误：{str(e)}")
+        raise
+    except Exception as e:
+        logger.error(f"流式调用大模型失败：{str(e)}")
+        raise
+
+# 定义异步调用大模型的函数
+async def ainvoke(
+    prompt: str,
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    on_token: Optional[Callable[[str], None]] = None,
+    system_prompt: Optional[str] = None,
+    timeout: Optional[float] = None
+) -> str:
+    """
+    异步调用大模型生成回复（内部使用流式接口）
+    参数:
+        prompt (str): 输入的提示词
+        model (str, optional): 模型名称，默认使用环境变量或默认值
+        temperature (float): 生成温度，默认0.7
+        on_token (Callable[[str], None], optional): 每收到一段内容时的回调
+        system_prompt (str, optional): 系统提示词，默认不发送
+        timeout (float, optional): 本次请求的超时（秒），默认使用 RAG_LLM_TIMEOUT
+    返回:
+        str: 大模型生成的完整回复内容
+    异常:
+        ValueError: API密钥未设置
+        Exception: API调用失败
+    """
+    parts = []
+    async for delta in astream(prompt, model=model, temperature=temperature, system_prompt=system_prompt, timeout=timeout):
+        parts.append(delta)
+        if on_token is not None:
+            on_token(delta)
+    content = "".join(parts)
+    logger.debug(f"大模型流式回复生成成功，长度：{len(content)}")
+    return content
@@ -0,0 +1,202 @@
+# 导入os模块，用于路径和文件操作
+import os
+# 导入json模块，用于读写清单文件
+import json
+# 导入hashlib模块，用于计算文件内容哈希
+import hashlib
+# 导入threading模块，保证清单读写的线程安全
+import threading
+# 导入类型注解
+from typing import Dict, List, Optional
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入默认的数据库路径
+from db import DEFAULT_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# 默认的入库清单文件路径，与ChromaDB数据目录放在一起
+DEFAULT_MANIFEST_PATH = f"{DEFAULT_DB_PATH}_manifest.json"
+# 计算文件哈希时每次读取的字节数
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+# 全局清单实例，初始为None，延迟初始化
+_manifest: Optional["IngestManifest"] = None
+
+
+def compute_file_hash(file_path: str) -> str:
+    """
+    分块读取文件并计算内容的md5哈希
+    参数:
+        file_path (str): 文件路径
+    返回:
+        str: 十六进制的文件内容哈希
+    """
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class IngestManifest:
+    """
+    持久化的入库清单：按集合记录每个文件的路径、大小、修改时间、内容哈希以及产生的分块ID，
+    用于判断文件是否变化，实现增量入库。
+    """
+
+    def __init__(self, path: str = DEFAULT_MANIFEST_PATH):
+        # 清单文件路径
+        self.path = path
+        # 读写锁
+        self._lock = threading.RLock()
+        # 清单数据：集合名称 -> 文件绝对路径 -> 文件记录
+        self._data: Dict[str, Dict[str, dict]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+            logger.info(f"已加载入库清单：{path}")
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        # 统一使用绝对路径作为文件的键
+        return os.path.abspath(file_path)
+
+    def get(self, collection_name: str, file_path: str) -> Optional[dict]:
+        """
+        获取文件在指定集合中的入库记录
+        参数:
+            collection_name (str): 集合名称
+            file_path (str): 文件路径
+        返回:
+            Optional[dict]: 文件记录，不存在时返回None
+        """
+        with self._lock:
+            return self._data.get(collection_name, {}).get(self._key(file_path))
+
+    def is_unchanged(self, collection_name: str, file_path: str, stat: Optional[os.stat_result] = None) -> bool:
+        """
+        根据文件大小和修改时间判断文件自上次入库以来是否未变化（O(1)，无需读取文件内容）
+        参数:
+            collection_name (str): 集合名称
+            file_path (str): 文件路径
+            stat (os.stat_result, optional): 已获取的文件状态
+        返回:
+            bool: 文件未变化且上次入库完整时返回True
+        """
+        entry = self.get(collection_name, file_path)
+        if not entry or not entry.get("content_hash"):
+            return False
+        stat = stat or os.stat(file_path)
+        return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+    def update(
+        self,
+        collection_name: str,
+        file_path: str,
+        size: int,
+        mtime: float,
+        content_hash: Optional[str],
+        chunk_ids: List[str]
+    ):
+        """
+        更新文件的入库记录
+        参数:
+            collection_name (str): 集合名称
+            file_path (str): 文件路径
+            size (int): 文件大小
+            mtime (float): 文件修改时间
+            content_hash (str, optional): 文件内容哈希，入库不完整时传None以便下次重新处理
+            chunk_ids (List[str]): 文件产生的分块ID列表
+        """
+        with self._lock:
+            old_entry = self.get(collection_name, file_path)
+            self._data.setdefault(collection_name, {})[self._key(file_path)] = {
+                "size": size,
+                "mtime": mtime,
+                "content_hash": content_hash,
+                "chunk_ids": chunk_ids,
+            }
+            if old_entry and old_entry.get("content_hash") != content_hash:
+                # 文件内容变了，上一个版本的PDF页缓存不再需要
+                self._release_hash(file_path, old_entry.get("content_hash"))
+
+    def remove(self, collection_name: str, file_path: str) -> Optional[dict]:
+        """
+        删除文件的入库记录
+        参数:
+            collection_name (str): 集合名称
+            file_path (str): 文件路径
+        返回:
+            Optional[dict]: 被删除的记录
+        """
+        with self._lock:
+            entry = self._data.get(collection_name, {}).pop(self._key(file_path), None)
+            if entry:
+                self._release_hash(file_path, entry.get("content_hash"))
+            return entry
+
+    def _release_hash(self, file_path: str, content_hash: Optional[str]):
+        # PDF文件的某个版本不再被清单中的任何文件（包括其他集合和内容相同的副本）引用时，清理其页缓存
+        if not content_hash or os.path.splitext(file_path)[-1].lower() != ".pdf":
+            return
+        for entries in self._data.values():
+            if any(entry.get("content_hash") == content_hash for entry in entries.values()):
+                return
+        # 延迟导入，避免 pdf_pages 与 manifest 之间循环导入
+        import pdf_pages
+        pdf_pages.evict(content_hash)
+
+    def files(self, collection_name: str) -> List[str]:
+        """
+        列出集合中记录的所有文件
+        参数:
+            collection_name (str): 集合名称
+        返回:
+            List[str]: 文件绝对路径列表
+        """
+        with self._lock:
+            return list(self._data.get(collection_name, {}))
+
+    def referenced_ids(self, collection_name: str, exclude: Optional[str] = None) -> set:
+        """
+        获取集合中被文件引用的所有分块ID（相同内容的分块可能被多个文件共享）
+        参数:
+            collection_name (str): 集合名称
+            exclude (str, optional): 需要排除的文件路径
+        返回:
+            set: 分块ID集合
+        """
+        exclude_key = self._key(exclude) if exclude else None
+        with self._lock:
+            ids = set()
+            for key, entry in self._data.get(collection_name, {}).items():
+                if key != exclude_key:
+                    ids.update(entry.get("chunk_ids") or [])
+            return ids
+
+    def save(self):
+        """
+        将清单原子地写入磁盘
+        """
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            # 先写临时文件再替换，避免进程中断导致清单损坏
+            os.replace(tmp_path, self.path)
+
+
+def get_manifest() -> IngestManifest:
+    """
+    获取入库清单实例（单例模式）
+    返回:
+        IngestManifest: 清单实例
+    """
+    global _manifest
+    if _manifest is None:
+        _manifest = IngestManifest(DEFAULT_MANIFEST_PATH)
+    return _manifest
@@ -0,0 +1,540 @@
+# 导入os模块，用于读取环境变量和写入导出文件
+import os
+# 导入time模块，用于计时
+import time
+# 导入bisect模块，用于定位直方图分桶
+import bisect
+# 导入threading模块，保证指标读写的线程安全
+import threading
+# 导入atexit模块，进程退出时导出一次指标
+import atexit
+# 导入抽象基类，用于定义导出器接口
+from abc import ABC, abstractmethod
+# 导入类型注解
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 是否启用指标采集，设置环境变量 RAG_METRICS=1 开启；关闭时计时器为空操作，几乎没有开销
+METRICS_ENABLED = os.getenv("RAG_METRICS", "0") == "1"
+# Prometheus文本格式的导出文件路径（可由node_exporter的textfile收集器读取），为空时不导出
+METRICS_PROM_FILE = os.getenv("RAG_METRICS_PROM_FILE", "")
+# 定期导出指标的间隔（秒），长期运行的服务不必等到进程退出才更新导出文件；小于等于0时只在进程退出时导出
+METRICS_FLUSH_INTERVAL = float(os.getenv("RAG_METRICS_FLUSH_INTERVAL", "15"))
+# 耗时直方图的默认分桶上界（秒）
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+# 入库各阶段耗时，标签stage：extract、split、dedupe_lookup、embed、write
+INGEST_STAGE_SECONDS = "rag_ingest_stage_seconds"
+# 单个文件入库总耗时
+INGEST_FILE_SECONDS = "rag_ingest_file_seconds"
+# 入库的分块数量，标签status：saved、failed、near_duplicate（与已入库内容近似重复而跳过）
+INGEST_CHUNKS_TOTAL = "rag_ingest_chunks_total"
+# 查询各阶段耗时，标签stage：embed、expand、retrieve、rerank、prompt_build
+QUERY_STAGE_SECONDS = "rag_query_stage_seconds"
+# 单次查询端到端耗时，标签mode：sync、stream
+QUERY_SECONDS = "rag_query_seconds"
+# 语义答案缓存的查询结果，标签result：hit、miss
+ANSWER_CACHE_TOTAL = "rag_answer_cache_total"
+# 大模型调用耗时，标签phase：ttft（首个token，仅流式调用）、total
+LLM_SECONDS = "rag_llm_seconds"
+# 大模型调用的重试次数，标签reason：HTTP状态码或异常类型
+LLM_RETRIES_TOTAL = "rag_llm_retries_total"
+# 大模型消耗的token数量，标签kind：prompt、completion（取自接口返回的usage）
+LLM_TOKENS_TOTAL = "rag_llm_tokens_total"
+
+# 标签以排序后的(键, 值)元组作为字典键
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    """
+    固定分桶的直方图，记录观测次数、总和、最小/最大值，并可按分桶估算分位数
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        # 分桶上界（升序），最后隐含一个 +Inf 分桶
+        self.buckets = tuple(sorted(buckets))
+        # 每个分桶（非累计）的观测次数，最后一项为 +Inf 分桶
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """
+        记录一次观测值
+        参数:
+            value (float): 观测值
+        """
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        在分桶内线性插值估算分位数
+        参数:
+            q (float): 分位数，取值 0~1
+        返回:
+            float: 估算值，没有观测值时为0
+        """
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            rank = q * self.count
+            cumulative = 0
+            for idx, bucket_count in enumerate(self.counts):
+                if bucket_count and cumulative + bucket_count >= rank:
+                    # 用实际的最小/最大值收紧首尾分桶的边界
+                    lower = max(self.buckets[idx - 1] if idx > 0 else 0.0, self.min)
+                    upper = min(self.buckets[idx] if idx < len(self.buckets) else self.max, self.max)
+                    return lower + (upper - lower) * (rank - cumulative) / bucket_count
+                cumulative += bucket_count
+            return self.max
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            cumulative = 0
+            buckets = []
+            for upper, bucket_count in zip(self.buckets + (float("inf"),), self.counts):
+                cumulative += bucket_count
+                buckets.append((upper, cumulative))
+            result = {
+                "count": self.count,
+                "sum": self.sum,
+                "min": self.min if self.count else 0.0,
+                "max": self.max if self.count else 0.0,
+                "buckets": buckets,
+            }
+        result.update({"p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)})
+        return result
+
+
+class Counter:
+    """
+    单调递增的计数器
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def to_dict(self) -> dict:
+        return {"value": self.value}
+
+
+class _Timer:
+    # 记录一段代码耗时的上下文管理器，退出时写入直方图（出现异常也会记录）
+    __slots__ = ("_histogram", "_start", "seconds")
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+        self._start = 0.0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        self._histogram.observe(self.seconds)
+        return False
+
+
+class _NullTimer:
+    # 关闭指标采集时使用的空计时器，所有调用共享同一个实例
+    __slots__ = ()
+    seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class TimedIterator:
+    """
+    包装一个迭代器，累计在其 __next__ 中花费的时间（包括其内部嵌套的迭代器），
+    用于统计流式管道中某一段的耗时
+    """
+
+    def __init__(self, iterable: Iterable):
+        self._iterator = iter(iterable)
+        # 累计耗时（秒）
+        self.seconds = 0.0
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsExporter(ABC):
+    """
+    指标导出器接口：export 接收 MetricsRegistry.snapshot() 的结果
+    """
+
+    @abstractmethod
+    def export(self, snapshot: List[dict]):
+        """
+        导出一次快照
+        参数:
+            snapshot (List[dict]): MetricsRegistry.snapshot() 的结果
+        """
+
+
+class InMemoryExporter(MetricsExporter):
+    """
+    将最近一次导出的快照保存在内存中，便于在测试或基准中读取
+    """
+
+    def __init__(self):
+        self.snapshot: List[dict] = []
+
+    def export(self, snapshot: List[dict]):
+        self.snapshot = snapshot
+
+    def get(self, name: str, **labels) -> Optional[dict]:
+        """
+        按名称和标签查找一条指标
+        参数:
+            name (str): 指标名称
+            **labels: 标签
+        返回:
+            dict: 指标数据，找不到时为None
+        """
+        wanted = {key: str(value) for key, value in labels.items()}
+        for sample in self.snapshot:
+            if sample["name"] == name and sample["labels"] == wanted:
+                return sample
+        return None
+
+
+def _escape_label_value(value: str) -> str:
+    # Prometheus文本格式要求转义反斜杠、双引号和换行
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels.items())
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def render_prometheus(snapshot: List[dict]) -> str:
+    """
+    将快照渲染为Prometheus文本格式
+    参数:
+        snapshot (List[dict]): MetricsRegistry.snapshot() 的结果
+    返回:
+        str: Prometheus文本格式的指标
+    """
+    lines = []
+    declared = set()
+    for sample in sorted(snapshot, key=lambda item: item["name"]):
+        name, labels = sample["name"], sample["labels"]
+        if name not in declared:
+            lines.append(f"# TYPE {name} {sample['type']}")
+            declared.add(name)
+        if sample["type"] == "counter":
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(sample['value'])}")
+            continue
+        for upper, cumulative in sample["buckets"]:
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(upper)))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(sample['sum'])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {sample['count']}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class PrometheusTextExporter(MetricsExporter):
+    """
+    以Prometheus文本格式导出指标：指定路径时原子地写入文件，否则只保存在 text 属性中
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.text = ""
+
+    def export(self, snapshot: List[dict]):
+        self.text = render_prometheus(snapshot)
+        if not self.path:
+            return
+        try:
+            # 先写临时文件再替换，避免收集器读到写了一半的文件
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.text)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"导出Prometheus指标失败：{self.path}, 错误：{str(e)}")
+            raise
+
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表：按(名称, 标签)保存直方图和计数器，并将快照推送给导出器
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+        self._counters: Dict[Tuple[str, LabelKey], Counter] = {}
+        self._exporters: List[MetricsExporter] = []
+        # 定期导出的后台线程及其停止信号
+        self._flush_thread: Optional[threading.Thread] = None
+        self._flush_stop = threading.Event()
+
+    def histogram(self, name: str, labels: Dict[str, object]) -> Histogram:
+        key = (name, _label_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def counter(self, name: str, labels: Dict[str, object]) -> Counter:
+        key = (name, _label_key(labels))
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, Counter())
+        return counter
+
+    def timer(self, name: str, **labels):
+        """
+        返回记录耗时的上下文管理器，关闭采集时返回共享的空计时器
+        参数:
+            name (str): 直方图名称
+            **labels: 标签
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.histogram(name, labels))
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        向直方图写入一个观测值
+        参数:
+            name (str): 直方图名称
+            value (float): 观测值
+            **labels: 标签
+        """
+        if self.enabled:
+            self.histogram(name, labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        """
+        增加计数器
+        参数:
+            name (str): 计数器名称
+            amount (float): 增加量，默认为1
+            **labels: 标签
+        """
+        if self.enabled:
+            self.counter(name, labels).inc(amount)
+
+    def snapshot(self) -> List[dict]:
+        """
+        获取所有指标的当前值
+        返回:
+            List[dict]: 每条指标一个字典，包含 name、type、labels 以及直方图/计数器的数据
+        """
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+        samples = []
+        for (name, labels), histogram in histograms:
+            samples.append({"name": name, "type": "histogram", "labels": dict(labels), **histogram.to_dict()})
+        for (name, labels), counter in counters:
+            samples.append({"name": name, "type": "counter", "labels": dict(labels), **counter.to_dict()})
+        return samples
+
+    def add_exporter(self, exporter: MetricsExporter):
+        """
+        注册导出器
+        参数:
+            exporter (MetricsExporter): 导出器实例
+        """
+        with self._lock:
+            self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter: MetricsExporter):
+        with self._lock:
+            if exporter in self._exporters:
+                self._exporters.remove(exporter)
+
+    def flush(self):
+        """
+        将当前快照推送给所有导出器，单个导出器失败不影响其他导出器
+        """
+        with self._lock:
+            exporters = list(self._exporters)
+        if not exporters:
+            return
+        snapshot = self.snapshot()
+        for exporter in exporters:
+            try:
+                exporter.export(snapshot)
+            except Exception as e:
+                logger.error(f"导出指标失败：{type(exporter).__name__}, 错误：{str(e)}")
+
+    def start_periodic_flush(self, interval: float = METRICS_FLUSH_INTERVAL):
+        """
+        启动后台线程，每隔interval秒将快照推送给所有导出器；已启动时不重复启动
+        参数:
+            interval (float): 导出间隔（秒），小于等于0时不启动
+        """
+        if interval <= 0:
+            return
+        with self._lock:
+            if self._flush_thread is not None and self._flush_thread.is_alive():
+                return
+            self._flush_stop.clear()
+            self._flush_thread = threading.Thread(
+                target=self._flush_loop, args=(interval,), name="metrics-flush", daemon=True
+            )
+            self._flush_thread.start()
+        logger.info(f"已启动指标定期导出，间隔{interval}秒")
+
+    def stop_periodic_flush(self):
+        """
+        停止定期导出的后台线程
+        """
+        with self._lock:
+            thread, self._flush_thread = self._flush_thread, None
+        if thread is not None:
+            self._flush_stop.set()
+            thread.join()
+
+    def _flush_loop(self, interval: float):
+        # Event.wait 在停止时立即返回，不必等满一个间隔
+        while not self._flush_stop.wait(interval):
+            self.flush()
+
+    def reset(self):
+        """
+        清空所有已记录的指标（主要用于测试和基准）
+        """
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+# 全局指标注册表实例
+_registry = MetricsRegistry()
+if METRICS_PROM_FILE:
+    _registry.add_exporter(PrometheusTextExporter(METRICS_PROM_FILE))
+    # 运行期间定期导出，进程退出时再导出一次最终值
+    _registry.start_periodic_flush(METRICS_FLUSH_INTERVAL)
+    atexit.register(_registry.flush)
+
+
+def get_registry() -> MetricsRegistry:
+    """
+    获取全局指标注册表
+    返回:
+        MetricsRegistry: 注册表实例
+    """
+    return _registry
+
+
+def enabled() -> bool:
+    """是否启用了指标采集"""
+    return _registry.enabled
+
+
+def enable(flag: bool = True):
+    """在运行时开启或关闭指标采集"""
+    _registry.enabled = flag
+
+
+def timer(name: str, **labels):
+    """记录耗时的上下文管理器，见 MetricsRegistry.timer"""
+    if not _registry.enabled:
+        return _NULL_TIMER
+    return _Timer(_registry.histogram(name, labels))
+
+
+def observe(name: str, value: float, **labels):
+    """向全局注册表的直方图写入观测值，见 MetricsRegistry.observe"""
+    if _registry.enabled:
+        _registry.histogram(name, labels).observe(value)
+
+
+def inc(name: str, amount: float = 1.0, **labels):
+    """增加全局注册表的计数器，见 MetricsRegistry.inc"""
+    if _registry.enabled:
+        _registry.counter(name, labels).inc(amount)
+
+
+def timed_iter(iterable: Iterable):
+    """
+    关闭采集时原样返回迭代对象，开启时包装为累计耗时的 TimedIterator
+    参数:
+        iterable (Iterable): 迭代对象
+    返回:
+        Iterable: 原迭代对象或 TimedIterator
+    """
+    return TimedIterator(iterable) if _registry.enabled else iterable
+
+
+def snapshot() -> List[dict]:
+    """获取全局注册表的快照，见 MetricsRegistry.snapshot"""
+    return _registry.snapshot()
+
+
+def add_exporter(exporter: MetricsExporter):
+    """向全局注册表注册导出器，见 MetricsRegistry.add_exporter"""
+    _registry.add_exporter(exporter)
+
+
+def flush():
+    """将全局注册表的快照推送给所有导出器，见 MetricsRegistry.flush"""
+    _registry.flush()
+
+
+def reset():
+    """清空全局注册表，见 MetricsRegistry.reset"""
+    _registry.reset()
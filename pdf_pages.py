@@ -0,0 +1,263 @@
+# 导入os模块，用于路径和环境变量
+import os
+# 导入sqlite3模块，用于保存每页文本的缓存
+import sqlite3
+# 导入threading模块，保证缓存读写的线程安全
+import threading
+# 导入multiprocessing模块，用于指定进程池的启动方式
+import multiprocessing
+# 导入进程池
+from concurrent.futures import ProcessPoolExecutor, Future
+# 导入类型注解
+from typing import Dict, Iterator, List, Optional, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入默认的数据库路径
+from db import DEFAULT_DB_PATH
+# 导入文件内容哈希函数，作为页缓存的键
+from manifest import compute_file_hash
+# 导入PDF页码范围提取函数（PyMuPDF在提取时才导入）
+import extract
+
+logger = logging.getLogger(__name__)
+
+# 是否按 (文件哈希, 页码) 缓存每页的文本，设置环境变量 RAG_PDF_PAGE_CACHE=0 可关闭
+PAGE_CACHE_ENABLED = os.getenv("RAG_PDF_PAGE_CACHE", "1") != "0"
+# 页缓存文件路径，默认与ChromaDB数据目录放在一起
+DEFAULT_PAGE_CACHE_PATH = os.getenv("RAG_PDF_PAGE_CACHE_PATH", f"{DEFAULT_DB_PATH}_pdf_pages.sqlite")
+# 并行提取的进程数，默认为CPU核数，设置为1时在当前进程中逐页提取；
+# 已经在进程池的工作进程中（例如 ingest 的提取进程）时默认不再启动子进程，避免进程数成倍增长
+DEFAULT_PDF_WORKERS = int(os.getenv("RAG_PDF_WORKERS", str(os.cpu_count() or 1)))
+# 待提取的页数达到该值时才启用多进程（启动进程和导入PyMuPDF有固定开销，页数少时得不偿失）
+DEFAULT_PARALLEL_MIN_PAGES = int(os.getenv("RAG_PDF_PARALLEL_MIN_PAGES", "64"))
+# 每个进程任务包含的最大页数：任务越小，按页码顺序产出时等待越短
+DEFAULT_MAX_RANGE_PAGES = 32
+
+# 全局页缓存实例，初始为None，延迟初始化
+_page_cache: Optional["PageCache"] = None
+# 创建页缓存时使用的锁
+_page_cache_lock = threading.Lock()
+
+
+class PageCache:
+    """
+    PDF每页文本的磁盘缓存（SQLite）：键为 (文件内容哈希, 页码)，同时记录每个文件的页数。
+    同一个文件再次入库，或上次提取中途失败后重新入库时，已经提取过的页直接读取缓存
+    """
+
+    def __init__(self, path: str = DEFAULT_PAGE_CACHE_PATH):
+        # 缓存文件路径
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (file_hash TEXT, page INTEGER, text TEXT, PRIMARY KEY (file_hash, page))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (file_hash TEXT PRIMARY KEY, page_count INTEGER)")
+        self._conn.commit()
+
+    def get_page_count(self, file_hash: str) -> Optional[int]:
+        """
+        参数:
+            file_hash (str): 文件内容哈希
+        返回:
+            Optional[int]: 记录的页数，没有记录时为None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT page_count FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+        return row[0] if row else None
+
+    def set_page_count(self, file_hash: str, page_count: int):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (file_hash, page_count))
+            self._conn.commit()
+
+    def cached_pages(self, file_hash: str) -> set:
+        """
+        参数:
+            file_hash (str): 文件内容哈希
+        返回:
+            set: 已缓存的页码
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT page FROM pages WHERE file_hash = ?", (file_hash,)).fetchall()
+        return {row[0] for row in rows}
+
+    def get(self, file_hash: str, page: int) -> Optional[str]:
+        """
+        参数:
+            file_hash (str): 文件内容哈希
+            page (int): 页码（从1开始）
+        返回:
+            Optional[str]: 缓存的页文本，没有缓存时为None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM pages WHERE file_hash = ? AND page = ?", (file_hash, page)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, file_hash: str, pages: List[Tuple[int, str]]):
+        """
+        写入一批页文本
+        参数:
+            file_hash (str): 文件内容哈希
+            pages (List[Tuple[int, str]]): (页码, 文本) 列表
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", [(file_hash, page, text) for page, text in pages]
+            )
+            self._conn.commit()
+
+    def remove(self, file_hash: str):
+        """
+        删除一个文件的所有缓存页
+        参数:
+            file_hash (str): 文件内容哈希
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM pages WHERE file_hash = ?", (file_hash,))
+            self._conn.execute("DELETE FROM files WHERE file_hash = ?", (file_hash,))
+            self._conn.commit()
+
+
+def evict(file_hash: str):
+    """
+    删除一个文件版本的所有缓存页（入库清单中该版本被替换或删除后调用）；
+    页缓存关闭或缓存文件不存在时不做任何事
+    参数:
+        file_hash (str): 文件内容哈希
+    """
+    if not PAGE_CACHE_ENABLED or not file_hash:
+        return
+    if _page_cache is None and not os.path.exists(DEFAULT_PAGE_CACHE_PATH):
+        return
+    get_page_cache().remove(file_hash)
+    logger.debug(f"已清理PDF页缓存：{file_hash}")
+
+
+def get_page_cache() -> PageCache:
+    """
+    获取全局页缓存实例（延迟初始化，单例模式）
+    返回:
+        PageCache: 页缓存实例
+    """
+    global _page_cache
+    if _page_cache is None:
+        with _page_cache_lock:
+            if _page_cache is None:
+                _page_cache = PageCache(DEFAULT_PAGE_CACHE_PATH)
+    return _page_cache
+
+
+def _page_ranges(pages: List[int], range_pages: int) -> List[Tuple[int, int]]:
+    """
+    把升序的页码列表切分为连续的页码范围，每段不超过range_pages页
+    参数:
+        pages (List[int]): 升序的页码
+        range_pages (int): 每段的最大页数
+    返回:
+        List[Tuple[int, int]]: (起始页码, 结束页码)，都包含在内
+    """
+    ranges = []
+    for page in pages:
+        if ranges and page == ranges[-1][1] + 1 and page - ranges[-1][0] < range_pages:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
+
+
+def iter_pdf_pages(
+    pdf_path: str,
+    max_workers: Optional[int] = None,
+    use_cache: Optional[bool] = None
+) -> Iterator[Tuple[int, str]]:
+    """
+    按页码顺序逐页产出PDF文件的文本。
+    已缓存的页直接读取；其余页按连续的页码范围分给多个进程，每个进程单独打开文档提取，
+    结果按页码顺序流式产出，同时只保留有限的进行中任务，内存占用与文档页数无关。
+    待提取的页数少于 RAG_PDF_PARALLEL_MIN_PAGES 或只有一个进程时在当前进程中提取
+    参数:
+        pdf_path (str): PDF文件路径
+        max_workers (int, optional): 进程数，默认读取环境变量 RAG_PDF_WORKERS；在子进程中调用时默认为1
+        use_cache (bool, optional): 是否使用页缓存，默认读取环境变量 RAG_PDF_PAGE_CACHE
+    返回:
+        Iterator[Tuple[int, str]]: (页码（从1开始）, 页文本)
+    异常:
+        FileNotFoundError: 文件不存在
+        Exception: PDF文件读取失败
+    """
+    use_cache = PAGE_CACHE_ENABLED if use_cache is None else use_cache
+    if not max_workers:
+        # 当前进程本身是子进程（如 ingest 进程池中的提取进程）时，各进程已经并行，在进程内提取
+        max_workers = 1 if multiprocessing.parent_process() is not None else DEFAULT_PDF_WORKERS
+    cache = get_page_cache() if use_cache else None
+    file_hash = compute_file_hash(pdf_path) if cache is not None else ""
+    page_count = cache.get_page_count(file_hash) if cache is not None else None
+    if page_count is None:
+        page_count = extract.get_pdf_page_count(pdf_path)
+        if cache is not None:
+            cache.set_page_count(file_hash, page_count)
+    cached = cache.cached_pages(file_hash) if cache is not None else set()
+    missing = [page for page in range(1, page_count + 1) if page not in cached]
+    parallel = max_workers > 1 and len(missing) >= DEFAULT_PARALLEL_MIN_PAGES
+    logger.info(
+        f"提取PDF：{pdf_path}，共{page_count}页，缓存命中{page_count - len(missing)}页，"
+        f"待提取{len(missing)}页{f'（{max_workers}个进程并行）' if parallel else ''}"
+    )
+    if not missing:
+        for page in range(1, page_count + 1):
+            yield page, cache.get(file_hash, page)
+        return
+
+    if parallel:
+        # 每个进程至少分到几段任务，段的大小不超过 DEFAULT_MAX_RANGE_PAGES
+        range_pages = max(1, min(DEFAULT_MAX_RANGE_PAGES, len(missing) // (max_workers * 4)))
+    else:
+        range_pages = DEFAULT_MAX_RANGE_PAGES
+    ranges = _page_ranges(missing, range_pages)
+    # 使用spawn启动子进程，避免在已加载模型和线程的进程中fork
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) \
+        if parallel else None
+    try:
+        # 按页码顺序提交的任务：起始页码 -> Future；同时进行的任务数有上限
+        in_flight: Dict[int, Future] = {}
+        next_range = 0
+        max_in_flight = max_workers * 2
+
+        def submit_until(limit: int):
+            nonlocal next_range
+            while next_range < len(ranges) and len(in_flight) < limit:
+                start, end = ranges[next_range]
+                in_flight[start] = executor.submit(extract.extract_pdf_page_range, pdf_path, start, end)
+                next_range += 1
+
+        range_starts = {start: end for start, end in ranges}
+        page = 1
+        while page <= page_count:
+            if page in cached:
+                yield page, cache.get(file_hash, page)
+                page += 1
+                continue
+            end = range_starts[page]
+            if executor is not None:
+                submit_until(max_in_flight)
+                texts = in_flight.pop(page).result()
+                # 取走一个结果后补充新任务，进程保持忙碌
+                submit_until(max_in_flight)
+            else:
+                texts = extract.extract_pdf_page_range(pdf_path, page, end)
+            if cache is not None:
+                # 每段提取完成后立即写入缓存，中途失败后重新入库时跳过已完成的页
+                cache.put_many(file_hash, texts)
+            yield from texts
+            page = end + 1
+    finally:
+        if executor is not None:
+            # 提前结束（例如调用方停止迭代或出错）时取消尚未开始的任务
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -1,13 +1,43 @@
-# 导入sentence_transformers库中的SentenceTransformer类
-from sentence_transformers import SentenceTransformer
-# 导入chromadb
-import chromadb
 # 从typing库导入List和Optional类型
-from typing import List, Optional
+from typing import List, Optional, Dict, AsyncIterator, Callable, Tuple, Union, TYPE_CHECKING
+# 导入os库，用于读取环境变量
+import os
+# 导入asyncio，用于异步查询
+import asyncio
+# 导入time模块，用于统计查询耗时
+import time
+# 导入datetime，用于按日期范围过滤
+from datetime import datetime
+# 导入线程池，用于把同步的向量化和检索放到线程中执行
+from concurrent.futures import ThreadPoolExecutor
+# 导入threading，保证全局实例在多线程下只初始化一次
+import threading
 # 导入logging库用于日志记录
 import logging
 # 导入llm模块（自定义的大模型API封装）
 import llm
+# 导入嵌入缓存模块
+import embed_cache
+# 导入BM25稀疏索引模块
+import bm25_index
+# 导入编码请求的微批处理器
+from embed_batcher import MicroBatcher
+# 导入语义答案缓存模块
+import answer_cache
+# 导入交叉编码器重排序模块
+import rerank
+# 导入上下文构建模块，负责合并重叠文本块、去重和控制token预算
+import context_builder
+# 导入查询扩展模块（多查询改写/HyDE），参数名与模块名相同，使用别名
+import query_expansion as query_expansion_module
+# 导入进程内共享的模型/客户端注册表
+import registry
+# 导入指标模块，记录查询各阶段耗时
+import metrics
+# sentence_transformers和chromadb只在类型检查时导入，运行时由registry在第一次使用时导入
+if TYPE_CHECKING:
+    import chromadb
+    from sentence_transformers import SentenceTransformer
 # 配置日志：设置日志等级为INFO,指定日志格式
 logging.basicConfig(
     level=logging.INFO,
@@ -23,39 +53,77 @@ DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
 DEFAULT_DB_PATH = "./chroma_db"
 # 默认检索返回文本块数目
 DEFAULT_N_RESULTS = 3
+# 默认检索模式："dense" 仅向量检索，"hybrid" BM25+向量混合检索
+DEFAULT_RETRIEVAL_MODE = "dense"
+# 倒数排名融合（RRF）的平滑常数
+DEFAULT_RRF_K = 60
+# 混合检索时每一路召回的候选数量是最终返回数量的倍数
+DEFAULT_HYBRID_CANDIDATE_FACTOR = 4
+# 检索命中的文本块前后各补充多少个相邻文本块（同一文件中按分块序号相邻），0表示不补充
+DEFAULT_NEIGHBOUR_WINDOW = int(os.getenv("RAG_NEIGHBOUR_WINDOW", "0"))
+# 是否使用压缩向量索引（int8 / IVF-PQ）做向量检索，设置环境变量 RAG_COMPRESSED_INDEX=1 开启，索引用 compressed_index.py build 构建
+COMPRESSED_INDEX_ENABLED = os.getenv("RAG_COMPRESSED_INDEX", "0") == "1"
+# 是否通过微批处理器合并并发的查询向量化请求，设置环境变量 RAG_QUERY_BATCHING=0 可关闭
+QUERY_BATCHING_ENABLED = os.getenv("RAG_QUERY_BATCHING", "1") != "0"
+# 查询向量化微批处理的最大批量
+QUERY_BATCH_SIZE = int(os.getenv("RAG_QUERY_BATCH_SIZE", "32"))
+# 查询向量化微批处理的等待窗口（毫秒）
+QUERY_BATCH_WAIT_MS = float(os.getenv("RAG_QUERY_BATCH_WAIT_MS", "2"))
+# 异步查询同时处理的最大请求数
+MAX_CONCURRENT_QUERIES = int(os.getenv("RAG_MAX_CONCURRENT_QUERIES", "32"))
+# 异步查询中执行向量化和检索的线程数
+EXECUTOR_WORKERS = int(os.getenv("RAG_EXECUTOR_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
 
-# 全局SentenceTransformer模型实例
-_model: Optional[SentenceTransformer] = None
-# 全局Chromadb客户端实例
-_client: Optional[chromadb.PersistentClient] = None
-# 全局Chromadb集合实例
-_collection: Optional[chromadb.Collection] = None
-
-def _get_model():
-    global _model
-    if _model is None:
-        logger.info(f"正在加载嵌入模型：{DEFAULT_MODEL_NAME}")
-        _model = SentenceTransformer(DEFAULT_MODEL_NAME)
-        logger.info("模型加载完成")
-
-    return _model
-
-def _get_client():
-    global _client
-    if _client is None:
-        logger.info(f"正在初始化ChromaDB客户端，路径：{DEFAULT_DB_PATH}")
-        _client = chromadb.PersistentClient(path=DEFAULT_DB_PATH)
-        logger.info(f"Chromadb客户端初始化完成")
-    return _client
-
-def _get_collection(collection_name:str = DEFAULT_COLLECTION_NAME):
-    global _collection
-    if _collection is None:
-        client = _get_client()
-        logger.info(f"正在获取或创建集合：{collection_name}")
-        _collection = client.get_or_create_collection(collection_name)
-        logger.info(f"集合{collection_name} 已准备就绪")
-    return _collection
+# 初始化全局实例时使用的锁（异步查询会在线程池中并发调用）
+_init_lock = threading.RLock()
+# 全局查询向量化微批处理器实例
+_batcher: Optional[MicroBatcher] = None
+# 全局线程池实例，用于异步查询中的同步计算
+_executor: Optional[ThreadPoolExecutor] = None
+# 每个事件循环对应的并发信号量（asyncio.Semaphore不能跨事件循环使用）
+_semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+# 模型、客户端和集合由注册表统一管理，与入库流程共享同一份实例
+def _get_model() -> "SentenceTransformer":
+    return registry.get_model(DEFAULT_MODEL_NAME)
+
+def _get_client() -> "chromadb.ClientAPI":
+    return registry.get_client(DEFAULT_DB_PATH)
+
+def _get_collection(collection_name:str = DEFAULT_COLLECTION_NAME) -> "chromadb.Collection":
+    # 每个集合名称分别缓存
+    return registry.get_collection(collection_name, DEFAULT_DB_PATH)
+
+def warmup(collection_names: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    预热查询所需的资源：嵌入模型、ChromaDB客户端和集合
+
+    参数:
+        collection_names (List[str], optional): 需要预先打开的集合，默认为 ["rag"]
+
+    返回:
+        Dict[str, float]: 资源名称 -> 初始化耗时（秒）
+    """
+    return registry.warmup(
+        model_names=[DEFAULT_MODEL_NAME],
+        collection_names=collection_names or [DEFAULT_COLLECTION_NAME],
+        path=DEFAULT_DB_PATH
+    )
+
+def _get_batcher() -> MicroBatcher:
+    global _batcher
+    with _init_lock:
+        if _batcher is None:
+            model = _get_model()
+            namespace = registry.cache_namespace(DEFAULT_MODEL_NAME)
+            # 整批文本一次读取缓存并只为未命中的文本做一次前向计算
+            _batcher = MicroBatcher(
+                lambda texts: embed_cache.encode_with_cache(model, namespace, texts, batch_size=QUERY_BATCH_SIZE),
+                max_batch_size=QUERY_BATCH_SIZE,
+                max_wait_ms=QUERY_BATCH_WAIT_MS,
+                name="query-embed-batcher"
+            )
+    return _batcher
 
 # 将query字符串转为embedding向量
 def get_query_embedding(query:str) -> List[float]:
@@ -70,16 +138,114 @@ def get_query_embedding(query:str) -> List[float]:
     """
     # 打印debug信息，开始向量化
     logger.debug("正在将Query转为向量")
-    model = _get_model()
-    embedding = model.encode(query).tolist()
+    # 优先读取嵌入缓存，重复的查询无需再次前向计算
+    # 缓存按模型名称和推理后端区分
+    namespace = registry.cache_namespace(DEFAULT_MODEL_NAME)
+    cached = embed_cache.lookup(namespace, query)
+    if cached is not None:
+        embedding = cached.tolist()
+    elif QUERY_BATCHING_ENABLED:
+        # 并发的查询在微批处理器中合并为一次前向计算
+        embedding = _get_batcher().encode(query).tolist()
+    else:
+        embedding = embed_cache.encode_with_cache(_get_model(), namespace, [query])[0].tolist()
     logger.debug(f"Query向量化完成，向量维度：{len(embedding)}")
     return embedding
 
+# 将多个查询文本批量转为embedding向量
+def get_query_embeddings(queries: List[str]) -> List[List[float]]:
+    """
+    将多个查询文本批量转换为embedding向量：先读取嵌入缓存，未命中的文本一次前向计算
+
+    参数:
+        queries (List[str]): 查询文本列表
+
+    返回:
+        List[List[float]]: 与queries一一对应的embedding向量
+    """
+    if not queries:
+        return []
+    namespace = registry.cache_namespace(DEFAULT_MODEL_NAME)
+    embeddings = embed_cache.encode_with_cache(_get_model(), namespace, queries, batch_size=QUERY_BATCH_SIZE)
+    logger.debug(f"批量向量化{len(queries)}个查询完成")
+    return embeddings.tolist()
+
+# 向量检索：多个查询向量一次完成，返回每个查询的排序ID和文本块内容
+def _vector_query(
+        collection: "chromadb.Collection",
+        collection_name: str,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        where: Optional[dict] = None
+) -> Tuple[List[List[str]], Dict[str, str]]:
+    """
+    向量检索。开启压缩索引（RAG_COMPRESSED_INDEX=1）且索引与集合一致时，先在压缩索引中检索再读取文本块内容；
+    有元数据过滤条件、没有索引或索引已过期时直接查询集合
+
+    参数:
+        collection (chromadb.Collection): 集合实例
+        collection_name (str): 集合名称
+        query_embeddings (List[List[float]]): 查询向量
+        n_results (int): 每个查询返回的结果数量
+        where (dict, optional): 元数据过滤条件
+
+    返回:
+        Tuple[List[List[str]], Dict[str, str]]: (每个查询按相关性排序的文本块ID, 文本块ID -> 内容)
+    """
+    if COMPRESSED_INDEX_ENABLED and not where:
+        # 压缩索引依赖numpy计算，只在开启时导入
+        import compressed_index
+        index = compressed_index.get_index(collection_name, collection)
+        if index is not None:
+            rankings = [[doc_id for doc_id, _ in row] for row in index.search(query_embeddings, n_results)]
+            candidates = list(dict.fromkeys(doc_id for ranking in rankings for doc_id in ranking))
+            found = collection.get(ids=candidates, include=["documents"]) if candidates else {"ids": [], "documents": []}
+            documents = dict(zip(found["ids"], found["documents"]))
+            # 索引构建后被删除的文本块不再返回
+            return [[doc_id for doc_id in ranking if doc_id in documents] for ranking in rankings], documents
+    results = collection.query(
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        where=where,
+        include=["documents"]
+    )
+    rankings = results.get("ids") or []
+    documents = {}
+    for batch_ids, batch_docs in zip(rankings, results.get("documents") or []):
+        documents.update(zip(batch_ids, batch_docs))
+    return rankings, documents
+
+# 向量检索，返回最相关的文本块ID和内容；多个查询向量在一次请求中检索并用RRF融合
+def _dense_search(
+        query_embeddings: List[List[float]],
+        n_results: int,
+        collection_name: str,
+        where: Optional[dict] = None
+) -> Tuple[List[str], List[str]]:
+    logger.info(f"正在进行向量检索（{len(query_embeddings)}个查询向量），返回最相关的{n_results}个文本块")
+    collection = _get_collection(collection_name)
+    rankings, documents = _vector_query(collection, collection_name, query_embeddings, n_results, where)
+    # 检查是否检索到相关内容
+    if not documents:
+        logger.warning("未检索到相关内容，请先入库或检查数据库！")
+        raise ValueError("未检索到相关内容，请先入库或检查数据库！")
+    if len(query_embeddings) == 1:
+        # 单个查询向量直接返回第一个结果list
+        ids = rankings[0]
+    else:
+        # 多个查询向量的排序结果用RRF融合
+        ids = reciprocal_rank_fusion(rankings)[:n_results]
+    chunks = [documents[doc_id] for doc_id in ids]
+    # 打印检索到的文本块数量
+    logger.info(f"成功检索到{len(chunks)}个相关文本块")
+    return ids, chunks
+
 # 向量检索，返回最相关的文本块列表
 def retrieve_related_chunks(
         query_embedding: List[float],
         n_results: int = DEFAULT_N_RESULTS,
-        collection_name:str = DEFAULT_COLLECTION_NAME
+        collection_name:str = DEFAULT_COLLECTION_NAME,
+        where: Optional[dict] = None
 ) -> List[str]:
     """
      向量检索，返回最相关的文本块列表
@@ -88,6 +254,7 @@ def retrieve_related_chunks(
         query_embedding (List[float]): 查询向量
         n_results (int): 返回的结果数量，默认为3
         collection_name (str): 集合名称，默认为 "rag"
+        where (dict, optional): 元数据过滤条件（Chroma的where语法），见 build_where
 
     返回:
         List[str]: 最相关的文本块列表
@@ -96,31 +263,428 @@ def retrieve_related_chunks(
         ValueError: 未检索到相关内容
     """
     try:
-        logger.info(f"正在进行向量检索，返回最相关的{n_results}个文本块")
-        collection = _get_collection(collection_name)
-        results = collection.query(
-            query_embeddings = [query_embedding],
-            n_results= n_results
+        return _dense_search([query_embedding], n_results, collection_name, where)[1]
+    except Exception as e:
+        logger.error(f"向量检索失败：{str(e)}")
+        raise
+
+# 倒数排名融合：合并多路检索的排序结果
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = DEFAULT_RRF_K) -> List[str]:
+    """
+    使用倒数排名融合（RRF）合并多路检索结果
+
+    参数:
+        rankings (List[List[str]]): 每一路检索按相关性排序的文档ID列表
+        k (int): 平滑常数，默认为60
+
+    返回:
+        List[str]: 融合后按得分从高到低排列的文档ID列表
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True)
+
+# 混合检索：BM25稀疏检索 + 向量检索，使用RRF融合，返回文本块ID和内容
+def _hybrid_search(
+        queries: List[str],
+        query_embeddings: List[List[float]],
+        n_results: int,
+        collection_name: str,
+        candidate_factor: int,
+        where: Optional[dict] = None
+) -> Tuple[List[str], List[str]]:
+    n_candidates = n_results * candidate_factor
+    logger.info(f"正在进行混合检索（{len(queries)}个查询），每路召回{n_candidates}个候选，返回最相关的{n_results}个文本块")
+    collection = _get_collection(collection_name)
+    # 向量检索，所有查询向量在一次请求中完成
+    dense_rankings, documents = _vector_query(collection, collection_name, query_embeddings, n_candidates, where)
+    dense_ids = [doc_id for ranking in dense_rankings for doc_id in ranking]
+    # BM25检索（索引延迟加载，并只在集合变化时增量同步）
+    index = bm25_index.get_bm25_index(collection_name, collection)
+    sparse_rankings = [[doc_id for doc_id, _ in index.search(query, n_candidates)] for query in queries]
+    if where:
+        # BM25索引不含元数据，候选再到集合中按过滤条件筛一遍
+        candidates = list(dict.fromkeys(doc_id for ranking in sparse_rankings for doc_id in ranking))
+        allowed = set(collection.get(ids=candidates, where=where, include=[])["ids"]) if candidates else set()
+        sparse_rankings = [[doc_id for doc_id in ranking if doc_id in allowed] for ranking in sparse_rankings]
+    sparse_ids = [doc_id for ranking in sparse_rankings for doc_id in ranking]
+    # 融合所有查询的两路结果
+    fused_ids = reciprocal_rank_fusion(dense_rankings + sparse_rankings)[:n_results]
+    if not fused_ids:
+        logger.warning("未检索到相关内容，请先入库或检查数据库！")
+        raise ValueError("未检索到相关内容，请先入库或检查数据库！")
+    # 仅由BM25召回的文档需要补充读取内容
+    missing = [doc_id for doc_id in fused_ids if doc_id not in documents]
+    if missing:
+        extra = collection.get(ids=missing, include=["documents"])
+        documents.update(zip(extra["ids"], extra["documents"]))
+    fused_ids = [doc_id for doc_id in fused_ids if doc_id in documents]
+    logger.info(f"成功检索到{len(fused_ids)}个相关文本块（向量{len(dense_ids)}个，BM25{len(sparse_ids)}个候选）")
+    return fused_ids, [documents[doc_id] for doc_id in fused_ids]
+
+# 混合检索：BM25稀疏检索 + 向量检索，使用RRF融合
+def retrieve_hybrid_chunks(
+        query: str,
+        query_embedding: List[float],
+        n_results: int = DEFAULT_N_RESULTS,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        candidate_factor: int = DEFAULT_HYBRID_CANDIDATE_FACTOR,
+        where: Optional[dict] = None
+) -> List[str]:
+    """
+    混合检索，返回最相关的文本块列表
+
+    参数:
+        query (str): 查询文本，用于BM25检索
+        query_embedding (List[float]): 查询向量，用于向量检索
+        n_results (int): 返回的结果数量，默认为3
+        collection_name (str): 集合名称，默认为 "rag"
+        candidate_factor (int): 每一路召回的候选数量倍数，默认为4
+        where (dict, optional): 元数据过滤条件（Chroma的where语法），见 build_where
+
+    返回:
+        List[str]: 最相关的文本块列表
+
+    异常:
+        ValueError: 未检索到相关内容
+    """
+    try:
+        return _hybrid_search([query], [query_embedding], n_results, collection_name, candidate_factor, where)[1]
+    except Exception as e:
+        logger.error(f"混合检索失败：{str(e)}")
+        raise
+
+# 构建元数据过滤条件
+def build_where(
+        source: Optional[Union[str, List[str]]] = None,
+        file_format: Optional[Union[str, List[str]]] = None,
+        since: Optional[Union[datetime, float]] = None,
+        until: Optional[Union[datetime, float]] = None
+) -> Optional[dict]:
+    """
+    按文档、格式和日期范围构建检索时的元数据过滤条件（Chroma的where语法），
+    对应入库时写入的 source、format、mtime 元数据
+
+    参数:
+        source (str | List[str], optional): 文档路径（相对路径会转换为绝对路径），多个时匹配其中任意一个
+        file_format (str | List[str], optional): 文件格式，如 "pdf" 或 ".pdf"，多个时匹配其中任意一个
+        since (datetime | float, optional): 文件修改时间不早于该时间（datetime或Unix时间戳）
+        until (datetime | float, optional): 文件修改时间不晚于该时间（datetime或Unix时间戳）
+
+    返回:
+        Optional[dict]: 过滤条件，没有任何条件时为None
+    """
+    conditions = []
+
+    def match_any(field: str, values: List[str]) -> dict:
+        return {field: values[0]} if len(values) == 1 else {field: {"$in": values}}
+
+    if source:
+        sources = [source] if isinstance(source, str) else list(source)
+        conditions.append(match_any("source", [os.path.abspath(item) for item in sources]))
+    if file_format:
+        formats = [file_format] if isinstance(file_format, str) else list(file_format)
+        conditions.append(match_any("format", [item.lower().lstrip(".") for item in formats]))
+    for bound, operator in ((since, "$gte"), (until, "$lte")):
+        if bound is not None:
+            timestamp = bound.timestamp() if isinstance(bound, datetime) else bound
+            conditions.append({"mtime": {operator: int(timestamp)}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+# 补充检索结果在原文档中的相邻文本块
+def expand_neighbours(
+        chunk_ids: List[str],
+        related_chunks: List[str],
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        window: int = 1
+) -> Tuple[List[str], List[str]]:
+    """
+    按入库时记录的 source 和 chunk_index 元数据，为每个检索到的文本块补充同一文件中前后各window个相邻文本块。
+    相邻文本块按原文顺序排在命中的文本块周围，构建上下文时首尾重叠的部分会被拼回连续片段；
+    没有位置元数据的文本块保持原样。所有相邻文本块在一次 collection.get 中读取。
+
+    参数:
+        chunk_ids (List[str]): 检索到的文本块ID，按相关性从高到低排列
+        related_chunks (List[str]): 与chunk_ids一一对应的文本块
+        collection_name (str): 集合名称，默认为 "rag"
+        window (int): 前后各补充的文本块数量，默认为1，小于等于0时不补充
+
+    返回:
+        Tuple[List[str], List[str]]: 补充并去重后的(文本块ID列表, 文本块列表)
+    """
+    if window <= 0 or not chunk_ids:
+        return chunk_ids, related_chunks
+    collection = _get_collection(collection_name)
+    found = collection.get(ids=chunk_ids, include=["metadatas"])
+    locations = {}
+    for chunk_id, metadata in zip(found["ids"], found["metadatas"]):
+        if metadata and "source" in metadata and "chunk_index" in metadata:
+            locations[chunk_id] = (metadata["source"], metadata["chunk_index"])
+    # 每个文件需要读取的分块序号
+    wanted: Dict[str, set] = {}
+    for source, chunk_index in locations.values():
+        wanted.setdefault(source, set()).update(
+            idx for idx in range(chunk_index - window, chunk_index + window + 1) if idx >= 0
         )
-        print(f"从数据库查到的原始结果：{results}")
-        related_chunks = results.get("documents")
-        # 检查是否检索到相关内容
-        if not related_chunks or not related_chunks[0]:
-            logger.warning("未检索到相关内容，请先入库或检查数据库！")
-            raise ValueError("未检索到相关内容，请先入库或检查数据库！")
-        # 打印检索到的文本块数量
-        logger.info(f"成功检索到{len(related_chunks[0])}个相关文本块")
-        # 返回第一个结果list（按设计，一个query只查一个batch，取[0]即可）
-        return related_chunks[0]
+    if not wanted:
+        return chunk_ids, related_chunks
+    conditions = [
+        {"$and": [{"source": source}, {"chunk_index": {"$in": sorted(indices)}}]}
+        for source, indices in wanted.items()
+    ]
+    neighbours = collection.get(
+        where=conditions[0] if len(conditions) == 1 else {"$or": conditions},
+        include=["documents", "metadatas"]
+    )
+    by_location = {
+        (metadata["source"], metadata["chunk_index"]): (neighbour_id, document)
+        for neighbour_id, document, metadata in zip(neighbours["ids"], neighbours["documents"], neighbours["metadatas"])
+    }
+    expanded_ids: List[str] = []
+    expanded_chunks: List[str] = []
+    for chunk_id, chunk in zip(chunk_ids, related_chunks):
+        group = [(chunk_id, chunk)]
+        if chunk_id in locations:
+            source, chunk_index = locations[chunk_id]
+            group = [
+                by_location.get((source, idx), (chunk_id, chunk) if idx == chunk_index else None)
+                for idx in range(chunk_index - window, chunk_index + window + 1)
+            ]
+        for item in group:
+            if item is not None and item[0] not in expanded_ids:
+                expanded_ids.append(item[0])
+                expanded_chunks.append(item[1])
+    logger.info(f"补充相邻文本块：{len(chunk_ids)}个文本块扩展为{len(expanded_ids)}个")
+    return expanded_ids, expanded_chunks
 
+# 构建发送给大模型的prompt
+def build_prompt(query: str, related_chunks: List[str], token_budget: Optional[int] = None) -> str:
+    """
+    将检索到的文本块合并为上下文，拼接prompt。
+    首尾重叠的文本块拼回连续片段、近似重复的文本块去掉，再按相关性顺序填充token预算；
+    固定的说明放在系统提示词 context_builder.SYSTEM_PROMPT 中，各次请求共享相同的前缀
+
+    参数:
+        query (str): 用户查询问题
+        related_chunks (List[str]): 检索到的文本块，按相关性从高到低排列
+        token_budget (int, optional): 上下文的token预算，默认读取环境变量 RAG_CONTEXT_TOKEN_BUDGET
+
+    返回:
+        str: prompt
+    """
+    context = context_builder.build_context(related_chunks, token_budget)
+    return f"已知信息：\n{context}\n\n请根据上述内容回答用户问题：{query}"
+
+# 按检索模式检索相关文本块
+def retrieve(
+        query: str,
+        query_embedding: List[float],
+        n_results: int = DEFAULT_N_RESULTS,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        retrieval_mode: str = DEFAULT_RETRIEVAL_MODE,
+        where: Optional[dict] = None
+) -> List[str]:
+    """
+    按检索模式检索相关文本块
+
+    参数:
+        query (str): 查询文本
+        query_embedding (List[float]): 查询向量
+        n_results (int): 返回的结果数量，默认为3
+        collection_name (str): 集合名称，默认为 "rag"
+        retrieval_mode (str): 检索模式，"dense" 或 "hybrid"，默认为 "dense"
+        where (dict, optional): 元数据过滤条件（Chroma的where语法），见 build_where
+
+    返回:
+        List[str]: 最相关的文本块列表
+
+    异常:
+        ValueError: 检索模式不支持或未检索到相关内容
+    """
+    return retrieve_with_ids(query, query_embedding, n_results, collection_name, retrieval_mode, where)[1]
+
+# 按检索模式检索相关文本块，同时返回文本块ID
+def retrieve_with_ids(
+        query: str,
+        query_embedding: List[float],
+        n_results: int = DEFAULT_N_RESULTS,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        retrieval_mode: str = DEFAULT_RETRIEVAL_MODE,
+        where: Optional[dict] = None
+) -> Tuple[List[str], List[str]]:
+    """
+    按检索模式检索相关文本块，同时返回文本块ID（用于答案缓存判断检索结果是否变化）
+
+    参数:
+        query (str): 查询文本
+        query_embedding (List[float]): 查询向量
+        n_results (int): 返回的结果数量，默认为3
+        collection_name (str): 集合名称，默认为 "rag"
+        retrieval_mode (str): 检索模式，"dense" 或 "hybrid"，默认为 "dense"
+        where (dict, optional): 元数据过滤条件（Chroma的where语法），见 build_where
+
+    返回:
+        Tuple[List[str], List[str]]: (文本块ID列表, 文本块列表)
+
+    异常:
+        ValueError: 检索模式不支持或未检索到相关内容
+    """
+    return retrieve_multi([query], [query_embedding], n_results, collection_name, retrieval_mode, where)
+
+# 用多个查询（原始查询及其扩展变体）检索，融合后返回文本块ID和内容
+def retrieve_multi(
+        queries: List[str],
+        query_embeddings: List[List[float]],
+        n_results: int = DEFAULT_N_RESULTS,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        retrieval_mode: str = DEFAULT_RETRIEVAL_MODE,
+        where: Optional[dict] = None
+) -> Tuple[List[str], List[str]]:
+    """
+    用多个查询检索相关文本块：所有查询向量在一次 collection.query 中检索，各路排序结果用RRF融合
+
+    参数:
+        queries (List[str]): 查询文本列表，用于BM25检索
+        query_embeddings (List[List[float]]): 与queries一一对应的查询向量
+        n_results (int): 返回的结果数量，默认为3
+        collection_name (str): 集合名称，默认为 "rag"
+        retrieval_mode (str): 检索模式，"dense" 或 "hybrid"，默认为 "dense"
+        where (dict, optional): 元数据过滤条件（Chroma的where语法），见 build_where
+
+    返回:
+        Tuple[List[str], List[str]]: (文本块ID列表, 文本块列表)
+
+    异常:
+        ValueError: 检索模式不支持或未检索到相关内容
+    """
+    try:
+        # 混合模式下同时做BM25检索并融合
+        if retrieval_mode == "hybrid":
+            return _hybrid_search(
+                queries, query_embeddings, n_results, collection_name, DEFAULT_HYBRID_CANDIDATE_FACTOR, where
+            )
+        if retrieval_mode == "dense":
+            return _dense_search(query_embeddings, n_results, collection_name, where)
     except Exception as e:
-        logger.error(f"向量检索失败：{str(e)}")
+        logger.error(f"检索失败：{str(e)}")
         raise
+    raise ValueError(f"不支持的检索模式：{retrieval_mode}")
+
+# 批量检索：每个查询各自返回检索结果，所有查询向量在一次请求中检索
+def retrieve_batch(
+        queries: List[str],
+        query_embeddings: List[List[float]],
+        n_results: int = DEFAULT_N_RESULTS,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        retrieval_mode: str = DEFAULT_RETRIEVAL_MODE,
+        where: Optional[dict] = None
+) -> List[Tuple[List[str], List[str]]]:
+    """
+    批量检索相关文本块：与 retrieve_multi 不同，各个查询是独立的问题，结果不融合。
+    所有查询向量在一次向量检索请求中完成；混合模式下每个查询再各自做BM25检索并与自己的向量检索结果融合
+
+    参数:
+        queries (List[str]): 查询文本列表
+        query_embeddings (List[List[float]]): 与queries一一对应的查询向量
+        n_results (int): 每个查询返回的结果数量，默认为3
+        collection_name (str): 集合名称，默认为 "rag"
+        retrieval_mode (str): 检索模式，"dense" 或 "hybrid"，默认为 "dense"
+        where (dict, optional): 元数据过滤条件（Chroma的where语法），见 build_where
+
+    返回:
+        List[Tuple[List[str], List[str]]]: 与queries一一对应的 (文本块ID列表, 文本块列表)，未检索到内容的查询为两个空列表
+
+    异常:
+        ValueError: 检索模式不支持
+    """
+    if retrieval_mode not in ("dense", "hybrid"):
+        raise ValueError(f"不支持的检索模式：{retrieval_mode}")
+    if not queries:
+        return []
+    try:
+        collection = _get_collection(collection_name)
+        n_fetch = n_results * DEFAULT_HYBRID_CANDIDATE_FACTOR if retrieval_mode == "hybrid" else n_results
+        rankings, documents = _vector_query(collection, collection_name, query_embeddings, n_fetch, where)
+        rankings = rankings or [[] for _ in queries]
+        if retrieval_mode == "hybrid":
+            index = bm25_index.get_bm25_index(collection_name, collection)
+            sparse_rankings = [[doc_id for doc_id, _ in index.search(query, n_fetch)] for query in queries]
+            candidates = list(dict.fromkeys(doc_id for ranking in sparse_rankings for doc_id in ranking))
+            if where and candidates:
+                # BM25索引不含元数据，候选再到集合中按过滤条件筛一遍
+                allowed = set(collection.get(ids=candidates, where=where, include=[])["ids"])
+                sparse_rankings = [[doc_id for doc_id in ranking if doc_id in allowed] for ranking in sparse_rankings]
+            rankings = [
+                reciprocal_rank_fusion([dense, sparse])[:n_results] for dense, sparse in zip(rankings, sparse_rankings)
+            ]
+            # 仅由BM25召回的文档一次补充读取内容
+            missing = list(dict.fromkeys(doc_id for ranking in rankings for doc_id in ranking if doc_id not in documents))
+            if missing:
+                extra = collection.get(ids=missing, include=["documents"])
+                documents.update(zip(extra["ids"], extra["documents"]))
+        results = []
+        for ranking in rankings:
+            ids = [doc_id for doc_id in ranking if doc_id in documents]
+            results.append((ids, [documents[doc_id] for doc_id in ids]))
+        logger.info(f"批量检索完成：{len(queries)}个查询，{sum(1 for ids, _ in results if ids)}个检索到相关内容")
+        return results
+    except Exception as e:
+        logger.error(f"批量检索失败：{str(e)}")
+        raise
+
+# 检索相关文本块，并查询语义答案缓存
+def _retrieve_cached(
+        query: str,
+        query_embedding: List[float],
+        n_results: int,
+        collection_name: str,
+        retrieval_mode: str,
+        use_answer_cache: bool,
+        use_rerank: bool = False,
+        expansion: str = "none",
+        where: Optional[dict] = None,
+        neighbour_window: int = 0
+) -> Tuple[List[str], List[str], Optional[Tuple[int, int]], Optional[str]]:
+    # 先记录集合状态，再检索，保证缓存的答案不会比检索结果更新
+    state = answer_cache.collection_state(_get_collection(collection_name), collection_name) if use_answer_cache else None
+    queries, query_embeddings = [query], [query_embedding]
+    if expansion != "none":
+        # 扩展出的变体一次批量向量化，原始查询的向量已经算好
+        with metrics.timer(metrics.QUERY_STAGE_SECONDS, stage="expand"):
+            queries = query_expansion_module.expand_query(query, expansion)
+            query_embeddings += get_query_embeddings(queries[1:])
+    # 重排序时多召回一些候选，由交叉编码器挑出最好的n_results个
+    n_fetch = n_results * rerank.DEFAULT_OVERFETCH_FACTOR if use_rerank else n_results
+    with metrics.timer(metrics.QUERY_STAGE_SECONDS, stage="retrieve"):
+        chunk_ids, related_chunks = retrieve_multi(
+            queries, query_embeddings, n_fetch, collection_name, retrieval_mode, where
+        )
+    if use_rerank:
+        with metrics.timer(metrics.QUERY_STAGE_SECONDS, stage="rerank"):
+            chunk_ids, related_chunks, _ = rerank.get_reranker().rerank(query, chunk_ids, related_chunks, n_results)
+    if neighbour_window > 0:
+        # 相邻文本块在重排序之后补充，只扩展最终选中的文本块
+        chunk_ids, related_chunks = expand_neighbours(chunk_ids, related_chunks, collection_name, neighbour_window)
+    cached = None
+    if use_answer_cache:
+        cached = answer_cache.get_answer_cache().get(collection_name, state, query_embedding, chunk_ids)
+        metrics.inc(metrics.ANSWER_CACHE_TOTAL, result="miss" if cached is None else "hit")
+    return chunk_ids, related_chunks, state, cached
 
 def query_rag(
         query: str,
         n_results: int = DEFAULT_N_RESULTS,
-        collection_name:str = DEFAULT_COLLECTION_NAME
+        collection_name:str = DEFAULT_COLLECTION_NAME,
+        retrieval_mode: str = DEFAULT_RETRIEVAL_MODE,
+        use_answer_cache: Optional[bool] = None,
+        use_rerank: Optional[bool] = None,
+        query_expansion: Optional[str] = None,
+        where: Optional[dict] = None,
+        neighbour_window: Optional[int] = None
 ) -> str:
     """
     RAG查询主函数：向量检索 + LLM生成答案
@@ -129,6 +693,16 @@ def query_rag(
         query (str): 用户查询问题
         n_results (int): 检索的文档块数量，默认为3
         collection_name (str): 集合名称，默认为 "rag"
+        retrieval_mode (str): 检索模式，"dense" 仅向量检索，"hybrid" BM25+向量混合检索，默认为 "dense"
+        use_answer_cache (bool, optional): 是否使用语义答案缓存，默认读取环境变量 RAG_ANSWER_CACHE
+        use_rerank (bool, optional): 是否召回更多候选并用交叉编码器重排序，只把最好的n_results个文本块放入prompt，
+            默认读取环境变量 RAG_RERANK
+        query_expansion (str, optional): 查询扩展方式，"none"、"multi_query"、"hyde"、"multi_query+hyde" 或 "template"，
+            扩展出的变体批量向量化后在一次检索请求中检索并用RRF融合，默认读取环境变量 RAG_QUERY_EXPANSION
+        where (dict, optional): 元数据过滤条件（Chroma的where语法），只在匹配的文本块中检索，
+            例如按文档、格式或日期范围过滤，见 build_where
+        neighbour_window (int, optional): 为每个检索到的文本块补充前后各多少个相邻文本块，
+            默认读取环境变量 RAG_NEIGHBOUR_WINDOW
 
     返回:
         str: LLM生成的答案
@@ -139,24 +713,44 @@ def query_rag(
     try:
         # 打印RAG查询日志
         logger.info(f"开始RAG查询：{query}")
+        start = time.perf_counter()
         # 步骤1：将查询文本转为向量
-        quer_embedding = get_query_embedding(query)
-        # 步骤2：基于query embedding做向量检索
-        related_chunks = retrieve_related_chunks(
+        with metrics.timer(metrics.QUERY_STAGE_SECONDS, stage="embed"):
+            quer_embedding = get_query_embedding(query)
+        if use_answer_cache is None:
+            use_answer_cache = answer_cache.ANSWER_CACHE_ENABLED
+        if use_rerank is None:
+            use_rerank = rerank.RERANK_ENABLED
+        # 步骤2：基于query embedding做向量检索（混合模式下同时做BM25检索并融合），可选查询扩展和重排序
+        chunk_ids, related_chunks, state, cached = _retrieve_cached(
+            query,
             quer_embedding,
             n_results,
-            collection_name
+            collection_name,
+            retrieval_mode,
+            use_answer_cache,
+            use_rerank,
+            query_expansion or query_expansion_module.DEFAULT_EXPANSION,
+            where,
+            DEFAULT_NEIGHBOUR_WINDOW if neighbour_window is None else neighbour_window
         )
+        # 语义相近的查询检索到相同的文本块时，直接返回缓存的答案
+        if cached is not None:
+            metrics.observe(metrics.QUERY_SECONDS, time.perf_counter() - start, mode="sync")
+            return cached
         # 步骤3：将检索到的文本块合并为上下文，拼接prompt
-        context = "\n".join(related_chunks)
-        prompt = f"已知信息：\n{context}\n\n请根据上述内容回答用户问题：{query}"
+        with metrics.timer(metrics.QUERY_STAGE_SECONDS, stage="prompt_build"):
+            prompt = build_prompt(query, related_chunks)
         # 打印构建的prompt长度
         logger.debug(f"Prompt已构建，长度: {len(prompt)}")
         # 步骤4：调用llm.invoke（大语言模型调用）生成最终答案
         logger.info("正在调用大模型生成答案...")
-        answer = llm.invoke(prompt)
+        answer = llm.invoke(prompt, system_prompt=context_builder.SYSTEM_PROMPT)
         # 打印答案生成完成
         logger.info("答案生成完成")
+        if use_answer_cache:
+            answer_cache.get_answer_cache().put(collection_name, state, quer_embedding, chunk_ids, answer)
+        metrics.observe(metrics.QUERY_SECONDS, time.perf_counter() - start, mode="sync")
 
         # 返回模型生成的答案
         return answer
@@ -167,6 +761,144 @@ def query_rag(
         logger.error(f"RAG查询过程中发生错误：{str(e)}")
         raise
 
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _init_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="rag-query")
+    return _executor
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        # 清理已关闭的事件循环对应的信号量
+        for closed in [item for item in _semaphores if item.is_closed()]:
+            del _semaphores[closed]
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+async def astream_rag(
+        query: str,
+        n_results: int = DEFAULT_N_RESULTS,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        retrieval_mode: str = DEFAULT_RETRIEVAL_MODE,
+        use_answer_cache: Optional[bool] = None,
+        use_rerank: Optional[bool] = None,
+        query_expansion: Optional[str] = None,
+        where: Optional[dict] = None,
+        neighbour_window: Optional[int] = None
+) -> AsyncIterator[str]:
+    """
+    异步RAG查询，流式产出大模型的回答。
+    向量化和检索放到线程池中执行，不阻塞事件循环；同时处理的请求数受 MAX_CONCURRENT_QUERIES 限制。
+
+    参数:
+        query (str): 用户查询问题
+        n_results (int): 检索的文档块数量，默认为3
+        collection_name (str): 集合名称，默认为 "rag"
+        retrieval_mode (str): 检索模式，"dense" 或 "hybrid"，默认为 "dense"
+        use_answer_cache (bool, optional): 是否使用语义答案缓存，默认读取环境变量 RAG_ANSWER_CACHE
+        use_rerank (bool, optional): 是否召回更多候选并用交叉编码器重排序，默认读取环境变量 RAG_RERANK
+        query_expansion (str, optional): 查询扩展方式，见 query_rag，默认读取环境变量 RAG_QUERY_EXPANSION
+        where (dict, optional): 元数据过滤条件，见 query_rag
+        neighbour_window (int, optional): 补充的相邻文本块数量，默认读取环境变量 RAG_NEIGHBOUR_WINDOW
+
+    返回:
+        AsyncIterator[str]: 逐段产出的答案，命中答案缓存时一次性产出完整答案
+
+    异常:
+        ValueError: 检索失败或未找到相关内容
+    """
+    async with _get_semaphore():
+        try:
+            logger.info(f"开始异步RAG查询：{query}")
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            executor = _get_executor()
+            # 步骤1：在线程池中将查询文本转为向量
+            with metrics.timer(metrics.QUERY_STAGE_SECONDS, stage="embed"):
+                query_embedding = await loop.run_in_executor(executor, get_query_embedding, query)
+            if use_answer_cache is None:
+                use_answer_cache = answer_cache.ANSWER_CACHE_ENABLED
+            if use_rerank is None:
+                use_rerank = rerank.RERANK_ENABLED
+            # 步骤2：在线程池中检索相关文本块（可选查询扩展和重排序）
+            chunk_ids, related_chunks, state, cached = await loop.run_in_executor(
+                executor, _retrieve_cached, query, query_embedding, n_results, collection_name, retrieval_mode,
+                use_answer_cache, use_rerank, query_expansion or query_expansion_module.DEFAULT_EXPANSION, where,
+                DEFAULT_NEIGHBOUR_WINDOW if neighbour_window is None else neighbour_window
+            )
+            if cached is not None:
+                metrics.observe(metrics.QUERY_SECONDS, time.perf_counter() - start, mode="stream")
+                yield cached
+                return
+            # 步骤3：拼接prompt
+            with metrics.timer(metrics.QUERY_STAGE_SECONDS, stage="prompt_build"):
+                prompt = build_prompt(query, related_chunks)
+            logger.debug(f"Prompt已构建，长度: {len(prompt)}")
+            # 步骤4：流式调用大模型
+            logger.info("正在流式调用大模型生成答案...")
+            parts = []
+            async for delta in llm.astream(prompt, system_prompt=context_builder.SYSTEM_PROMPT):
+                parts.append(delta)
+                yield delta
+            logger.info("答案生成完成")
+            metrics.observe(metrics.QUERY_SECONDS, time.perf_counter() - start, mode="stream")
+            # 只缓存完整生成的答案（调用方中途停止迭代时不会执行到这里）
+            if use_answer_cache:
+                answer_cache.get_answer_cache().put(collection_name, state, query_embedding, chunk_ids, "".join(parts))
+        except ValueError as e:
+            logger.error(f"异步RAG查询失败：{str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"异步RAG查询过程中发生错误：{str(e)}")
+            raise
+
+async def aquery_rag(
+        query: str,
+        n_results: int = DEFAULT_N_RESULTS,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        retrieval_mode: str = DEFAULT_RETRIEVAL_MODE,
+        on_token: Optional[Callable[[str], None]] = None,
+        use_answer_cache: Optional[bool] = None,
+        use_rerank: Optional[bool] = None,
+        query_expansion: Optional[str] = None,
+        where: Optional[dict] = None,
+        neighbour_window: Optional[int] = None
+) -> str:
+    """
+    异步RAG查询主函数：返回完整答案，可通过on_token回调实时获取流式输出
+
+    参数:
+        query (str): 用户查询问题
+        n_results (int): 检索的文档块数量，默认为3
+        collection_name (str): 集合名称，默认为 "rag"
+        retrieval_mode (str): 检索模式，"dense" 或 "hybrid"，默认为 "dense"
+        on_token (Callable[[str], None], optional): 每收到一段答案时的回调
+        use_answer_cache (bool, optional): 是否使用语义答案缓存，默认读取环境变量 RAG_ANSWER_CACHE
+        use_rerank (bool, optional): 是否召回更多候选并用交叉编码器重排序，默认读取环境变量 RAG_RERANK
+        query_expansion (str, optional): 查询扩展方式，见 query_rag，默认读取环境变量 RAG_QUERY_EXPANSION
+        where (dict, optional): 元数据过滤条件，见 query_rag
+        neighbour_window (int, optional): 补充的相邻文本块数量，默认读取环境变量 RAG_NEIGHBOUR_WINDOW
+
+    返回:
+        str: LLM生成的答案
+
+    异常:
+        ValueError: 检索失败或未找到相关内容
+    """
+    parts = []
+    async for delta in astream_rag(
+        query, n_results, collection_name, retrieval_mode, use_answer_cache, use_rerank, query_expansion,
+        where, neighbour_window
+    ):
+        parts.append(delta)
+        if on_token is not None:
+            on_token(delta)
+    return "".join(parts)
+
 if __name__ == "__main__":
     query = "红楼梦的作者是谁？"
     logger.info(f"用户查询：{query}")
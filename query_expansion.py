@@ -0,0 +1,135 @@
+# 导入os模块，用于读取环境变量
+import os
+# 导入正则表达式，用于清理大模型输出和模板改写
+import re
+# 导入threading模块，保证扩展结果缓存的线程安全
+import threading
+# 导入有序字典，用于LRU淘汰
+from collections import OrderedDict
+# 导入类型注解
+from typing import List, Optional, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入llm模块，用于让大模型生成改写问题和假设答案
+import llm
+
+logger = logging.getLogger(__name__)
+
+# 默认的查询扩展方式，设置环境变量 RAG_QUERY_EXPANSION 修改
+DEFAULT_EXPANSION = os.getenv("RAG_QUERY_EXPANSION", "none")
+# 支持的查询扩展方式：
+# "none" 不扩展；"multi_query" 大模型改写问题；"hyde" 大模型生成假设答案（HyDE）；
+# "multi_query+hyde" 同时生成改写问题和假设答案（两次调用并发进行）；"template" 本地模板改写，不调用大模型
+EXPANSION_MODES = ("none", "multi_query", "hyde", "multi_query+hyde", "template")
+# 大模型改写的问题数量
+DEFAULT_NUM_VARIANTS = int(os.getenv("RAG_QUERY_EXPANSION_VARIANTS", "3"))
+# 生成改写和假设答案使用的温度，较低的温度让改写贴近原问题
+EXPANSION_TEMPERATURE = float(os.getenv("RAG_QUERY_EXPANSION_TEMPERATURE", "0.3"))
+# 缓存的大模型扩展结果条数（LRU），相同的问题再次查询时不再调用大模型，0表示不缓存
+DEFAULT_EXPANSION_CACHE_SIZE = int(os.getenv("RAG_QUERY_EXPANSION_CACHE_SIZE", "1024"))
+
+# 大模型扩展结果的缓存：(查询, 扩展方式, 改写数量) -> 变体列表，按最近使用时间排列
+_expansion_cache: "OrderedDict[Tuple[str, str, int], List[str]]" = OrderedDict()
+# 读写扩展结果缓存时使用的锁
+_expansion_cache_lock = threading.Lock()
+
+MULTI_QUERY_PROMPT = (
+    "请将下面的问题改写为{n}个表述不同但含义相同的问题，用于在知识库中检索相关资料。"
+    "每行一个问题，不要编号，不要输出其他内容。\n问题：{query}"
+)
+HYDE_PROMPT = (
+    "请写一段约100字的文字，直接回答下面的问题，写法尽量接近资料原文。"
+    "即使不确定也请给出最可能的答案，不要说明这是假设。\n问题：{query}"
+)
+
+# 去掉大模型输出中每行开头的编号和列表符号
+_LIST_MARKER_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+[.、)）]|[（(]\d+[)）])\s*")
+# 模板改写时去掉的疑问词和句末语气词、问号
+_QUESTION_WORDS_PATTERN = re.compile(r"(请问|是谁|是什么|什么是|有哪些|为什么|怎么样|如何|吗|呢|\?|？)")
+
+
+def _parse_variants(text: str, query: str, n_variants: int) -> List[str]:
+    variants = []
+    for line in text.splitlines():
+        line = _LIST_MARKER_PATTERN.sub("", line).strip()
+        if line and line != query and line not in variants:
+            variants.append(line)
+    return variants[:n_variants]
+
+
+def template_variants(query: str) -> List[str]:
+    """
+    不调用大模型的本地模板改写：去掉疑问词得到关键词形式的查询，更接近陈述句写成的资料原文
+    参数:
+        query (str): 原始查询
+    返回:
+        List[str]: 改写后的查询（不含原始查询，可能为空）
+    """
+    keywords = _QUESTION_WORDS_PATTERN.sub(" ", query)
+    keywords = re.sub(r"\s+", " ", keywords).strip(" ，,。.的")
+    variants = []
+    if keywords and keywords != query:
+        variants.append(keywords)
+        variants.append(f"关于{keywords}的介绍")
+    return variants
+
+
+def expand_query(query: str, mode: Optional[str] = None, n_variants: int = DEFAULT_NUM_VARIANTS) -> List[str]:
+    """
+    生成查询的扩展变体，原始查询总是排在第一个。
+    大模型扩展的结果按 (查询, 扩展方式, 改写数量) 缓存在进程内的LRU中，重复的查询（例如答案缓存命中时）不再调用大模型；
+    扩展失败（例如大模型调用出错）时只记录警告并返回原始查询，不影响检索
+    参数:
+        query (str): 原始查询
+        mode (str, optional): 扩展方式，见 EXPANSION_MODES，默认读取环境变量 RAG_QUERY_EXPANSION
+        n_variants (int): 大模型改写的问题数量
+    返回:
+        List[str]: [原始查询, 变体1, 变体2, ...]
+    异常:
+        ValueError: 不支持的扩展方式
+    """
+    mode = mode or DEFAULT_EXPANSION
+    if mode not in EXPANSION_MODES:
+        raise ValueError(f"不支持的查询扩展方式：{mode}，可选：{', '.join(EXPANSION_MODES)}")
+    if mode == "none":
+        return [query]
+    if mode == "template":
+        variants = template_variants(query)
+    else:
+        key = (query, mode, n_variants)
+        with _expansion_cache_lock:
+            cached = _expansion_cache.get(key)
+            if cached is not None:
+                _expansion_cache.move_to_end(key)
+                logger.debug(f"命中查询扩展缓存（{mode}）")
+                return [query] + cached
+        prompts = []
+        if mode in ("multi_query", "multi_query+hyde"):
+            prompts.append(MULTI_QUERY_PROMPT.format(n=n_variants, query=query))
+        if mode in ("hyde", "multi_query+hyde"):
+            prompts.append(HYDE_PROMPT.format(query=query))
+        try:
+            # 改写和假设答案互不依赖，一次批量调用并发生成
+            outputs = llm.invoke_many(prompts, temperature=EXPANSION_TEMPERATURE)
+        except Exception as e:
+            logger.warning(f"查询扩展失败，只使用原始查询检索：{str(e)}")
+            return [query]
+        variants = []
+        if mode in ("multi_query", "multi_query+hyde"):
+            variants.extend(_parse_variants(outputs[0], query, n_variants))
+        if mode in ("hyde", "multi_query+hyde"):
+            hypothetical = outputs[-1].strip()
+            if hypothetical:
+                variants.append(hypothetical)
+    # 去掉与原始查询重复的变体
+    variants = [variant for variant in dict.fromkeys(variants) if variant != query]
+    if mode != "template" and DEFAULT_EXPANSION_CACHE_SIZE > 0:
+        # 只缓存成功的大模型扩展，调用失败时下次仍会重试
+        with _expansion_cache_lock:
+            _expansion_cache[key] = variants
+            _expansion_cache.move_to_end(key)
+            while len(_expansion_cache) > DEFAULT_EXPANSION_CACHE_SIZE:
+                _expansion_cache.popitem(last=False)
+    logger.info(f"查询扩展（{mode}）：生成{len(variants)}个变体")
+    return [query] + variants
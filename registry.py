@@ -0,0 +1,314 @@
+# 导入os模块，用于规范化数据库路径
+import os
+# 导入time模块，用于统计预热耗时
+import time
+# 导入threading模块，保证资源只初始化一次
+import threading
+# 导入线程池，用于并行预热模型和客户端
+from concurrent.futures import ThreadPoolExecutor
+# 导入类型注解
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple, TYPE_CHECKING
+# 导入logging模块，用于日志记录
+import logging
+
+# chromadb和sentence_transformers（含torch）导入很慢，只在类型检查时导入，
+# 运行时在第一次创建对应资源时才导入
+if TYPE_CHECKING:
+    import chromadb
+
+logger = logging.getLogger(__name__)
+
+# 默认的嵌入模型名称
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+# 默认的数据库文件路径
+DEFAULT_DB_PATH = "./chroma_db"
+# 嵌入模型的推理后端："torch"（PyTorch）、"onnx"（ONNX Runtime）、"onnx-int8"（ONNX Runtime + 动态量化int8）
+DEFAULT_EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "torch")
+# 支持的推理后端
+EMBED_BACKENDS = ("torch", "onnx", "onnx-int8")
+# int8后端使用的量化模型文件（相对于模型仓库），可按CPU指令集选择：
+# onnx/model_quint8_avx2.onnx、onnx/model_qint8_avx512.onnx、onnx/model_qint8_avx512_vnni.onnx、onnx/model_qint8_arm64.onnx
+ONNX_INT8_FILE = os.getenv("RAG_EMBED_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+# 向量库引擎："chroma"（ChromaDB持久化客户端）或 "local"（vector_store.LocalVectorStore，内存映射矩阵+精确检索）
+DEFAULT_VECTOR_STORE = os.getenv("RAG_VECTOR_STORE", "chroma")
+
+
+def cache_namespace(model_name: str, backend: Optional[str] = None) -> str:
+    """
+    嵌入缓存的命名空间：不同推理后端产生的向量略有差异，需要分开缓存
+    参数:
+        model_name (str): 模型名称
+        backend (str, optional): 推理后端，默认为 DEFAULT_EMBED_BACKEND
+    返回:
+        str: 命名空间，PyTorch后端沿用模型名称本身
+    """
+    backend = backend or DEFAULT_EMBED_BACKEND
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def load_model(model_name: str, backend: Optional[str] = None):
+    """
+    按推理后端加载SentenceTransformer模型（不经过注册表缓存）
+    参数:
+        model_name (str): 模型名称
+        backend (str, optional): 推理后端，默认为 DEFAULT_EMBED_BACKEND
+    返回:
+        SentenceTransformer: 嵌入模型实例
+    异常:
+        ValueError: 不支持的推理后端
+    """
+    backend = backend or DEFAULT_EMBED_BACKEND
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"不支持的嵌入推理后端：{backend}，可选：{', '.join(EMBED_BACKENDS)}")
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        # 使用模型仓库中导出好的 onnx/model.onnx（需要安装 sentence-transformers[onnx]）
+        return SentenceTransformer(model_name, backend="onnx")
+    # 使用模型仓库中动态量化为int8的ONNX模型
+    return SentenceTransformer(model_name, backend="onnx", model_kwargs={"file_name": ONNX_INT8_FILE})
+
+
+class ResourceRegistry:
+    """
+    进程内共享的重量级资源注册表：嵌入模型（按模型名称）、重排序模型、ChromaDB客户端（按数据库路径）
+    以及集合句柄（按数据库路径和集合名称）。
+    所有资源在第一次使用时才初始化；每个资源有独立的锁，加载模型时不会阻塞获取集合等其他操作。
+    """
+
+    def __init__(self):
+        # 保护下面几个字典以及各资源锁的创建
+        self._lock = threading.Lock()
+        # 资源键 -> 初始化该资源时使用的锁
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        # (模型名称, 推理后端) -> 模型实例
+        self._models: Dict[Tuple[str, str], object] = {}
+        # 模型名称 -> 交叉编码器（重排序模型）实例
+        self._cross_encoders: Dict[str, object] = {}
+        # 数据库绝对路径 -> 客户端实例
+        self._clients: Dict[str, "chromadb.ClientAPI"] = {}
+        # (数据库绝对路径, 集合名称, 向量库引擎) -> 集合实例
+        self._collections: Dict[Tuple[str, str, str], "chromadb.Collection"] = {}
+
+    @staticmethod
+    def _normalize_path(path: str) -> str:
+        # 同一个目录的不同写法（相对/绝对路径）共享同一个客户端
+        return os.path.abspath(path)
+
+    def _get_or_create(self, store: dict, key: Hashable, factory: Callable[[], object]):
+        # 快速路径：已初始化的资源直接返回
+        value = store.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault((id(store), key), threading.Lock())
+        # 双重检查，同一个资源只初始化一次
+        with key_lock:
+            value = store.get(key)
+            if value is None:
+                value = factory()
+                store[key] = value
+        return value
+
+    def get_model(self, model_name: str = DEFAULT_MODEL_NAME, backend: Optional[str] = None):
+        """
+        获取嵌入模型实例（延迟加载，同名模型在同一推理后端下只加载一次）
+        参数:
+            model_name (str): 模型名称
+            backend (str, optional): 推理后端，默认为 DEFAULT_EMBED_BACKEND
+        返回:
+            SentenceTransformer: 嵌入模型实例
+        """
+        backend = backend or DEFAULT_EMBED_BACKEND
+
+        def load():
+            logger.info(f"正在加载嵌入模型：{model_name}，推理后端：{backend}")
+            model = load_model(model_name, backend)
+            logger.info(f"嵌入模型{model_name}加载完成")
+            return model
+        return self._get_or_create(self._models, (model_name, backend), load)
+
+    def set_model(self, model_name: str, model, backend: Optional[str] = None):
+        """
+        注册一个已创建的模型实例，替换同名模型
+        参数:
+            model_name (str): 模型名称
+            model: 模型实例
+            backend (str, optional): 推理后端，默认为 DEFAULT_EMBED_BACKEND
+        """
+        self._models[(model_name, backend or DEFAULT_EMBED_BACKEND)] = model
+
+    def get_cross_encoder(self, model_name: str):
+        """
+        获取交叉编码器（重排序模型）实例（延迟加载，同名模型只加载一次）
+        参数:
+            model_name (str): 模型名称
+        返回:
+            CrossEncoder: 交叉编码器实例
+        """
+        def load():
+            logger.info(f"正在加载重排序模型：{model_name}")
+            from sentence_transformers import CrossEncoder
+            model = CrossEncoder(model_name)
+            logger.info(f"重排序模型{model_name}加载完成")
+            return model
+        return self._get_or_create(self._cross_encoders, model_name, load)
+
+    def set_cross_encoder(self, model_name: str, model):
+        """
+        注册一个已创建的交叉编码器实例，替换同名模型
+        参数:
+            model_name (str): 模型名称
+            model: 交叉编码器实例
+        """
+        self._cross_encoders[model_name] = model
+
+    def get_client(self, path: str = DEFAULT_DB_PATH) -> "chromadb.ClientAPI":
+        """
+        获取ChromaDB客户端实例（延迟初始化，同一路径在进程内只打开一次）
+        参数:
+            path (str): 数据库路径
+        返回:
+            chromadb.PersistentClient: 客户端实例
+        """
+        path = self._normalize_path(path)
+
+        def connect():
+            logger.info(f"正在初始化Chromadb客户端,路径：{path}")
+            import chromadb
+            client = chromadb.PersistentClient(path=path)
+            logger.info("Chromadb客户端初始化完成")
+            return client
+        return self._get_or_create(self._clients, path, connect)
+
+    def get_collection(
+        self,
+        collection_name: str,
+        path: str = DEFAULT_DB_PATH,
+        store: Optional[str] = None
+    ) -> "chromadb.Collection":
+        """
+        获取集合实例，集合不存在时创建（每个集合名称分别缓存）
+        参数:
+            collection_name (str): 集合名称
+            path (str): 数据库路径
+            store (str, optional): 向量库引擎，默认为 DEFAULT_VECTOR_STORE；
+                非 "chroma" 的引擎返回与ChromaDB集合接口兼容的实例，见 vector_store
+        返回:
+            chromadb.Collection: 集合实例
+        """
+        store = store or DEFAULT_VECTOR_STORE
+        key = (self._normalize_path(path), collection_name, store)
+
+        def open_collection():
+            logger.info(f"正在获取或创建集合：{collection_name}（{store}）")
+            if store == "chroma":
+                collection = self.get_client(path).get_or_create_collection(collection_name)
+            else:
+                # 其他引擎在第一次使用时才导入
+                import vector_store
+                collection = vector_store.open_store(store, collection_name, self._normalize_path(path))
+            logger.info(f"集合{collection_name} 已准备就绪")
+            return collection
+        return self._get_or_create(self._collections, key, open_collection)
+
+    def warmup(
+        self,
+        model_names: Iterable[str] = (DEFAULT_MODEL_NAME,),
+        collection_names: Iterable[str] = (),
+        path: str = DEFAULT_DB_PATH
+    ) -> Dict[str, float]:
+        """
+        显式预热：并行加载模型、打开客户端和集合，使第一个请求不再承担冷启动开销
+        参数:
+            model_names (Iterable[str]): 需要加载的模型名称
+            collection_names (Iterable[str]): 需要打开的集合名称
+            path (str): 数据库路径
+        返回:
+            Dict[str, float]: 资源名称 -> 初始化耗时（秒）
+        """
+        def timed(name: str, fn: Callable[[], object]) -> Tuple[str, float]:
+            start = time.perf_counter()
+            fn()
+            return name, time.perf_counter() - start
+
+        collection_names = list(collection_names)
+
+        def open_store():
+            # 集合依赖客户端，在同一个任务中依次打开
+            if DEFAULT_VECTOR_STORE == "chroma":
+                self.get_client(path)
+            for name in collection_names:
+                self.get_collection(name, path)
+
+        tasks = [(f"model:{name}", lambda name=name: self.get_model(name)) for name in model_names]
+        tasks.append((f"client:{self._normalize_path(path)}", open_store))
+        # 模型加载和客户端初始化互不依赖，并行执行
+        with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="registry-warmup") as executor:
+            timings = dict(executor.map(lambda task: timed(*task), tasks))
+        logger.info(f"资源预热完成：{', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items())}")
+        return timings
+
+    def clear(self):
+        """
+        释放所有已缓存的资源引用（主要用于测试和切换数据库路径）
+        """
+        with self._lock:
+            self._models.clear()
+            self._cross_encoders.clear()
+            self._clients.clear()
+            self._collections.clear()
+            self._key_locks.clear()
+
+
+# 全局资源注册表实例
+_registry = ResourceRegistry()
+
+
+def get_registry() -> ResourceRegistry:
+    """
+    获取全局资源注册表
+    返回:
+        ResourceRegistry: 注册表实例
+    """
+    return _registry
+
+
+def get_model(model_name: str = DEFAULT_MODEL_NAME, backend: Optional[str] = None):
+    """获取全局注册表中的嵌入模型，见 ResourceRegistry.get_model"""
+    return _registry.get_model(model_name, backend)
+
+
+def set_model(model_name: str, model, backend: Optional[str] = None):
+    """在全局注册表中注册模型实例，见 ResourceRegistry.set_model"""
+    _registry.set_model(model_name, model, backend)
+
+
+def get_cross_encoder(model_name: str):
+    """获取全局注册表中的交叉编码器，见 ResourceRegistry.get_cross_encoder"""
+    return _registry.get_cross_encoder(model_name)
+
+
+def set_cross_encoder(model_name: str, model):
+    """在全局注册表中注册交叉编码器实例，见 ResourceRegistry.set_cross_encoder"""
+    _registry.set_cross_encoder(model_name, model)
+
+
+def get_client(path: str = DEFAULT_DB_PATH) -> "chromadb.ClientAPI":
+    """获取全局注册表中的ChromaDB客户端，见 ResourceRegistry.get_client"""
+    return _registry.get_client(path)
+
+
+def get_collection(collection_name: str, path: str = DEFAULT_DB_PATH, store: Optional[str] = None) -> "chromadb.Collection":
+    """获取全局注册表中的集合，见 ResourceRegistry.get_collection"""
+    return _registry.get_collection(collection_name, path, store)
+
+
+def warmup(
+    model_names: Iterable[str] = (DEFAULT_MODEL_NAME,),
+    collection_names: Iterable[str] = (),
+    path: str = DEFAULT_DB_PATH
+) -> Dict[str, float]:
+    """预热全局注册表中的资源，见 ResourceRegistry.warmup"""
+    return _registry.warmup(model_names, collection_names, path)
@@ -0,0 +1,143 @@
+# 导入os模块，用于读取环境变量
+import os
+# 导入threading模块，保证得分缓存读写的线程安全
+import threading
+# 导入有序字典，用于LRU淘汰
+from collections import OrderedDict
+# 导入类型注解
+from typing import List, Optional, Tuple
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于排序得分
+import numpy as np
+
+# 导入进程内共享的模型注册表，交叉编码器在第一次重排序时才加载
+import registry
+
+logger = logging.getLogger(__name__)
+
+# 是否默认在查询中启用重排序，设置环境变量 RAG_RERANK=1 开启
+RERANK_ENABLED = os.getenv("RAG_RERANK", "0") == "1"
+# 默认的交叉编码器（重排序模型）名称
+DEFAULT_RERANK_MODEL = os.getenv("RAG_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# 重排序时召回的候选数量是最终返回数量的倍数
+DEFAULT_OVERFETCH_FACTOR = int(os.getenv("RAG_RERANK_OVERFETCH", "4"))
+# 每批送入交叉编码器的(查询, 文本块)对数量
+DEFAULT_RERANK_BATCH_SIZE = int(os.getenv("RAG_RERANK_BATCH_SIZE", "32"))
+# 缓存的(查询, 文本块)得分数量
+DEFAULT_SCORE_CACHE_SIZE = int(os.getenv("RAG_RERANK_CACHE_SIZE", "10000"))
+
+# 全局重排序器实例，初始为None，延迟初始化
+_reranker: Optional["Reranker"] = None
+# 创建重排序器实例时使用的锁
+_reranker_lock = threading.Lock()
+
+
+class Reranker:
+    """
+    交叉编码器重排序：对(查询, 候选文本块)逐对打分，按得分重新排序并只保留最好的几个。
+    文本块ID即内容哈希，(查询, 文本块ID)的得分可以直接缓存，重复的查询和热门文本块无需再次打分。
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        batch_size: int = DEFAULT_RERANK_BATCH_SIZE,
+        cache_size: int = DEFAULT_SCORE_CACHE_SIZE,
+        model=None
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        # 交叉编码器，为None时在第一次打分时从注册表获取共享的模型
+        self._model = model
+        self._lock = threading.Lock()
+        # (查询, 文本块ID) -> 得分，按最近使用时间排列
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+
+    def _get_model(self):
+        if self._model is None:
+            self._model = registry.get_cross_encoder(self.model_name)
+        return self._model
+
+    def score(self, query: str, chunk_ids: List[str], chunks: List[str]) -> np.ndarray:
+        """
+        计算查询与每个文本块的相关性得分，优先读取得分缓存，未命中的文本块分批打分
+        参数:
+            query (str): 查询文本
+            chunk_ids (List[str]): 文本块ID
+            chunks (List[str]): 文本块内容，与chunk_ids一一对应
+        返回:
+            np.ndarray: 与chunks一一对应的得分，越大越相关
+        """
+        scores = np.empty(len(chunks), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for idx, chunk_id in enumerate(chunk_ids):
+                cached = self._scores.get((query, chunk_id))
+                if cached is None:
+                    missing.append(idx)
+                else:
+                    self._scores.move_to_end((query, chunk_id))
+                    scores[idx] = cached
+        if missing:
+            logger.debug(f"重排序打分：{len(chunks)}个候选，缓存未命中{len(missing)}个")
+            predicted = self._get_model().predict(
+                [(query, chunks[idx]) for idx in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            predicted = np.asarray(predicted, dtype=np.float32).reshape(len(missing))
+            scores[missing] = predicted
+            with self._lock:
+                for idx, value in zip(missing, predicted.tolist()):
+                    self._scores[(query, chunk_ids[idx])] = value
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        return scores
+
+    def rerank(
+        self,
+        query: str,
+        chunk_ids: List[str],
+        chunks: List[str],
+        top_n: int
+    ) -> Tuple[List[str], List[str], List[float]]:
+        """
+        按交叉编码器得分重新排序候选文本块
+        参数:
+            query (str): 查询文本
+            chunk_ids (List[str]): 候选文本块ID
+            chunks (List[str]): 候选文本块内容
+            top_n (int): 保留的文本块数量
+        返回:
+            Tuple[List[str], List[str], List[float]]: 按得分从高到低排列的(文本块ID, 文本块内容, 得分)
+        """
+        if not chunks:
+            return [], [], []
+        scores = self.score(query, chunk_ids, chunks)
+        # 稳定排序，得分相同时保留原检索顺序
+        order = np.argsort(-scores, kind="stable")[:top_n]
+        logger.info(f"重排序完成：{len(chunks)}个候选中保留{len(order)}个")
+        return [chunk_ids[idx] for idx in order], [chunks[idx] for idx in order], scores[order].tolist()
+
+    def clear_cache(self):
+        """
+        清空得分缓存
+        """
+        with self._lock:
+            self._scores.clear()
+
+
+def get_reranker() -> Reranker:
+    """
+    获取重排序器实例（单例模式）
+    返回:
+        Reranker: 重排序器实例
+    """
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker()
+        return _reranker
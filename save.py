@@ -1,16 +1,31 @@
 # 导入os模块，用于路径和文件操作
 import os
-# 导入Optional类型用于类型注解（本文件其实未用到）
-from typing import Optional
-
-from sympy.strategies.core import switch
+# 导入time模块，用于统计入库耗时
+import time
+# 导入bisect模块，用于按字符偏移查找分块所在的页
+import bisect
+# 导入Optional、List类型用于类型注解
+from typing import Optional, List, Iterable, Iterator, Tuple, Union
 
 # 从db模块导入保存文本到数据库的函数
-from db import save_text_to_db, DEFAULT_COLLECTION_NAME
-# 导入extract模块，用于处理各种格式的文本提取
+from db import (
+    save_texts_to_db,
+    delete_texts_from_db,
+    update_metadatas_in_db,
+    _compute_text_id,
+    _get_collection,
+    DEFAULT_COLLECTION_NAME,
+    DEFAULT_ENCODE_BATCH_SIZE,
+    DEFAULT_WRITE_BATCH_SIZE,
+)
+# 导入入库清单，用于增量入库
+from manifest import get_manifest, compute_file_hash
+# 导入extract模块，用于处理各种格式的文本提取（各格式的解析库在提取时才导入）
 import extract
-# 导入递归字符分割器，用于文本分块
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+# 导入指标模块，记录入库各阶段耗时
+import metrics
+# 递归字符分割器（langchain_text_splitters）、语义分块器和内容定义分块器在创建分割器时才导入，
+# SimHash近似去重索引在开启 RAG_NEAR_DUP 时才导入
 
 # 导入logging模块，用于日志记录
 import logging
@@ -23,6 +38,35 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_CHUNK_SIZE = 200
 DEFAULT_CHUNK_OVERLAP = 30
+# 流式分块时缓冲区达到多少个分块大小后触发一次分割
+DEFAULT_STREAM_BUFFER_CHUNKS = 8
+# 默认的分块方式："recursive" 递归字符分割，"semantic" 语义分块，"cdc" 内容定义分块（切分点由滚动哈希决定，编辑后未变化区域的分块ID保持不变）
+DEFAULT_SPLITTER = "recursive"
+# 是否在入库时跳过与已入库分块近似重复（SimHash汉明距离很小）的分块，设置环境变量 RAG_NEAR_DUP=1 开启
+NEAR_DUP_ENABLED = os.getenv("RAG_NEAR_DUP", "0") == "1"
+# 支持自动提取的文件扩展名
+SUPPORTED_EXTENSIONS = (
+    ".pdf", ".docx", ".doc", ".xlsx", ".xls", ".pptx", ".ppt",
+    ".html", ".htm", ".xml", ".csv", ".json", ".md", ".txt", ".jsonl"
+)
+# 扩展名 -> (文件类型名称, extract模块中的提取函数名)
+_EXTRACTORS = {
+    ".pdf": ("PDF", "extract_pdf_text"),
+    ".docx": ("Word", "extract_text_from_word"),
+    ".doc": ("Word", "extract_text_from_word"),
+    ".xlsx": ("Excel", "extract_text_from_excel"),
+    ".xls": ("Excel", "extract_text_from_excel"),
+    ".pptx": ("PPT", "extract_ppt_text"),
+    ".ppt": ("PPT", "extract_ppt_text"),
+    ".html": ("HTML", "extract_text_from_html"),
+    ".htm": ("HTML", "extract_text_from_html"),
+    ".xml": ("XML", "extract_xml_text"),
+    ".csv": ("CSV", "read_csv_to_text"),
+    ".json": ("JSON", "extract_text_from_json"),
+    ".md": ("文本/Markdown/JSONL", "read_text_file"),
+    ".txt": ("文本/Markdown/JSONL", "read_text_file"),
+    ".jsonl": ("文本/Markdown/JSONL", "read_text_file"),
+}
 
 # 定义自动根据文件类型提取文本内容的函数
 def extract_text_auto(file_path:str) -> str:
@@ -46,55 +90,306 @@ def extract_text_auto(file_path:str) -> str:
     ext = os.path.splitext(file_path)[-1].lower()
 
     try:
-        # 如果是pdf文件
-        if ext == ".pdf":
-            logger.info(f"检测到PDF文件，开始提取文本: {file_path}")
-            return extract.extract_pdf_text(file_path)
-        # 如果是Word文档
-        elif ext in [".docx", ".doc"]:
-            logger.info(f"检测到Word文件，开始提取文本: {file_path}")
-            return extract.extract_text_from_word(file_path)
-        # 如果是Excel文件
-        elif ext in [".xlsx", ".xls"]:
-            logger.info(f"检测到Excel文件，开始提取文本: {file_path}")
-            return extract.extract_text_from_excel(file_path)
-        # 如果是PPT文件
-        elif ext in [".pptx", ".ppt"]:
-            logger.info(f"检测到PPT文件，开始提取文本: {file_path}")
-            return extract.extract_ppt_text(file_path)
-        # 如果是HTML文件
-        elif ext in [".html", ".htm"]:
-            logger.info(f"检测到HTML文件，开始提取文本: {file_path}")
-            return extract.extract_text_from_html(file_path)
-        # 如果是XML文件
-        elif ext == ".xml":
-            logger.info(f"检测到XML文件，开始提取文本: {file_path}")
-            return extract.extract_xml_text(file_path)
-        # 如果是CSV文件
-        elif ext == ".csv":
-            logger.info(f"检测到CSV文件，开始提取文本: {file_path}")
-            return extract.read_csv_to_text(file_path)
-        # 如果是JSON文件
-        elif ext == ".json":
-            logger.info(f"检测到JSON文件，开始提取文本: {file_path}")
-            return extract.extract_text_from_json(file_path)
-        # 如果是纯文本、Markdown、JSONL文件
-        elif ext in [".md", ".txt", ".jsonl"]:
-            logger.info(f"检测到文本/Markdown/JSONL文件，开始读取: {file_path}")
-            return extract.read_text_file(file_path)
+        # 按扩展名查表找到对应的提取函数，解析库在提取函数第一次被调用时才导入
+        entry = _EXTRACTORS.get(ext)
         # 其余不支持的文件类型
-        else:
+        if entry is None:
             logger.error(f"不支持的文件类型: {ext}")
             raise ValueError(f"不支持的文件类型: {ext}")
+        label, func_name = entry
+        logger.info(f"检测到{label}文件，开始提取文本: {file_path}")
+        return getattr(extract, func_name)(file_path)
     except Exception as e:
         logger.error(f"提取文件内容失败: {file_path}, 错误: {str(e)}")
         raise
+# 定义文本分块函数
+def split_text(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[str]:
+    """
+    使用递归字符分割器将文本分块
+    参数:
+        text (str): 待分块的文本
+        chunk_size (int): 分块大小，默认为 200
+        chunk_overlap (int): 分块重叠长度，默认为 30
+    返回:
+        List[str]: 分块后的文本列表
+    """
+    return get_splitter("recursive", chunk_size, chunk_overlap).split_text(text)
+
+# 定义根据分块方式创建分割器的函数
+def get_splitter(
+    splitter: Union[str, object] = DEFAULT_SPLITTER,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP
+):
+    """
+    根据分块方式创建分割器
+    参数:
+        splitter (str | object): "recursive"、"semantic"、"cdc"，或任何带有 split_text(text) -> List[str] 方法的对象
+        chunk_size (int): 分块大小，对 "recursive" 生效，"cdc" 作为最大分块长度，默认为 200
+        chunk_overlap (int): 分块重叠长度，仅对 "recursive" 生效，默认为 30
+    返回:
+        带有 split_text 方法的分割器
+    异常:
+        ValueError: 不支持的分块方式
+    """
+    if splitter == "recursive":
+        # 延迟导入递归字符分割器
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap
+        )
+    if splitter == "semantic":
+        # 延迟导入语义分块器
+        from semantic_chunker import SemanticChunker
+        return SemanticChunker()
+    if splitter == "cdc":
+        # 延迟导入内容定义分块器
+        from cdc_chunker import ContentDefinedChunker
+        return ContentDefinedChunker(max_size=chunk_size)
+    if hasattr(splitter, "split_text"):
+        return splitter
+    raise ValueError(f"不支持的分块方式：{splitter}")
+
+# 定义为文本段补齐分隔符的函数
+def _join_segments(segments: Iterable[str], separator: str) -> Iterator[str]:
+    """
+    在文本段之间插入分隔符，使所有文本段直接拼接后与整体提取结果一致
+    参数:
+        segments (Iterable[str]): 文本段
+        separator (str): 文本段之间的分隔符
+    返回:
+        Iterator[str]: 补齐分隔符后的文本段
+    """
+    for idx, segment in enumerate(segments):
+        yield segment if idx == 0 else separator + segment
+
+# 定义为带位置的文本段补齐分隔符的函数
+def _join_located(segments: Iterable[Tuple[str, dict]], separator: str) -> Iterator[Tuple[str, dict]]:
+    """
+    与 _join_segments 相同，文本段带有位置信息
+    参数:
+        segments (Iterable[Tuple[str, dict]]): (文本段, 位置)
+        separator (str): 文本段之间的分隔符
+    返回:
+        Iterator[Tuple[str, dict]]: (补齐分隔符后的文本段, 位置)
+    """
+    for idx, (segment, location) in enumerate(segments):
+        yield (segment if idx == 0 else separator + segment), location
+
+# 定义流式提取带位置信息的文本段的函数
+def iter_located_text(file_path: str) -> Iterator[Tuple[str, dict]]:
+    """
+    根据文件类型流式提取文本段及其在原文档中的位置：PDF逐页（{"page": 页码}）、
+    Excel按行块（{"sheet": 工作表名}）、PPT逐张幻灯片（{"slide": 幻灯片序号}），
+    其余格式没有页的概念，位置为空字典。所有文本段直接拼接等于extract_text_auto的结果。
+    参数:
+        file_path (str): 文件路径
+    返回:
+        Iterator[Tuple[str, dict]]: (文本段, 位置)
+    异常:
+        FileNotFoundError: 文件不存在
+        ValueError: 不支持的文件类型
+    """
+    # 检查文件是否存在
+    if not os.path.exists(file_path):
+        logger.error(f"文件不存在：{file_path}")
+        raise FileNotFoundError(f"文件不存在：{file_path}")
+    # 获取文件扩展名并转换为小写
+    ext = os.path.splitext(file_path)[-1].lower()
+    if ext == ".pdf":
+        logger.info(f"检测到PDF文件，开始逐页提取文本: {file_path}")
+        # 页数较多时多进程并行提取，按页码顺序产出，已缓存的页直接读取
+        import pdf_pages
+        pages = ((text, {"page": page}) for page, text in pdf_pages.iter_pdf_pages(file_path))
+        yield from _join_located(pages, "\n")
+    elif ext in [".xlsx", ".xls"]:
+        logger.info(f"检测到Excel文件，开始按行块提取文本: {file_path}")
+        location = {"sheet": extract.get_excel_sheet_name(file_path)}
+        yield from _join_located(((text, location) for text in extract.iter_excel_rows(file_path)), "\n")
+    elif ext in [".pptx", ".ppt"]:
+        logger.info(f"检测到PPT文件，开始逐张幻灯片提取文本: {file_path}")
+        slides = ((text, {"slide": slide}) for slide, text in extract.iter_ppt_slides(file_path))
+        yield from _join_located(slides, "\n")
+    elif ext == ".csv":
+        logger.info(f"检测到CSV文件，开始按行块提取文本: {file_path}")
+        yield from ((text, {}) for text in _join_segments(extract.iter_csv_rows(file_path), "\n"))
+    elif ext in [".md", ".txt", ".jsonl"]:
+        logger.info(f"检测到文本/Markdown/JSONL文件，开始按行块读取: {file_path}")
+        yield from ((text, {}) for text in extract.iter_text_file(file_path))
+    else:
+        # 其余格式的解析库本身需要整体载入文档，直接整体提取
+        yield extract_text_auto(file_path), {}
+
+# 定义自动根据文件类型流式提取文本内容的函数
+def iter_text_auto(file_path: str) -> Iterator[str]:
+    """
+    根据文件类型流式提取文本内容：PDF逐页、Excel/CSV按行块、PPT逐张幻灯片、文本文件按行块；
+    其他格式一次性提取后作为单个文本段产出。所有文本段直接拼接等于extract_text_auto的结果。
+    参数:
+        file_path (str): 文件路径
+    返回:
+        Iterator[str]: 文本段
+    异常:
+        FileNotFoundError: 文件不存在
+        ValueError: 不支持的文件类型
+    """
+    for text, _ in iter_located_text(file_path):
+        yield text
+
+# 定义流式文本分块并记录字符偏移的函数
+def iter_split_text_with_offsets(
+    segments: Iterable[str],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    buffer_chunks: int = DEFAULT_STREAM_BUFFER_CHUNKS,
+    splitter: Union[str, object] = DEFAULT_SPLITTER
+) -> Iterator[Tuple[str, Optional[int]]]:
+    """
+    对流式文本段进行分块：缓冲区累积到一定长度后分割，只产出已确定的分块，
+    最后一个（可能不完整的）分块连同其前面的重叠部分留在缓冲区中与后续文本段拼接，
+    因此分块重叠可以跨越文本段边界，内存占用只与分块大小有关，与文档大小无关。
+    同时记录每个分块在全文（所有文本段直接拼接）中的起始字符偏移。
+    参数:
+        segments (Iterable[str]): 文本段
+        chunk_size (int): 分块大小，默认为 200
+        chunk_overlap (int): 分块重叠长度，默认为 30
+        buffer_chunks (int): 缓冲区达到多少个分块大小后触发分割，默认为 8
+        splitter (str | object): 分块方式，见 get_splitter，默认为 "recursive"
+    返回:
+        Iterator[Tuple[str, Optional[int]]]: (分块文本, 起始字符偏移)，
+            分割器改写了文本（分块不是原文的子串）时偏移为None
+    """
+    spliter = get_splitter(splitter, chunk_size, chunk_overlap)
+    buffer = ""
+    # 缓冲区第一个字符在全文中的偏移，缓冲区内容不再是原文时为None
+    buffer_start: Optional[int] = 0
+
+    def locate(chunks: List[str]) -> Iterator[Tuple[str, Optional[int]]]:
+        # 分块按原文顺序排列，从上一个分块的起点之后查找下一个分块
+        cursor = 0
+        for chunk in chunks:
+            pos = buffer.find(chunk, cursor) if buffer_start is not None else -1
+            if pos >= 0:
+                cursor = pos + 1
+                yield chunk, buffer_start + pos
+            else:
+                yield chunk, None
+
+    for segment in segments:
+        buffer += segment
+        # 缓冲区不够长时继续累积，减少分割次数
+        if len(buffer) < chunk_size * buffer_chunks:
+            continue
+        chunks = spliter.split_text(buffer)
+        if len(chunks) <= 1:
+            continue
+        # 产出除最后一块以外的所有分块
+        yield from locate(chunks[:-1])
+        # 最后一块从其在缓冲区中的起始位置保留下来，与后续文本段继续拼接
+        pos = buffer.rfind(chunks[-1])
+        if pos >= 0:
+            buffer = buffer[pos:]
+            if buffer_start is not None:
+                buffer_start += pos
+        else:
+            buffer = chunks[-1]
+            buffer_start = None
+    # 处理缓冲区中剩余的文本
+    if buffer.strip():
+        yield from locate(spliter.split_text(buffer))
+
+# 定义流式文本分块函数
+def iter_split_text(
+    segments: Iterable[str],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    buffer_chunks: int = DEFAULT_STREAM_BUFFER_CHUNKS,
+    splitter: Union[str, object] = DEFAULT_SPLITTER
+) -> Iterator[str]:
+    """
+    对流式文本段进行分块，见 iter_split_text_with_offsets
+    参数:
+        segments (Iterable[str]): 文本段
+        chunk_size (int): 分块大小，默认为 200
+        chunk_overlap (int): 分块重叠长度，默认为 30
+        buffer_chunks (int): 缓冲区达到多少个分块大小后触发分割，默认为 8
+        splitter (str | object): 分块方式，见 get_splitter，默认为 "recursive"
+    返回:
+        Iterator[str]: 分块文本
+    """
+    for chunk, _ in iter_split_text_with_offsets(segments, chunk_size, chunk_overlap, buffer_chunks, splitter):
+        yield chunk
+
+# 定义流式分块并生成分块元数据的函数
+def iter_chunks_with_metadata(
+    file_path: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    splitter: Union[str, object] = DEFAULT_SPLITTER,
+    located_segments: Optional[Iterable[Tuple[str, dict]]] = None
+) -> Iterator[Tuple[str, dict]]:
+    """
+    流式提取并分块，为每个分块生成元数据：
+    source（文件绝对路径）、format（扩展名）、chunk_index（分块序号）、mtime（文件修改时间，秒）、
+    start_offset/end_offset（在全文中的字符偏移）以及分块起点所在的 page/sheet/slide。
+    取不到的字段不写入（Chroma的元数据不允许None）。
+    参数:
+        file_path (str): 文件路径
+        chunk_size (int): 分块大小，默认为 200
+        chunk_overlap (int): 分块重叠长度，默认为 30
+        splitter (str | object): 分块方式，见 get_splitter，默认为 "recursive"
+        located_segments (Iterable[Tuple[str, dict]], optional): 带位置的文本段，默认为 iter_located_text(file_path)，
+            传入包装后的迭代器可以单独统计提取耗时
+    返回:
+        Iterator[Tuple[str, dict]]: (分块文本, 元数据)
+    异常:
+        FileNotFoundError: 文件不存在
+        ValueError: 不支持的文件类型
+    """
+    if located_segments is None:
+        located_segments = iter_located_text(file_path)
+    base = {
+        "source": os.path.abspath(file_path),
+        "format": os.path.splitext(file_path)[-1].lower().lstrip("."),
+        "mtime": int(os.path.getmtime(file_path)),
+    }
+    # 各文本段在全文中的起始偏移和位置，用于按偏移查找分块所在的页
+    segment_starts: List[int] = []
+    segment_locations: List[dict] = []
+    consumed = 0
+
+    def segments() -> Iterator[str]:
+        nonlocal consumed
+        for text, location in located_segments:
+            segment_starts.append(consumed)
+            segment_locations.append(location)
+            consumed += len(text)
+            yield text
+
+    chunks = iter_split_text_with_offsets(segments(), chunk_size, chunk_overlap, splitter=splitter)
+    for chunk_index, (chunk, start_offset) in enumerate(chunks):
+        metadata = dict(base, chunk_index=chunk_index)
+        if start_offset is not None:
+            metadata["start_offset"] = start_offset
+            metadata["end_offset"] = start_offset + len(chunk)
+            # 跳过分块开头的空白，找到第一个有内容的字符所在的文本段
+            lead = len(chunk) - len(chunk.lstrip())
+            idx = bisect.bisect_right(segment_starts, start_offset + lead) - 1
+            if idx >= 0:
+                metadata.update(segment_locations[idx])
+        yield chunk, metadata
+
 # 定义文档入库的主流程函数
 def doc_to_vectorstore(
     file_path:str,
     collection_name: str = DEFAULT_COLLECTION_NAME,
     chunk_size = DEFAULT_CHUNK_SIZE,
-    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+    encode_batch_size: int = DEFAULT_ENCODE_BATCH_SIZE,
+    write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+    incremental: bool = False,
+    splitter: Union[str, object] = DEFAULT_SPLITTER
 ) -> int:
     """
     将文档提取、分块并保存到向量数据库
@@ -103,6 +398,12 @@ def doc_to_vectorstore(
         collection_name (str): 集合名称，默认为 "rag"
         chunk_size (int): 分块大小，默认为 200
         chunk_overlap (int): 分块重叠长度，默认为 30
+        encode_batch_size (int): 每批编码的分块数量，默认为 64
+        write_batch_size (int): 每批写入数据库的分块数量，默认为 1000
+        incremental (bool): 是否基于入库清单增量入库，默认为 False。
+            开启后未变化的文件直接跳过，变化的文件只为新增分块生成向量，并删除已消失的分块
+        splitter (str | object): 分块方式，"recursive" 递归字符分割，"semantic" 语义分块，"cdc" 内容定义分块，
+            或任何带有 split_text 方法的分割器，默认为 "recursive"
     返回:
         int: 成功保存的分块数量
     异常:
@@ -110,34 +411,143 @@ def doc_to_vectorstore(
         ValueError: 不支持的文件类型或其他参数错误
     """
     try:
-        # 步骤1：加载非结构化文本
-        logger.info(f"开始提取文件内容：{file_path}")
-        text = extract_text_auto(file_path)
-        logger.info(f"文件内容提取完成，长度为{len(text)}个字符")
-        # 检查是否为空
-        if not text.strip():
-            logger.warning(f"文件内容为空：{file_path}")
-            return 0
+        manifest = get_manifest() if incremental else None
+        # 上次入库时该文件产生的分块ID
+        known_ids = set()
+        if manifest is not None:
+            stat = os.stat(file_path)
+            entry = manifest.get(collection_name, file_path)
+            # 大小和修改时间都没变，直接跳过
+            if manifest.is_unchanged(collection_name, file_path, stat):
+                logger.info(f"文件未变化，跳过入库：{file_path}")
+                return len(entry["chunk_ids"])
+            content_hash = compute_file_hash(file_path)
+            if entry:
+                # 只是修改时间变了，内容没变，更新清单后跳过
+                if entry.get("content_hash") == content_hash:
+                    logger.info(f"文件内容未变化，跳过入库：{file_path}")
+                    manifest.update(collection_name, file_path, stat.st_size, stat.st_mtime, content_hash, entry["chunk_ids"])
+                    manifest.save()
+                    return len(entry["chunk_ids"])
+                known_ids = set(entry["chunk_ids"])
 
-        # 步骤2：将文本进行分块
-        logger.info(f"开始进行文本分块 (chunk_size={chunk_size}, chunk_overlap={chunk_overlap})")
-        spliter = RecursiveCharacterTextSplitter(
-            chunk_size= chunk_size,
-            chunk_overlap=chunk_overlap
+        # 开启近似去重时加载SimHash索引（本进程的写入已增量应用，只在冷启动或有其他进程写入时全量比对）
+        near_dup = None
+        # 近似去重时不参与比较的分块：本文件上一版本独占的分块，稍后可能被删除
+        near_dup_exclude = set()
+        if NEAR_DUP_ENABLED:
+            import simhash_index
+            near_dup = simhash_index.get_simhash_index(collection_name, _get_collection(collection_name))
+            if manifest is not None and known_ids:
+                near_dup_exclude = known_ids - manifest.referenced_ids(collection_name, exclude=file_path)
+        # 与已入库内容近似重复而跳过的分块数量
+        near_dup_count = 0
+
+        # 步骤1+2：流式提取文本并分块，内存占用与分块大小相关而与文档大小无关
+        start = time.perf_counter()
+        logger.info(f"开始流式提取并分块 (chunk_size={chunk_size}, chunk_overlap={chunk_overlap})：{file_path}")
+        # 提取和分块在同一条流式管道中交替执行，分别累计两段迭代器的耗时（关闭指标时不包装）
+        segments = metrics.timed_iter(iter_located_text(file_path))
+        chunks = metrics.timed_iter(
+            iter_chunks_with_metadata(file_path, chunk_size, chunk_overlap, splitter, located_segments=segments)
         )
-        chunks = spliter.split_text(text)
-        logger.info(f"文本分块完成，共分为{len(chunks)}块")
-        # 步骤3：为每个分块生成向量并保存入库
+        # 步骤3：按写入批次为分块生成向量并保存入库
+        total_count = 0
         success_count = 0
-        for idx , chunk in enumerate(chunks):
-            try:
-                logger.info(f"正在保存第{idx + 1}/{len(chunks)}块到向量数据库")
-                save_text_to_db(chunk, collection_name = collection_name)
-                success_count += 1
-            except Exception as e:
-                logger.error(f"保存第{idx + 1}块失败: {str(e)}")
-                # 继续处理下一块，不中断整个流程
-        logger.info(f"文件 {file_path} 已完成入库，成功保存 {success_count}/{len(chunks)} 个分块")
+        failed = []
+        # 本次成功入库的分块ID（按分块顺序）
+        saved_ids = []
+        batch = []
+
+        def flush():
+            nonlocal success_count, near_dup_count
+            logger.info(f"正在批量保存第{total_count - len(batch) + 1}~{total_count}块到向量数据库")
+            # 上次入库已存在的分块无需重新生成向量
+            batch_ids = [_compute_text_id(chunk) for chunk, _ in batch]
+            new_positions = [idx for idx, chunk_id in enumerate(batch_ids) if chunk_id not in known_ids]
+            chunk_ids = list(batch_ids)
+            skipped = {}
+            if near_dup is not None and new_positions:
+                # 与已入库内容近似重复的分块不生成向量也不写入
+                skipped = near_dup.filter_new(
+                    [batch_ids[idx] for idx in new_positions], [batch[idx][0] for idx in new_positions], near_dup_exclude
+                )
+                near_dup_count += sum(1 for idx in new_positions if batch_ids[idx] in skipped)
+                new_positions = [idx for idx in new_positions if batch_ids[idx] not in skipped]
+            if new_positions:
+                new_ids = save_texts_to_db(
+                    [batch[idx][0] for idx in new_positions],
+                    collection_name=collection_name,
+                    encode_batch_size=encode_batch_size,
+                    write_batch_size=write_batch_size,
+                    metadatas=[batch[idx][1] for idx in new_positions]
+                )
+                for idx, chunk_id in zip(new_positions, new_ids):
+                    chunk_ids[idx] = chunk_id
+            # 已存在的分块位置可能变了（例如前面插入了内容），只刷新元数据
+            known_positions = {}
+            for chunk_id, (_, metadata) in zip(batch_ids, batch):
+                if chunk_id in known_ids:
+                    known_positions.setdefault(chunk_id, metadata)
+            if known_positions:
+                update_metadatas_in_db(
+                    list(known_positions), list(known_positions.values()), collection_name, write_batch_size
+                )
+            # 统计成功保存的分块数量，失败的分块对应None，跳过的近似重复分块不计入；
+            # 清单中记录与之近似重复的保留分块，保留分块所在的文件修改或删除后，该分块仍被本文件引用而不会被删除
+            for offset, chunk_id in enumerate(chunk_ids):
+                if chunk_id in skipped:
+                    saved_ids.append(skipped[chunk_id])
+                    continue
+                if chunk_id is None:
+                    failed.append(total_count - len(batch) + offset + 1)
+                else:
+                    success_count += 1
+                    saved_ids.append(chunk_id)
+            batch.clear()
+
+        for chunk, metadata in chunks:
+            batch.append((chunk, metadata))
+            total_count += 1
+            if len(batch) >= write_batch_size:
+                flush()
+        if batch:
+            flush()
+        if isinstance(chunks, metrics.TimedIterator):
+            # 分块迭代器的耗时包含其内部提取迭代器的耗时，相减得到分块本身的耗时
+            metrics.observe(metrics.INGEST_STAGE_SECONDS, segments.seconds, stage="extract")
+            metrics.observe(metrics.INGEST_STAGE_SECONDS, chunks.seconds - segments.seconds, stage="split")
+
+        if manifest is not None:
+            # 删除上次入库有、本次已消失且未被其他文件引用的分块
+            removed = known_ids - set(saved_ids) - manifest.referenced_ids(collection_name, exclude=file_path)
+            if removed:
+                logger.info(f"删除文件中已消失的{len(removed)}个分块：{file_path}")
+                delete_texts_from_db(list(removed), collection_name, write_batch_size)
+            # 入库不完整时不记录内容哈希，下次重新处理
+            manifest.update(
+                collection_name,
+                file_path,
+                stat.st_size,
+                stat.st_mtime,
+                None if failed else content_hash,
+                saved_ids
+            )
+            manifest.save()
+        # 检查是否为空
+        if total_count == 0:
+            logger.warning(f"文件内容为空：{file_path}")
+            return 0
+        if failed:
+            # 部分分块保存失败时记录失败的分块序号，不中断整个流程
+            logger.error(f"共有{len(failed)}个分块保存失败，分块序号：{failed[:20]}{'...' if len(failed) > 20 else ''}")
+        metrics.observe(metrics.INGEST_FILE_SECONDS, time.perf_counter() - start)
+        metrics.inc(metrics.INGEST_CHUNKS_TOTAL, success_count, status="saved")
+        metrics.inc(metrics.INGEST_CHUNKS_TOTAL, len(failed), status="failed")
+        if near_dup is not None:
+            metrics.inc(metrics.INGEST_CHUNKS_TOTAL, near_dup_count, status="near_duplicate")
+            logger.info(f"跳过{near_dup_count}个与已入库内容近似重复的分块：{file_path}")
+        logger.info(f"文件 {file_path} 已完成入库，成功保存 {success_count}/{total_count} 个分块")
         return success_count
     except FileNotFoundError:
         logger.error(f"文件不存在：{file_path}")
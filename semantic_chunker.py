@@ -1,95 +1,158 @@
-from sentence_transformers import SentenceTransformer
 # 导入numpy 用于数值计算
 import numpy as np
 
 # 导入正则表达式
 import re
+# 导入类型注解
+from typing import List, Optional
+# 导入logging模块，用于日志记录
+import logging
 
-from torch.nn.functional import embedding
+# 导入数据库模块，使用其中的默认模型名称
+import db
+# 导入进程内共享的模型注册表，与入库和查询流程共用同一个模型实例
+import registry
+# 导入嵌入缓存模块
+import embed_cache
+
+logger = logging.getLogger(__name__)
+
+# 默认每个窗口包含的句子数
+DEFAULT_WINDOW_SIZE = 2
+# 默认相邻窗口的相似度阈值
+DEFAULT_THRESHOLD = 0.85
+# 默认每批编码的窗口数量，超长文档分批编码以限制显存/内存占用
+DEFAULT_ENCODE_BATCH_SIZE = 256
+
+# 按中英文标点和换行分割句子，使用捕获分组使分隔符保留在结果中
+_SENTENCE_PATTERN = re.compile(r"(。|！|？|\!|\?|\.|\n)")
 
-# 加载预训练的句子嵌入模型
-print("正在加载句子嵌入模型")
-model = SentenceTransformer("all-MiniLM-L6-v2")
-print("模型加载完成")
 
 class SemanticChunker:
-    def __init__(self, window_size = 2, threshold = 0.85):
+    def __init__(
+        self,
+        window_size: int = DEFAULT_WINDOW_SIZE,
+        threshold: float = DEFAULT_THRESHOLD,
+        encode_batch_size: int = DEFAULT_ENCODE_BATCH_SIZE,
+        model=None,
+        model_name: str = db.DEFAULT_MODEL_NAME,
+        backend: Optional[str] = None
+    ):
         # 设置每个窗口包含的的句子数
         self.window_size = window_size
         # 设置相邻窗口的相似度阈值
         self.threshold = threshold
+        # 设置每批编码的窗口数量
+        self.encode_batch_size = encode_batch_size
+        # 嵌入模型，为None时在第一次分块时从注册表获取共享的模型
+        self._model = model
+        # 模型名称
+        self.model_name = model_name
+        # 推理后端，为None时使用环境变量 RAG_EMBED_BACKEND 的配置
+        self.backend = backend
         # 日志：输出初始化参数
-        print(f"SemanticChunker初始化，窗口大小：{window_size},相似阈值：{threshold}")
-
-    def create_documents(self,text):
-        # 使用正则表达式按中英文标点和换行分割句子
-        # 当正则表达式中使用捕获分组时，分隔符会包含在分组中
-        print("正在分割原始文本句子...")
-        sentences = re.split(r"(。|！|？|\!|\?|\.|\n)",text)
-        print(f"sentences:{sentences}")
-        # 初始化句子列表
-        sents = []
+        logger.debug(f"SemanticChunker初始化，窗口大小：{window_size},相似阈值：{threshold}")
+
+    def _get_model(self):
+        # 延迟加载模型，导入本模块时不产生任何开销
+        if self._model is None:
+            self._model = registry.get_model(self.model_name, self.backend)
+        return self._model
+
+    @staticmethod
+    def split_sentences(text: str) -> List[str]:
+        """
+        按中英文标点和换行分割句子，标点保留在句子末尾
+        参数:
+            text (str): 原始文本
+        返回:
+            List[str]: 句子列表
+        """
+        pieces = _SENTENCE_PATTERN.split(text)
+        # 分割结果为 [句子, 标点, 句子, 标点, ..., 末尾文本]，补齐末尾没有标点的文本
+        if len(pieces) % 2 == 1:
+            pieces.append("")
         # 遍历分割后的句子和标点，合并为完整句子
-        for i in range(0, len(sentences) - 1, 2):
-            s = sentences[i].strip() + sentences[i+1].strip()
+        sents = []
+        for i in range(0, len(pieces) - 1, 2):
+            s = pieces[i].strip() + pieces[i + 1].strip()
             if s.strip():
                 sents.append(s)
-        print(f"分割得到{len(sents)}个句子")
-        print(sents)
-        # 初始化分块列表
-        docs = []
-        # 设置起始索引
-        start = 0
+        return sents
+
+    def _encode(self, docs: List[str]) -> np.ndarray:
+        # 分批编码并写入同一个矩阵，超长文档也只占用一份向量内存
+        model = self._get_model()
+        # 缓存按模型名称和推理后端区分
+        namespace = registry.cache_namespace(self.model_name, self.backend)
+        embeddings = None
+        for start in range(0, len(docs), self.encode_batch_size):
+            part = embed_cache.encode_with_cache(
+                model, namespace, docs[start:start + self.encode_batch_size], batch_size=self.encode_batch_size
+            )
+            if embeddings is None:
+                embeddings = np.empty((len(docs), part.shape[1]), dtype=np.float32)
+            embeddings[start:start + len(part)] = part
+        return embeddings
+
+    def adjacent_similarities(self, docs: List[str]) -> np.ndarray:
+        """
+        计算相邻窗口之间的余弦相似度
+        参数:
+            docs (List[str]): 窗口文本列表
+        返回:
+            np.ndarray: 长度为 len(docs) - 1 的相似度数组，第i项为窗口i与窗口i+1的相似度
+        """
+        if len(docs) < 2:
+            return np.zeros(0, dtype=np.float32)
+        embeddings = self._encode(docs)
+        # 先整体归一化，相邻相似度即为相邻行的逐行点积，一次向量化运算完成
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.maximum(norms, 1e-12)
+        return np.einsum("ij,ij->i", embeddings[:-1], embeddings[1:])
+
+    def create_documents(self, text: str) -> List[str]:
+        """
+        语义分块：句子按滑动窗口分组后编码，相邻窗口相似度低于阈值处切分
+        参数:
+            text (str): 原始文本
+        返回:
+            List[str]: 分块后的文本列表
+        """
+        sents = self.split_sentences(text)
         # 使用滑动窗口将句子分组
         # 窗口用于聚合上下文，窗口合并多个句子，嵌入能表达更完整的语义，让语义比较更稳定
-        print("正在使用滑动窗口进行初步分块...")
-        while start < len(sents):
-            # 计算窗口的结束位置
-            end = min(start + self.window_size, len(sents))
-            # 获取当前窗口的句子
-            window = sents[start:end]
-            # 合并窗口内句子为一个块
-            docs.append("".join(window))
-            # 移动到下一个窗口
-            start = end
-        print(f"初步分块完成，共{len(docs)}个块, {docs}")
-        print("正在计算每个块的嵌入向量...")
-        embeddings = model.encode(docs)
-        # 初始化分割点列表，起始点为0
-        split_points = [0]
-        # 遍历相邻窗口计算相似度
-        print('正在计算相邻块之间的相似度...')
-        for i in range(1, len(docs)):
-            sim = np.dot(embeddings[i - 1], embeddings[i]) / (
-                np.linalg.norm(embeddings[i - 1]) * np.linalg.norm(embeddings[i])
-            )
-            print(f"块{i}与块{i-1}的相似度为：{sim:.4f}")
-            if sim < self.threshold:
-                print(f"相似度低于阈值({self.threshold}), 在位置{i}添加分割点。")
-                split_points.append(i)
-        # 初始化最终分块结果列表
+        docs = ["".join(sents[start:start + self.window_size]) for start in range(0, len(sents), self.window_size)]
+        if not docs:
+            return []
+        sims = self.adjacent_similarities(docs)
+        # 相似度低于阈值的位置即为分割点
+        split_points = [0] + (np.flatnonzero(sims < self.threshold) + 1).tolist() + [len(docs)]
+        # 合并相邻分割点之间的窗口为一个块
         result = []
-        # 遍历所有分割点，生成最终文本块
-        for i in range(len(split_points)):
-            # 当前块的起始索引
-            start = split_points[i]
-            # 当前块的结束索引
-            end = split_points[i + 1] if i + 1 < len(split_points) else len(docs)
-            # 合并该范围内的窗口为一个块
-            chunk = ''.join(docs[start:end])
+        for start, end in zip(split_points[:-1], split_points[1:]):
+            chunk = "".join(docs[start:end])
             if chunk.strip():
-                print(f"生成第 {len(result) + 1}个块，内容长度：{len(chunk)}")
                 result.append(chunk)
-        # 返回所有分块
-        print(f"最终分块完成，共{len(result)}个块")
+        logger.debug(f"语义分块完成：{len(sents)}个句子，{len(docs)}个窗口，共{len(result)}个块")
         return result
 
-# 创建语义分块器对象，设置窗口大小和相似度阈值
-print("正在创建语义分块器对象...")
-semantic_splitter = SemanticChunker(window_size=2, threshold=0.85)
-# 准备需要分割的长文本
-print("准备待分割的长文本...")
-long_text = """今天天气晴朗，适合去公园散步。
+    def split_text(self, text: str) -> List[str]:
+        """
+        与 RecursiveCharacterTextSplitter.split_text 相同的接口，便于在入库流程中替换
+        参数:
+            text (str): 原始文本
+        返回:
+            List[str]: 分块后的文本列表
+        """
+        return self.create_documents(text)
+
+
+if __name__ == "__main__":
+    # 创建语义分块器对象，设置窗口大小和相似度阈值
+    semantic_splitter = SemanticChunker(window_size=2, threshold=0.85)
+    # 准备需要分割的长文本
+    long_text = """今天天气晴朗，适合去公园散步。
 
 量子力学中的叠加态是描述粒子同时处于多个状态的数学工具。
 
@@ -99,13 +162,12 @@ Windows命令行中复制文件可以使用copy命令。
 
 欧拉公式被誉为“最美的数学公式”。"""
 
-# 执行文本分割，得到分块结果
-print("开始执行文本分割...")
-documents = semantic_splitter.create_documents(long_text)
-# 打印分割结果，显示每个块的内容
-print(f"总共分割为 {len(documents)} 个块:\n")
-for i, doc in enumerate(documents, 1):
-    # 打印当前块的编号
-    print(f"=== 第 {i} 个块 ===")
-    # 打印当前块的内容
-    print(doc)
\ No newline at end of file
+    # 执行文本分割，得到分块结果
+    documents = semantic_splitter.create_documents(long_text)
+    # 打印分割结果，显示每个块的内容
+    print(f"总共分割为 {len(documents)} 个块:\n")
+    for i, doc in enumerate(documents, 1):
+        # 打印当前块的编号
+        print(f"=== 第 {i} 个块 ===")
+        # 打印当前块的内容
+        print(doc)
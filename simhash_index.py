@@ -0,0 +1,335 @@
+# 导入os模块，用于路径和环境变量
+import os
+# 导入re模块，用于规范化空白字符
+import re
+# 导入pickle模块，用于持久化索引
+import pickle
+# 导入hashlib模块，用于计算特征哈希
+import hashlib
+# 导入threading模块，保证索引读写的线程安全
+import threading
+# 导入atexit模块，进程退出时保存增量更新过的索引
+import atexit
+# 导入类型注解
+from typing import Dict, List, Optional, Set
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于批量计算指纹的各个比特位
+import numpy as np
+
+# 导入数据库相关的函数和默认配置
+import db
+
+logger = logging.getLogger(__name__)
+
+# 是否在入库时跳过与已入库分块近似重复的分块，设置环境变量 RAG_NEAR_DUP=1 开启
+NEAR_DUP_ENABLED = os.getenv("RAG_NEAR_DUP", "0") == "1"
+# 判定为近似重复的SimHash汉明距离上限（64位指纹）：150字左右的分块改动一个字时距离多在5以内，
+# 不相关的分块距离通常在12以上
+DEFAULT_MAX_DISTANCE = int(os.getenv("RAG_NEAR_DUP_DISTANCE", "5"))
+# 短于该长度（字符数）的分块特征太少，指纹不可靠，不参与近似去重
+DEFAULT_MIN_LENGTH = 32
+# 默认的SimHash索引目录，与ChromaDB数据目录放在一起
+DEFAULT_SIMHASH_DIR = f"{db.DEFAULT_DB_PATH}_simhash"
+# 特征使用的字符shingle长度
+_SHINGLE_SIZE = 3
+# 从集合同步文档时每批读取的数量
+_SYNC_BATCH_SIZE = 1000
+# 指纹每一位的移位量
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+# 全局索引实例：集合名称 -> SimHashIndex
+_indexes: Dict[str, "SimHashIndex"] = {}
+# 创建索引实例时使用的锁
+_indexes_lock = threading.Lock()
+
+
+def simhash(text: str) -> int:
+    """
+    计算文本的64位SimHash指纹：特征为规范化文本（小写、合并空白）的字符3-gram，按出现次数加权
+    参数:
+        text (str): 文本
+    返回:
+        int: 64位指纹
+    """
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    counts: Dict[str, int] = {}
+    for i in range(max(1, len(text) - _SHINGLE_SIZE + 1)):
+        shingle = text[i:i + _SHINGLE_SIZE]
+        counts[shingle] = counts.get(shingle, 0) + 1
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in counts)
+    values = np.frombuffer(digests, dtype="<u8")
+    # 每个特征的每一位为1时加上权重、为0时减去权重，结果为正的位在指纹中置1
+    bits = ((values[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.int64)
+    weights = np.fromiter(counts.values(), dtype=np.int64, count=len(counts)) @ (2 * bits - 1)
+    return int(((weights > 0).astype(np.uint64) << _BIT_SHIFTS).sum())
+
+
+def _fingerprint(text: Optional[str]) -> Optional[int]:
+    # 过短的文本块不计算指纹
+    if not text or len(text.strip()) < DEFAULT_MIN_LENGTH:
+        return None
+    return simhash(text)
+
+
+class SimHashIndex:
+    """
+    可增量更新、可持久化的SimHash近似重复索引：保存集合中每个文本块的64位指纹，
+    指纹按分段建立倒排表，查询只比较至少有一段相同的候选，汉明距离不超过 max_distance 即为近似重复。
+    分段数为 max_distance+1：距离不超过 max_distance 的两个指纹至少有一段完全相同，因此不会漏掉近似重复；
+    max_distance 越大每段越短，候选越多，查询越慢
+    """
+
+    def __init__(self, path: str, max_distance: int = DEFAULT_MAX_DISTANCE):
+        # 索引文件路径
+        self.path = path
+        self.max_distance = max_distance
+        # 指纹分段数和每段的位数
+        self._n_bands = max_distance + 1
+        self._band_bits = 64 // self._n_bands
+        self._lock = threading.RLock()
+        # 文本ID -> 指纹，过短的文本块没有指纹（为None），记录下来避免每次同步都重新读取
+        self.fingerprints: Dict[str, Optional[int]] = {}
+        # 每一段的倒排表：段值 -> 文本ID集合
+        self._tables: List[Dict[int, Set[str]]] = [{} for _ in range(self._n_bands)]
+        # 索引已包含的集合版本号，None表示还没有与集合全量比对过
+        self.synced_version: Optional[int] = None
+        # 增量更新后尚未保存到磁盘
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def _bands(self, fingerprint: int) -> List[int]:
+        mask = (1 << self._band_bits) - 1
+        return [fingerprint >> (band * self._band_bits) & mask for band in range(self._n_bands)]
+
+    def _insert(self, doc_id: str, fingerprint: Optional[int]):
+        self.fingerprints[doc_id] = fingerprint
+        if fingerprint is None:
+            return
+        for table, value in zip(self._tables, self._bands(fingerprint)):
+            table.setdefault(value, set()).add(doc_id)
+
+    def add(self, ids: List[str], documents: List[str]):
+        """
+        向索引中添加文本块，过短的文本块不建立指纹
+        参数:
+            ids (List[str]): 文本ID列表
+            documents (List[str]): 文本内容列表
+        """
+        with self._lock:
+            self.remove([doc_id for doc_id in ids if doc_id in self.fingerprints])
+            for doc_id, document in zip(ids, documents):
+                self._insert(doc_id, _fingerprint(document))
+
+    def remove(self, ids: List[str]):
+        """
+        从索引中删除文本块
+        参数:
+            ids (List[str]): 文本ID列表
+        """
+        with self._lock:
+            for doc_id in ids:
+                fingerprint = self.fingerprints.pop(doc_id, None)
+                if fingerprint is None:
+                    continue
+                for table, value in zip(self._tables, self._bands(fingerprint)):
+                    members = table.get(value)
+                    if members is not None:
+                        members.discard(doc_id)
+                        if not members:
+                            del table[value]
+
+    def find(self, text: str, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """
+        查找与文本近似重复的已入库文本块
+        参数:
+            text (str): 文本
+            exclude (Set[str], optional): 不参与比较的文本ID（例如同一文件上一版本的分块，稍后会被删除）
+        返回:
+            Optional[str]: 近似重复的文本ID，没有时为None
+        """
+        fingerprint = _fingerprint(text)
+        if fingerprint is None:
+            return None
+        with self._lock:
+            for table, value in zip(self._tables, self._bands(fingerprint)):
+                for doc_id in table.get(value, ()):
+                    if exclude and doc_id in exclude:
+                        continue
+                    if bin(self.fingerprints[doc_id] ^ fingerprint).count("1") <= self.max_distance:
+                        return doc_id
+        return None
+
+    def filter_new(
+        self,
+        ids: List[str],
+        texts: List[str],
+        exclude: Optional[Set[str]] = None
+    ) -> Dict[str, str]:
+        """
+        入库前的近似去重：依次检查每个新文本块，与已入库或本批前面保留的文本块近似重复的跳过，
+        保留的文本块立即加入索引（本批后面的近似重复也会被跳过）。ID已在索引中的文本块是完全相同的内容，不算近似重复
+        参数:
+            ids (List[str]): 文本ID列表
+            texts (List[str]): 与ids一一对应的文本内容
+            exclude (Set[str], optional): 不参与比较的文本ID
+        返回:
+            Dict[str, str]: 被跳过的文本ID -> 与之近似重复的文本ID
+        """
+        skipped: Dict[str, str] = {}
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                if doc_id in self.fingerprints or doc_id in skipped:
+                    continue
+                duplicate = self.find(text, exclude)
+                if duplicate is not None:
+                    skipped[doc_id] = duplicate
+                else:
+                    self._insert(doc_id, _fingerprint(text))
+        if skipped:
+            logger.info(f"近似去重：跳过{len(skipped)}个与已入库内容近似重复的分块")
+        return skipped
+
+    def apply_change(self, version: int, added_ids: List[str], added_documents: List[str], removed_ids: List[str]) -> bool:
+        """
+        应用本进程对集合的一次写入或删除（由 db 的集合变化监听调用），不读取集合。
+        索引不是紧接在这次变化之前的版本时不做处理，留给下次 sync 全量比对
+        参数:
+            version (int): 这次变化之后的集合版本号
+            added_ids (List[str]): 新增的文本ID
+            added_documents (List[str]): 与added_ids一一对应的文本内容
+            removed_ids (List[str]): 删除的文本ID
+        返回:
+            bool: 是否已应用
+        """
+        with self._lock:
+            if self.synced_version is None or self.synced_version != version - 1:
+                return False
+            self.remove(removed_ids)
+            # filter_new 保留的分块已经加入索引，写入后不必重新计算指纹
+            new = [(doc_id, document) for doc_id, document in zip(added_ids, added_documents) if doc_id not in self.fingerprints]
+            for doc_id, document in new:
+                self._insert(doc_id, _fingerprint(document))
+            self.synced_version = version
+            self._dirty = True
+            return True
+
+    def sync(self, collection, collection_name: str, force: bool = False) -> bool:
+        """
+        与ChromaDB集合同步：本进程的写入和删除已由 apply_change 增量应用，集合版本号与索引一致且文档数量相同时直接返回；
+        冷启动、有未能增量应用的写入（例如其他进程的写入）或 force=True 时全量比对ID，
+        只为新增文档计算指纹，并删除集合中已不存在的文档（包括入库失败而未写入的分块）
+        参数:
+            collection: ChromaDB集合实例
+            collection_name (str): 集合名称
+            force (bool): 是否强制比对全部ID，默认为 False
+        返回:
+            bool: 索引是否发生了变化
+        """
+        with self._lock:
+            version = db.get_collection_version(collection_name)
+            if not force and version == self.synced_version and collection.count() == len(self):
+                return False
+            all_ids = []
+            offset = 0
+            while True:
+                page = collection.get(include=[], limit=_SYNC_BATCH_SIZE, offset=offset)
+                ids = page.get("ids") or []
+                all_ids.extend(ids)
+                if len(ids) < _SYNC_BATCH_SIZE:
+                    break
+                offset += _SYNC_BATCH_SIZE
+            current = set(all_ids)
+            removed = [doc_id for doc_id in self.fingerprints if doc_id not in current]
+            added = [doc_id for doc_id in all_ids if doc_id not in self.fingerprints]
+            self.remove(removed)
+            for start in range(0, len(added), _SYNC_BATCH_SIZE):
+                page = collection.get(ids=added[start:start + _SYNC_BATCH_SIZE], include=["documents"])
+                self.add(page["ids"], page["documents"])
+            self.synced_version = version
+            changed = bool(removed or added)
+            if changed:
+                logger.info(f"SimHash索引已同步：新增{len(added)}个文档，删除{len(removed)}个文档，共{len(self)}个文档")
+                self.save()
+            return changed
+
+    def save(self):
+        """
+        将索引原子地写入磁盘
+        """
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"fingerprints": self.fingerprints}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def save_if_dirty(self):
+        """
+        增量更新过的索引写回磁盘（每次写入都保存整个索引的代价与集合大小成正比，因此推迟到入库结束或进程退出时）
+        """
+        with self._lock:
+            if self._dirty:
+                self.save()
+
+    @classmethod
+    def load(cls, path: str) -> "SimHashIndex":
+        """
+        从磁盘加载索引，文件不存在时返回空索引
+        参数:
+            path (str): 索引文件路径
+        返回:
+            SimHashIndex: 索引实例
+        """
+        index = cls(path)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            for doc_id, fingerprint in data["fingerprints"].items():
+                index._insert(doc_id, fingerprint)
+            logger.info(f"已加载SimHash索引：{path}，共{len(index)}个指纹")
+        return index
+
+
+def get_simhash_index(collection_name: str, collection) -> SimHashIndex:
+    """
+    获取指定集合的SimHash索引（延迟加载，单例模式），并与集合做增量同步
+    参数:
+        collection_name (str): 集合名称
+        collection: ChromaDB集合实例
+    返回:
+        SimHashIndex: 索引实例
+    """
+    with _indexes_lock:
+        index = _indexes.get(collection_name)
+        if index is None:
+            index = SimHashIndex.load(os.path.join(DEFAULT_SIMHASH_DIR, f"{collection_name}.pkl"))
+            _indexes[collection_name] = index
+    index.sync(collection, collection_name)
+    return index
+
+
+def _on_collection_change(
+    collection_name: str,
+    version: int,
+    added_ids: List[str],
+    added_documents: List[str],
+    removed_ids: List[str]
+):
+    # 只更新本进程已加载的索引，未加载的索引在第一次使用时全量比对
+    index = _indexes.get(collection_name)
+    if index is not None:
+        index.apply_change(version, added_ids, added_documents, removed_ids)
+
+
+def _save_all():
+    for index in list(_indexes.values()):
+        index.save_if_dirty()
+
+
+db.add_change_listener(_on_collection_change)
+atexit.register(_save_all)
@@ -0,0 +1,92 @@
+# 导入os模块，用于定位项目目录
+import os
+# 导入sys模块，用于获取当前解释器
+import sys
+# 导入subprocess模块，在干净的子进程中测量导入耗时
+import subprocess
+# 导入unittest模块，python -m unittest 或 pytest 都可以直接运行
+import unittest
+# 导入类型注解
+from typing import Dict, Set, Tuple
+
+# 每个入口模块的导入耗时预算（毫秒，取 python -X importtime 的累计耗时）
+IMPORT_TIME_BUDGET_MS: Dict[str, float] = {
+    "query": 500,
+    "save": 300,
+    "ingest": 300,
+    "db": 200,
+    "llm": 300,
+    "extract": 100,
+    "semantic_chunker": 300,
+    "rerank": 200,
+}
+# 导入入口模块时不允许被加载的重量级依赖（应在第一次使用时才导入）
+FORBIDDEN_MODULES = (
+    "sentence_transformers",
+    "torch",
+    "chromadb",
+    "openai",
+    "langchain_text_splitters",
+    "fitz",
+    "docx",
+    "openpyxl",
+    "pptx",
+    "bs4",
+    "lxml",
+    "sympy",
+    "huggingface_hub",
+)
+
+# 项目根目录
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import(module: str) -> Tuple[float, Set[str]]:
+    """
+    在新的子进程中导入模块，解析 -X importtime 的输出
+    参数:
+        module (str): 模块名称
+    返回:
+        Tuple[float, Set[str]]: (该模块的累计导入耗时（毫秒）, 导入过程中加载的所有模块名称)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=_ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    cumulative_us = 0
+    loaded = set()
+    for line in result.stderr.splitlines():
+        # 格式：import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue
+        loaded.add(name.strip())
+        # 顶层（没有缩进）的入口模块记录的是整个导入的累计耗时
+        if name.rstrip() == f" {module}":
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000.0, loaded
+
+
+class ImportTimeTest(unittest.TestCase):
+    """
+    入口模块的导入耗时不超过预算，且导入时不加载重量级依赖
+    """
+
+    def test_import_budgets(self):
+        for module, budget_ms in IMPORT_TIME_BUDGET_MS.items():
+            with self.subTest(module=module):
+                elapsed_ms, loaded = measure_import(module)
+                heavy = sorted(name for name in loaded if name.split(".")[0] in FORBIDDEN_MODULES)
+                self.assertLessEqual(
+                    elapsed_ms, budget_ms, f"import {module} 耗时 {elapsed_ms:.1f}ms，超出预算 {budget_ms:.0f}ms"
+                )
+                self.assertEqual(heavy, [], f"import {module} 加载了重量级依赖：{', '.join(heavy[:10])}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,553 @@
+# 导入os模块，用于路径和文件操作
+import os
+# 导入glob模块，用于清理旧的向量文件
+import glob
+# 导入json模块，用于序列化元数据
+import json
+# 导入sqlite3模块，用于保存ID/文档/元数据
+import sqlite3
+# 导入argparse模块，用于命令行复制集合
+import argparse
+# 导入threading模块，保证读写的线程安全
+import threading
+# 导入类型注解
+from typing import Callable, Dict, List, Optional, Sequence
+# 导入logging模块，用于日志记录
+import logging
+
+# 导入numpy，用于内存映射的向量矩阵和矩阵乘法检索
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 本地引擎向量的存储精度：float32 或 float16（float16 占用一半内存和磁盘，打分时分块转换为float32）
+DEFAULT_LOCAL_DTYPE = os.getenv("RAG_LOCAL_STORE_DTYPE", "float32")
+# 本地引擎向量文件的初始容量（行数），写满后按倍数扩容
+DEFAULT_INITIAL_CAPACITY = 1024
+# float16 存储时每次转换为float32参与打分的行数，限制临时内存
+_SCORE_BLOCK_ROWS = 65536
+# get/query 默认返回的字段（与ChromaDB一致）
+_DEFAULT_GET_INCLUDE = ("metadatas", "documents")
+_DEFAULT_QUERY_INCLUDE = ("metadatas", "documents", "distances")
+
+
+def _match(metadata: Optional[dict], where: dict) -> bool:
+    """
+    判断元数据是否满足过滤条件，支持ChromaDB where语法的常用子集：
+    字段等值、$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin 以及 $and/$or
+    参数:
+        metadata (dict): 元数据
+        where (dict): 过滤条件
+    返回:
+        bool: 是否满足
+    异常:
+        ValueError: 不支持的运算符
+    """
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_match(metadata, item) for item in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_match(metadata, item) for item in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                ok = value == operand
+            elif operator == "$ne":
+                ok = value != operand
+            elif operator == "$in":
+                ok = value in operand
+            elif operator == "$nin":
+                ok = value not in operand
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                # 字段不存在或类型不可比较时视为不满足
+                try:
+                    ok = value is not None and {
+                        "$gt": value > operand,
+                        "$gte": value >= operand,
+                        "$lt": value < operand,
+                        "$lte": value <= operand,
+                    }[operator]
+                except TypeError:
+                    ok = False
+            else:
+                raise ValueError(f"不支持的过滤运算符：{operator}")
+            if not ok:
+                return False
+    return True
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    # 归一化为单位向量，内积即为余弦相似度
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class LocalVectorStore:
+    """
+    进程内的本地向量引擎，接口与ChromaDB集合（add/upsert/update/delete/get/query/count）兼容。
+    归一化后的向量存放在内存映射的 .npy 矩阵中（float32/float16），ID、文档和元数据存放在SQLite中，
+    打开时整体读入内存；检索时用一次矩阵乘法计算所有向量的得分，再用argpartition取top-k（精确检索），
+    多个查询向量在同一次矩阵乘法中完成。适合读多写少、语料固定的服务场景。
+    删除的行留作空位，后续写入时复用，不需要整理文件。
+    """
+
+    def __init__(self, directory: str, name: str = "rag", dtype: str = DEFAULT_LOCAL_DTYPE):
+        # 集合名称（与ChromaDB集合的name属性一致）
+        self.name = name
+        self.directory = directory
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "rows.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (slot INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        # 已有数据时以创建时的存储精度为准
+        self.dtype = np.dtype(meta.get("dtype", dtype))
+        # 向量维度在第一次写入时确定
+        self.dim: Optional[int] = int(meta["dim"]) if "dim" in meta else None
+        # 向量文件的代号，每次扩容递增，读取中的旧矩阵不受影响
+        self._generation = int(meta.get("generation", 0))
+        self._vectors: Optional[np.ndarray] = None
+        if self.dim is not None:
+            self._vectors = np.load(self._vectors_path(self._generation), mmap_mode="r+")
+        self._remove_stale_files()
+        # 行号 -> ID/文档/元数据，None表示空位
+        self._ids: List[Optional[str]] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[dict]] = []
+        # ID -> 行号
+        self._slot_of: Dict[str, int] = {}
+        for slot, text_id, document, metadata in self._conn.execute("SELECT slot, id, document, metadata FROM rows"):
+            self._ensure_rows(slot + 1)
+            self._ids[slot] = text_id
+            self._documents[slot] = document
+            self._metadatas[slot] = json.loads(metadata) if metadata else None
+            self._slot_of[text_id] = slot
+        # 有效行的掩码，与向量矩阵的行一一对应
+        self._live = np.zeros(len(self._ids), dtype=bool)
+        self._live[list(self._slot_of.values())] = True
+        # 可复用的空位（已删除的行）
+        self._free = [slot for slot, text_id in enumerate(self._ids) if text_id is None]
+        if self._slot_of:
+            logger.info(f"已打开本地向量库：{directory}，共{len(self._slot_of)}条向量")
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"vectors.{generation}.npy")
+
+    def _remove_stale_files(self):
+        # 清理扩容前的旧向量文件（上次扩容时可能仍被读取而没能删除）
+        current = self._vectors_path(self._generation)
+        for path in glob.glob(os.path.join(self.directory, "vectors.*.npy")):
+            if os.path.abspath(path) != os.path.abspath(current):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _ensure_rows(self, size: int):
+        # 扩展内存中的行列表
+        missing = size - len(self._ids)
+        if missing > 0:
+            self._ids.extend([None] * missing)
+            self._documents.extend([None] * missing)
+            self._metadatas.extend([None] * missing)
+
+    def _set_meta(self, **values):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(key, str(value)) for key, value in values.items()]
+        )
+
+    def _reserve(self, count: int) -> List[int]:
+        """
+        为新写入的向量分配行号：先复用空位，不够时在末尾追加，向量文件容量不足时扩容
+        """
+        slots = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        start = len(self._ids)
+        slots.extend(range(start, start + count - len(slots)))
+        size = max(slots) + 1 if slots else start
+        self._ensure_rows(size)
+        if len(self._live) < size:
+            self._live = np.concatenate([self._live, np.zeros(size - len(self._live), dtype=bool)])
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if size > capacity:
+            new_capacity = max(DEFAULT_INITIAL_CAPACITY, capacity * 2, size)
+            generation = self._generation + 1
+            vectors = np.lib.format.open_memmap(
+                self._vectors_path(generation), mode="w+", dtype=self.dtype, shape=(new_capacity, self.dim)
+            )
+            if self._vectors is not None:
+                vectors[:capacity] = self._vectors
+            vectors.flush()
+            self._set_meta(generation=generation)
+            self._conn.commit()
+            self._vectors, self._generation = vectors, generation
+            # 正在进行的检索仍持有旧矩阵的引用，POSIX系统上删除文件不影响已有的内存映射
+            self._remove_stale_files()
+            logger.debug(f"本地向量库扩容：{capacity} -> {new_capacity}行")
+        return slots
+
+    def _write(self, ids: List[str], embeddings, metadatas: Optional[List[dict]], documents: Optional[List[str]]):
+        # 写入新行或覆盖已有行（调用方持有锁，并保证ids中没有重复）
+        vectors = _normalize(embeddings)
+        if vectors.shape[0] != len(ids):
+            raise ValueError(f"向量数量{vectors.shape[0]}与ID数量{len(ids)}不一致")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._set_meta(dim=self.dim, dtype=self.dtype.name)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度{vectors.shape[1]}与集合的维度{self.dim}不一致")
+        new_ids = [text_id for text_id in ids if text_id not in self._slot_of]
+        new_slots = dict(zip(new_ids, self._reserve(len(new_ids))))
+        slots = [self._slot_of.get(text_id, new_slots.get(text_id)) for text_id in ids]
+        # 先写向量再写SQLite：中途失败时没有记录的行仍是空位
+        self._vectors[slots] = vectors
+        self._vectors.flush()
+        rows = []
+        for idx, (text_id, slot) in enumerate(zip(ids, slots)):
+            document = documents[idx] if documents is not None else self._documents[slot]
+            metadata = metadatas[idx] if metadatas is not None else self._metadatas[slot]
+            rows.append((slot, text_id, document, json.dumps(metadata, ensure_ascii=False) if metadata else None))
+            self._ids[slot], self._documents[slot], self._metadatas[slot] = text_id, document, metadata or None
+            self._slot_of[text_id] = slot
+        self._conn.executemany("INSERT OR REPLACE INTO rows (slot, id, document, metadata) VALUES (?, ?, ?, ?)", rows)
+        self._conn.commit()
+        self._live[slots] = True
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings=None,
+        metadatas: Optional[List[dict]] = None,
+        documents: Optional[List[str]] = None
+    ):
+        """
+        添加向量，已存在的ID跳过（与ChromaDB一致）
+        参数:
+            ids (List[str]): ID列表
+            embeddings: 与ids一一对应的向量
+            metadatas (List[dict], optional): 元数据
+            documents (List[str], optional): 文档
+        异常:
+            ValueError: 没有提供向量（本地引擎不带嵌入函数）或维度不一致
+        """
+        if embeddings is None:
+            raise ValueError("本地向量库需要显式提供embeddings")
+        with self._lock:
+            # 已存在和批内重复的ID只保留第一次出现的位置
+            keep = {}
+            for idx, text_id in enumerate(ids):
+                if text_id not in self._slot_of:
+                    keep.setdefault(text_id, idx)
+            if len(keep) < len(ids):
+                logger.debug(f"本地向量库：跳过{len(ids) - len(keep)}条已存在的ID")
+            if not keep:
+                return
+            positions = list(keep.values())
+            self._write(
+                list(keep),
+                np.asarray(embeddings, dtype=np.float32)[positions],
+                [metadatas[idx] for idx in positions] if metadatas is not None else None,
+                [documents[idx] for idx in positions] if documents is not None else None
+            )
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings=None,
+        metadatas: Optional[List[dict]] = None,
+        documents: Optional[List[str]] = None
+    ):
+        """
+        添加或覆盖向量
+        参数:
+            ids (List[str]): ID列表
+            embeddings: 与ids一一对应的向量
+            metadatas (List[dict], optional): 元数据
+            documents (List[str], optional): 文档
+        异常:
+            ValueError: 没有提供向量或维度不一致
+        """
+        if embeddings is None:
+            raise ValueError("本地向量库需要显式提供embeddings")
+        with self._lock:
+            # 批内重复的ID以最后一次出现为准
+            last = {text_id: idx for idx, text_id in enumerate(ids)}
+            positions = list(last.values())
+            self._write(
+                list(last),
+                np.asarray(embeddings, dtype=np.float32)[positions],
+                [metadatas[idx] for idx in positions] if metadatas is not None else None,
+                [documents[idx] for idx in positions] if documents is not None else None
+            )
+
+    def update(
+        self,
+        ids: List[str],
+        embeddings=None,
+        metadatas: Optional[List[dict]] = None,
+        documents: Optional[List[str]] = None
+    ):
+        """
+        更新已存在的ID，不存在的ID忽略；元数据与原有元数据合并（与ChromaDB一致）
+        参数:
+            ids (List[str]): ID列表
+            embeddings: 新的向量，None表示不修改
+            metadatas (List[dict], optional): 需要修改的元数据字段
+            documents (List[str], optional): 新的文档
+        """
+        with self._lock:
+            positions = [idx for idx, text_id in enumerate(ids) if text_id in self._slot_of]
+            if not positions:
+                return
+            target = [ids[idx] for idx in positions]
+            slots = [self._slot_of[text_id] for text_id in target]
+            if metadatas is not None:
+                merged = [dict(self._metadatas[slot] or {}, **(metadatas[idx] or {})) for idx, slot in zip(positions, slots)]
+            else:
+                merged = None
+            if embeddings is not None:
+                vectors = np.asarray(embeddings, dtype=np.float32)[positions]
+            else:
+                vectors = np.asarray(self._vectors[slots], dtype=np.float32)
+            self._write(target, vectors, merged, [documents[idx] for idx in positions] if documents is not None else None)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None):
+        """
+        删除向量，删除的行留作空位供后续写入复用
+        参数:
+            ids (List[str], optional): ID列表
+            where (dict, optional): 元数据过滤条件，与ids同时提供时取交集
+        """
+        with self._lock:
+            if ids is None and where is None:
+                return
+            targets = self.get(ids=ids, where=where, include=[])["ids"]
+            slots = [self._slot_of.pop(text_id) for text_id in targets]
+            for slot in slots:
+                self._ids[slot] = self._documents[slot] = self._metadatas[slot] = None
+            self._live[slots] = False
+            self._free.extend(slots)
+            self._conn.executemany("DELETE FROM rows WHERE slot = ?", [(slot,) for slot in slots])
+            self._conn.commit()
+
+    def count(self) -> int:
+        """
+        返回:
+            int: 向量条数
+        """
+        return len(self._slot_of)
+
+    def _filter_slots(self, slots: Sequence[int], where: Optional[dict]) -> List[int]:
+        if not where:
+            return list(slots)
+        return [slot for slot in slots if _match(self._metadatas[slot], where)]
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Sequence[str] = _DEFAULT_GET_INCLUDE
+    ) -> dict:
+        """
+        按ID和/或元数据条件读取，未指定ID时按行号顺序返回（分页结果稳定）
+        参数:
+            ids (List[str], optional): ID列表
+            where (dict, optional): 元数据过滤条件
+            limit (int, optional): 最多返回的条数
+            offset (int, optional): 跳过的条数
+            include (Sequence[str]): 返回的字段："documents"、"metadatas"、"embeddings"
+        返回:
+            dict: {"ids": [...], "documents": [...], "metadatas": [...], "embeddings": ...}，未包含的字段为None
+        """
+        with self._lock:
+            if ids is not None:
+                slots = list(dict.fromkeys(self._slot_of[text_id] for text_id in ids if text_id in self._slot_of))
+            else:
+                slots = np.flatnonzero(self._live).tolist()
+            slots = self._filter_slots(slots, where)
+            start = offset or 0
+            slots = slots[start:start + limit] if limit is not None else slots[start:]
+            return {
+                "ids": [self._ids[slot] for slot in slots],
+                "documents": [self._documents[slot] for slot in slots] if "documents" in include else None,
+                "metadatas": [self._metadatas[slot] for slot in slots] if "metadatas" in include else None,
+                "embeddings": (
+                    np.asarray(self._vectors[slots], dtype=np.float32)
+                    if "embeddings" in include and self._vectors is not None else None
+                ),
+            }
+
+    def _scores(self, queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        # 所有查询向量与所有行的内积（余弦相似度），形状为 (查询数, 行数)
+        if vectors.dtype == np.float32:
+            return queries @ vectors.T
+        scores = np.empty((queries.shape[0], vectors.shape[0]), dtype=np.float32)
+        for start in range(0, vectors.shape[0], _SCORE_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + _SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + block.shape[0]] = queries @ block.T
+        return scores
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        where: Optional[dict] = None,
+        include: Sequence[str] = _DEFAULT_QUERY_INCLUDE
+    ) -> dict:
+        """
+        精确的top-k检索：一次矩阵乘法计算所有查询向量与所有行的余弦相似度，再用argpartition取top-k
+        参数:
+            query_embeddings: 一个或多个查询向量
+            n_results (int): 每个查询返回的结果数量
+            where (dict, optional): 元数据过滤条件
+            include (Sequence[str]): 返回的字段："documents"、"metadatas"、"distances"、"embeddings"
+        返回:
+            dict: 与ChromaDB一致的嵌套列表，每个查询一个列表；
+                distances 为单位向量之间的欧氏距离平方（2 - 2 * 余弦相似度），与ChromaDB默认的l2空间一致
+        """
+        queries = _normalize(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        with self._lock:
+            # 在锁内取得当前矩阵和掩码的快照，矩阵乘法在锁外进行，并发检索互不阻塞
+            size = len(self._ids)
+            vectors = self._vectors[:size] if self._vectors is not None else None
+            allowed = self._live[:size].copy()
+            if where:
+                for slot in np.flatnonzero(allowed):
+                    if not _match(self._metadatas[slot], where):
+                        allowed[slot] = False
+            ids, documents, metadatas = self._ids, self._documents, self._metadatas
+        empty = {"ids": [[] for _ in queries]}
+        for field in ("documents", "metadatas", "distances", "embeddings"):
+            empty[field] = [[] for _ in queries] if field in include else None
+        n_candidates = int(allowed.sum())
+        if vectors is None or n_candidates == 0 or n_results <= 0:
+            return empty
+        scores = self._scores(queries, vectors)
+        scores[:, ~allowed] = -np.inf
+        k = min(n_results, n_candidates)
+        # argpartition 只保证前k个是最大的k个，再对这k个排序
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        result = {"ids": [[ids[slot] for slot in row] for row in top.tolist()]}
+        result["documents"] = [[documents[slot] for slot in row] for row in top.tolist()] if "documents" in include else None
+        result["metadatas"] = [[metadatas[slot] for slot in row] for row in top.tolist()] if "metadatas" in include else None
+        result["distances"] = (2.0 - 2.0 * top_scores).tolist() if "distances" in include else None
+        result["embeddings"] = (
+            [np.asarray(vectors[row], dtype=np.float32) for row in top.tolist()] if "embeddings" in include else None
+        )
+        return result
+
+    def close(self):
+        """
+        关闭SQLite连接
+        """
+        with self._lock:
+            self._conn.close()
+
+
+# 向量库引擎名称 -> 打开集合的函数 (集合名称, 数据库路径) -> 集合实例；"chroma" 由registry直接处理
+_STORES: Dict[str, Callable[[str, str], object]] = {}
+
+
+def register_store(name: str, opener: Callable[[str, str], object]):
+    """
+    注册一个向量库引擎，设置环境变量 RAG_VECTOR_STORE 为该名称即可使用
+    参数:
+        name (str): 引擎名称
+        opener (Callable[[str, str], object]): (集合名称, 数据库路径) -> 与ChromaDB集合接口兼容的实例
+    """
+    _STORES[name] = opener
+
+
+def local_store_dir(collection_name: str, path: str) -> str:
+    """
+    本地引擎的集合目录：与ChromaDB数据目录放在一起，每个集合一个子目录
+    参数:
+        collection_name (str): 集合名称
+        path (str): 数据库路径
+    返回:
+        str: 目录路径
+    """
+    return os.path.join(f"{path}_local", collection_name)
+
+
+def open_store(store: str, collection_name: str, path: str):
+    """
+    用指定的引擎打开集合
+    参数:
+        store (str): 引擎名称
+        collection_name (str): 集合名称
+        path (str): 数据库路径
+    返回:
+        与ChromaDB集合接口兼容的实例
+    异常:
+        ValueError: 未注册的引擎
+    """
+    opener = _STORES.get(store)
+    if opener is None:
+        raise ValueError(f"不支持的向量库引擎：{store}，可选：chroma, {', '.join(_STORES)}")
+    return opener(collection_name, path)
+
+
+register_store("local", lambda collection_name, path: LocalVectorStore(local_store_dir(collection_name, path), collection_name))
+
+
+def copy_collection(source, target, batch_size: int = 1000) -> int:
+    """
+    把一个集合的全部数据（ID、文档、元数据、向量）复制到另一个集合，例如从ChromaDB导出到本地引擎
+    参数:
+        source: 源集合
+        target: 目标集合
+        batch_size (int): 每批复制的条数
+    返回:
+        int: 复制的条数
+    """
+    copied = 0
+    offset = 0
+    while True:
+        page = source.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset)
+        ids = page.get("ids") or []
+        if ids:
+            target.upsert(
+                ids=ids,
+                embeddings=np.asarray(page["embeddings"], dtype=np.float32),
+                metadatas=page.get("metadatas"),
+                documents=page.get("documents")
+            )
+            copied += len(ids)
+        if len(ids) < batch_size:
+            break
+        offset += batch_size
+    logger.info(f"已复制{copied}条向量")
+    return copied
+
+
+if __name__ == "__main__":
+    import registry
+    parser = argparse.ArgumentParser(description="在向量库引擎之间复制集合（例如把ChromaDB集合导出到本地引擎）")
+    parser.add_argument("--collection", default="rag")
+    parser.add_argument("--db-path", default=registry.DEFAULT_DB_PATH)
+    parser.add_argument("--source", default="chroma")
+    parser.add_argument("--target", default="local")
+    args = parser.parse_args()
+    count = copy_collection(
+        registry.get_collection(args.collection, args.db_path, store=args.source),
+        registry.get_collection(args.collection, args.db_path, store=args.target)
+    )
+    print(f"已将集合{args.collection}从{args.source}复制到{args.target}：{count}条")